@@ -17,7 +17,7 @@
 import logging
 import os
 import time
-from typing import List
+from typing import List, Literal
 from autorating_utils import (
     EvalInput,
     EvalResults,
@@ -25,21 +25,33 @@ from autorating_utils import (
     format_summary,
     generate_evaluation_report,
 )
-from models.vertex_model import VertexModel, run_tasks_in_parallel
+from models.model import Model
 import pandas as pd
+from typing_extensions import TypedDict  # Pydantic needs it before Python 3.12
+
+
+class HallucinationRating(TypedDict):
+  analysis: str
+  answer: Literal["YES", "NO", "MAYBE"]
+  explanation: str
 
 
 class HallucinationAutorater:
 
-  def __init__(self, model: VertexModel, output_dir: str):
+  def __init__(self, model: Model, output_dir: str):
     self.model = model
     self.output_dir = output_dir
 
   async def rate_hallucination(
-      self, summaries: List[EvalInput], context: str = ""
+      self,
+      summaries: List[EvalInput],
+      context: str = "",
   ):
     """Evaluates the hallucination/fabrication tendency of generated summary statements.
 
+    All statements are handed to the model as one batch, which a model with a
+    batch backend runs as a single offline batch prediction job.
+
     Args:
         summaries: A list of `EvalInput` objects.
         context: optional additional context to provide to the model
@@ -108,27 +120,14 @@ For example:
 """
       prompts.append((prompt, statement, comments))
 
-    # inner function to evaluate a single prompt
-    async def evaluate(prompt_data):
-      prompt, statement, comments = prompt_data
-      start_time_statement = time.perf_counter()
-
-      try:
-        response = await self.model.generate_data(prompt)
-
-      except Exception as e:
-        logging.error(f"Error during LLM call or parsing: {e}")
-        return {
-            "statement": statement,
-            "comments": comments,
-            "has_hallucinations": "NULL",
-            "analysis": "NULL",
-            "explanation": "NULL",
-            "runtime": "NULL",
-        }
-
-      if not response:
+    # inner function to turn a model response into a result row
+    def to_result(statement, comments, response, runtime_sec):
+      if isinstance(response, Exception):
+        logging.error(f"Error during LLM call or parsing: {response}")
+        response = None
+      elif not response:
         logging.warning("Skipping due to invalid response from LLM.")
+      if not response:
         return {
             "statement": statement,
             "comments": comments,
@@ -137,22 +136,28 @@ For example:
             "explanation": "NULL",
             "runtime": "NULL",
         }
-
-      statement_runtime_sec = time.perf_counter() - start_time_statement
-      logging.info(
-          f"STATEMENT hallucination check took {statement_runtime_sec} seconds."
-      )
-
       return {
           "statement": statement,
           "comments": comments,
           "has_hallucinations": response["answer"],
           "analysis": response["analysis"],
           "explanation": response["explanation"],
-          "runtime": f"{statement_runtime_sec:.2f}",
+          "runtime": (
+              f"{runtime_sec:.2f}" if runtime_sec is not None else "NULL"
+          ),
       }
 
-    results = await run_tasks_in_parallel(prompts, evaluate)
+    # The model picks how to run the batch, e.g. concurrent online calls or
+    # an offline batch job, which doesn't time statements one by one
+    responses, runtimes_sec = await self.model.generate_data_batch_timed(
+        [prompt for prompt, _, _ in prompts], HallucinationRating
+    )
+    results = [
+        to_result(statement, comments, response, runtime_sec)
+        for (_, statement, comments), response, runtime_sec in zip(
+            prompts, responses, runtimes_sec
+        )
+    ]
 
     for result in results:
       # add to dataframe
@@ -26,7 +26,7 @@ import pytest
 def mock_model():
   """Fixture to create a mocked VertexModel."""
   model = MagicMock(spec=VertexModel)
-  model.generate_data = AsyncMock()
+  model.generate_data_batch_timed = AsyncMock()
   model.llm = MagicMock()
   model.llm.generate_content_async = AsyncMock()
   return model
@@ -51,11 +51,15 @@ async def test_correctly_process_summaries_and_generate_report(
       EvalInput(summary="Statement 1", source="Comment 1"),
       EvalInput(summary="Statement 2", source="Comment 2"),
   ]
-  mock_model.generate_data.return_value = {
-      "analysis": "Test analysis",
-      "answer": "YES",
-      "explanation": "Test explanation",
-  }
+  mock_model.generate_data_batch_timed.return_value = (
+      [{
+          "analysis": "Test analysis",
+          "answer": "YES",
+          "explanation": "Test explanation",
+      }]
+      * 2,
+      [None, None],
+  )
   mock_model.llm.generate_content_async.return_value.candidates = [
       MagicMock(
           content=MagicMock(
@@ -89,3 +93,30 @@ async def test_correctly_process_summaries_and_generate_report(
     assert "Summary Evaluation Report" in report_content
     assert "Total summary claims: 2" in report_content
     assert "Yes: 100%" in report_content
+
+
+@pytest.mark.asyncio
+async def test_rates_summaries_as_one_batch(mock_model, mock_output_dir):
+  summaries = [
+      EvalInput(summary="Statement 1", source="Comment 1"),
+      EvalInput(summary="Statement 2", source="Comment 2"),
+  ]
+  mock_model.generate_data_batch_timed.return_value = (
+      [
+          {"analysis": "Test analysis", "answer": "NO", "explanation": "NO"},
+          ValueError("Failed to parse"),
+      ],
+      [1.234, 0.5],
+  )
+
+  autorater = HallucinationAutorater(mock_model, mock_output_dir)
+  await autorater.rate_hallucination(summaries)
+
+  mock_model.generate_data_batch_timed.assert_awaited_once()
+  prompts, _ = mock_model.generate_data_batch_timed.call_args.args
+  assert len(prompts) == 2
+  csv_path = os.path.join(mock_output_dir, "hallucination_autoratings.csv")
+  with open(csv_path) as f:
+    csv_content = f.read()
+  assert "Statement 1,Comment 1,NO,Test analysis,NO,1.23" in csv_content
+  assert "Statement 2,Comment 2,NULL,NULL,NULL,NULL" in csv_content
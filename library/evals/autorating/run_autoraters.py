@@ -22,7 +22,10 @@
 # 1. Specifying all flags:
 # python evals/autorating/run_autoraters.py -p your-project-id -l europe-west4 -m gemini-2.0-flash-001 -i evals/summary.csv -o evals/hallucination_results
 
-# 2. Using all default flag values:
+# 2. Sending short prompts to a faster model:
+# python evals/autorating/run_autoraters.py -p your-project-id -m gemini-2.5-pro --fastModel gemini-2.5-flash -i evals/summary.csv
+
+# 3. Using all default flag values:
 # python evals/autorating/run_autoraters.py -p your-project-id -i evals/summary.csv
 
 # Example of input data:
@@ -34,11 +37,10 @@
 
 import argparse
 import asyncio
+import contextlib
 import logging
 
-from autorating_utils import read_csv
-from hallucination_autorater import HallucinationAutorater
-from models.vertex_model import VertexModel
+from models import metrics
 
 
 async def main():
@@ -84,13 +86,87 @@ async def main():
       default="",
       help="Additional context to provide to the model",
   )
+  parser.add_argument(
+      "--metricsFile",
+      default="",
+      help=(
+          "Where to save LLM call metrics at exit, as Prometheus text if the"
+          " file ends in .prom and as JSON otherwise"
+      ),
+  )
+  parser.add_argument(
+      "--fastModel",
+      default="",
+      help=(
+          "If set, Vertex AI model name for short prompts, e.g. claims with"
+          " few source comments. Responses it fails to produce are retried"
+          " with --model"
+      ),
+  )
+  parser.add_argument(
+      "--fastModelMaxTokens",
+      type=int,
+      default=2000,
+      help="The most estimated prompt tokens sent to --fastModel",
+  )
+  parser.add_argument(
+      "--deadlineMin",
+      type=float,
+      default=None,
+      help=(
+          "If set, stop calling the model after this many minutes. Statements"
+          " not rated by then are reported as NULL"
+      ),
+  )
+  parser.add_argument(
+      "--batchGcsUri",
+      default="",
+      help=(
+          "If set, rate all summaries in one offline batch prediction job,"
+          " staging its files under this gs:// URI"
+      ),
+  )
   args = parser.parse_args()
-
-  model = VertexModel(args.gcpProject, args.location, args.model)
+  if args.metricsFile:
+    metrics.default_registry.dump_at_exit(args.metricsFile)
+
+  # Imported after parsing the flags, so --help doesn't wait for the Vertex AI
+  # SDK and pandas to load
+  from autorating_utils import read_csv
+  from hallucination_autorater import HallucinationAutorater
+  from models.batch_prediction import VertexBatchBackend
+  from models.deadline import run_deadline
+  from models.router_model import RouterModel, RoutingRule
+  from models.vertex_model import VertexModel
+
+  def make_model(model_name: str) -> VertexModel:
+    batch_backend = None
+    if args.batchGcsUri:
+      batch_backend = VertexBatchBackend(
+          args.gcpProject, args.location, model_name, args.batchGcsUri
+      )
+    return VertexModel(
+        args.gcpProject, args.location, model_name, batch_backend=batch_backend
+    )
+
+  model = make_model(args.model)
+  if args.fastModel:
+    model = RouterModel(
+        [
+            RoutingRule(
+                make_model(args.fastModel),
+                max_prompt_tokens=args.fastModelMaxTokens,
+            )
+        ],
+        model,
+    )
   autorater = HallucinationAutorater(model, args.outputDir)
   summaries = read_csv(args.inputFile)
 
-  await autorater.rate_hallucination(summaries, args.additionalContext)
+  with contextlib.ExitStack() as stack:
+    if args.deadlineMin is not None:
+      stack.enter_context(run_deadline(args.deadlineMin * 60))
+    await autorater.rate_hallucination(summaries, args.additionalContext)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,480 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Offline batch prediction, for bulk jobs that don't need fast responses.
+
+A batch prediction job runs many prompts outside the online quota, at a lower
+price, and typically finishes within hours. The prompts are written to a JSONL
+file with one keyed request per line, the file is submitted as a single job,
+and the job is polled until it ends. Outputs are matched back to their prompts
+by key, as the service writes them in any order.
+
+`LocalBatchBackend` simulates the service with a `Model`, so the batch path
+can be run and tested without a cloud project.
+"""
+
+import abc
+import asyncio
+import dataclasses
+import enum
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from . import deadline
+from . import executor
+from . import metrics
+from .credentials import SharedCredentials, default_credentials
+from .model import Model
+
+# How long in seconds to wait between two checks of a running job.
+DEFAULT_POLL_INTERVAL_SEC = 30.0
+# How many requests of a job the local backend runs at the same time.
+LOCAL_BATCH_PARALLELISM = 10
+
+BATCH_REQUESTS = metrics.default_registry.counter(
+    "llm_batch_requests_total",
+    "Requests run through offline batch prediction jobs, by outcome.",
+)
+
+
+class BatchJobError(Exception):
+  """A batch prediction job failed or didn't finish in time."""
+
+
+class BatchJobState(str, enum.Enum):
+  """The lifecycle of a batch prediction job."""
+
+  RUNNING = "running"
+  SUCCEEDED = "succeeded"
+  FAILED = "failed"
+
+
+@dataclasses.dataclass
+class BatchOutput:
+  """The response of a batch job to one request."""
+
+  key: str
+  text: Optional[str] = None
+  error: Optional[str] = None
+  input_token_count: int = 0
+  output_token_count: int = 0
+
+  @property
+  def ok(self) -> bool:
+    return self.error is None
+
+
+def make_request(
+    prompt: str,
+    system_prompt: Optional[str] = None,
+    generation_config: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+  """Returns the GenerateContentRequest of a prompt, as a JSON dict."""
+  request: Dict[str, Any] = {
+      "contents": [{"role": "user", "parts": [{"text": prompt}]}]
+  }
+  if system_prompt:
+    request["systemInstruction"] = {"parts": [{"text": system_prompt}]}
+  if generation_config:
+    request["generationConfig"] = generation_config
+  return request
+
+
+def parse_output_line(key: str, line: Dict[str, Any]) -> BatchOutput:
+  """Parses the output line of a request into its text or error."""
+  # Vertex AI reports errors in "status", the Gemini API in "error"
+  error = line.get("status") or line.get("error")
+  if error:
+    return BatchOutput(key, error=str(error))
+  response = line.get("response") or {}
+  usage = response.get("usageMetadata") or {}
+  output = BatchOutput(
+      key,
+      input_token_count=usage.get("promptTokenCount", 0),
+      output_token_count=usage.get("candidatesTokenCount", 0),
+  )
+  candidates = response.get("candidates") or []
+  if not candidates:
+    output.error = f"No candidates in response: {response}"
+    return output
+  candidate = candidates[0]
+  parts = (candidate.get("content") or {}).get("parts") or []
+  if candidate.get("finishReason", "STOP") != "STOP" or not parts:
+    output.error = f"Model stopped generating: {candidate.get('finishReason')}"
+    return output
+  output.text = "".join(part.get("text", "") for part in parts)
+  return output
+
+
+class BatchBackend(abc.ABC):
+  """A service that runs JSONL files of requests as batch prediction jobs."""
+
+  # How long in seconds to wait between two checks of a running job.
+  poll_interval_sec: float = DEFAULT_POLL_INTERVAL_SEC
+
+  def format_line(self, key: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    """Returns the input line of a request."""
+    return {"key": key, "request": request}
+
+  def output_key(self, line: Dict[str, Any]) -> Optional[str]:
+    """Returns the key of the request an output line belongs to."""
+    return line.get("key")
+
+  @abc.abstractmethod
+  async def submit(self, input_path: str) -> str:
+    """Submits the requests in a local JSONL file and returns the job ID."""
+
+  @abc.abstractmethod
+  async def get_state(self, job_id: str) -> BatchJobState:
+    """Returns the current state of a job."""
+
+  @abc.abstractmethod
+  async def read_output(self, job_id: str) -> List[Dict[str, Any]]:
+    """Returns the output lines of a job that succeeded."""
+
+  @abc.abstractmethod
+  async def cancel(self, job_id: str):
+    """Cancels a running job."""
+
+
+async def _cancel(backend: BatchBackend, job_id: str):
+  """Cancels a job that is given up on, so it stops running and billing."""
+  try:
+    await backend.cancel(job_id)
+    logging.info(f"Cancelled batch prediction job {job_id}.")
+  except Exception as e:
+    logging.error(f"Could not cancel batch prediction job {job_id}: {e}")
+
+
+async def run_batch(
+    backend: BatchBackend,
+    requests: Dict[str, Dict[str, Any]],
+    work_dir: Optional[str] = None,
+    poll_interval_sec: Optional[float] = None,
+    timeout_sec: Optional[float] = None,
+) -> Dict[str, BatchOutput]:
+  """Runs requests as one batch prediction job and waits for their outputs.
+
+  Args:
+    backend: The batch prediction service.
+    requests: The GenerateContentRequests to run, by a unique key.
+    work_dir: Where to write the JSONL input file. Defaults to a temporary
+      directory.
+    poll_interval_sec: How long to wait between two checks of the job.
+      Defaults to the backend's `poll_interval_sec`.
+    timeout_sec: How long to wait for the job before giving up, if at all.
+
+  Returns:
+    The output of every request, by key. Requests without an output line get
+    an output with an error.
+
+  Raises:
+    BatchJobError: If the job failed or didn't finish within `timeout_sec`.
+    DeadlineExceededError: If the run deadline passed before the job finished.
+      In both cases, an unfinished job is cancelled first.
+  """
+  with tempfile.TemporaryDirectory() as temp_dir:
+    input_path = os.path.join(
+        work_dir or temp_dir, f"batch_input_{uuid.uuid4().hex}.jsonl"
+    )
+    with open(input_path, "w", encoding="utf-8") as f:
+      for key, request in requests.items():
+        line = backend.format_line(key, request)
+        f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+    start_time = time.monotonic()
+    job_id = await backend.submit(input_path)
+    logging.info(
+        f"Submitted batch prediction job {job_id} with {len(requests)}"
+        " requests."
+    )
+  while (state := await backend.get_state(job_id)) == BatchJobState.RUNNING:
+    elapsed_sec = time.monotonic() - start_time
+    if timeout_sec is not None and elapsed_sec > timeout_sec:
+      await _cancel(backend, job_id)
+      raise BatchJobError(
+          f"Batch prediction job {job_id} didn't finish in {timeout_sec}s."
+      )
+    if deadline.expired():
+      await _cancel(backend, job_id)
+      raise deadline.DeadlineExceededError(
+          f"The run deadline passed before batch prediction job {job_id}"
+          " finished."
+      )
+    await asyncio.sleep(
+        backend.poll_interval_sec
+        if poll_interval_sec is None
+        else poll_interval_sec
+    )
+  if state == BatchJobState.FAILED:
+    BATCH_REQUESTS.inc(len(requests), outcome="job_failed")
+    raise BatchJobError(f"Batch prediction job {job_id} failed.")
+  logging.info(
+      f"Batch prediction job {job_id} finished in"
+      f" {time.monotonic() - start_time:.1f}s."
+  )
+
+  outputs = {}
+  for line in await backend.read_output(job_id):
+    key = backend.output_key(line)
+    if key in requests:
+      outputs[key] = parse_output_line(key, line)
+  for key in requests:
+    if key not in outputs:
+      outputs[key] = BatchOutput(key, error="The job returned no output.")
+    BATCH_REQUESTS.inc(outcome="success" if outputs[key].ok else "error")
+  return outputs
+
+
+class LocalBatchBackend(BatchBackend):
+  """Simulates a batch prediction service by calling a model.
+
+  Jobs run in the background of the event loop, and write their output as
+  JSONL in the format of Vertex AI batch prediction jobs.
+  """
+
+  poll_interval_sec = 0.1
+
+  def __init__(
+      self,
+      model: Model,
+      output_dir: str,
+      parallelism: int = LOCAL_BATCH_PARALLELISM,
+  ):
+    """Initializes the LocalBatchBackend.
+
+    Args:
+      model: The model that answers the requests, with `generate_text`.
+      output_dir: Where to write the output of the jobs.
+      parallelism: How many requests of a job run at the same time.
+    """
+    self.model = model
+    self.output_dir = output_dir
+    self.parallelism = parallelism
+    self._jobs: Dict[str, asyncio.Task] = {}
+
+  async def submit(self, input_path: str) -> str:
+    with open(input_path, encoding="utf-8") as f:
+      lines = [json.loads(line) for line in f if line.strip()]
+    job_id = f"local-{uuid.uuid4().hex}"
+    self._jobs[job_id] = asyncio.create_task(self._run(job_id, lines))
+    return job_id
+
+  async def _respond(self, line: Dict[str, Any]) -> Dict[str, Any]:
+    request = line["request"]
+    texts = [
+        part.get("text", "")
+        for content in [request.get("systemInstruction") or {}] + request[
+            "contents"
+        ]
+        for part in content.get("parts", [])
+    ]
+    text = await self.model.generate_text("\n\n".join(texts))
+    return {
+        "candidates": [{
+            "content": {"role": "model", "parts": [{"text": text}]},
+            "finishReason": "STOP",
+        }],
+        "usageMetadata": {},
+    }
+
+  async def _run(self, job_id: str, lines: List[Dict[str, Any]]):
+    output_path = self._output_path(job_id)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+      async for outcome in executor.stream_tasks(
+          lines, self._respond, limit=self.parallelism, ordered=False
+      ):
+        output_line = dict(outcome.item)
+        if outcome.ok:
+          output_line.update(response=outcome.value, status="")
+        else:
+          output_line["status"] = str(outcome.error)
+        f.write(json.dumps(output_line, ensure_ascii=False) + "\n")
+
+  def _output_path(self, job_id: str) -> str:
+    return os.path.join(self.output_dir, job_id, "predictions.jsonl")
+
+  async def get_state(self, job_id: str) -> BatchJobState:
+    task = self._jobs[job_id]
+    if not task.done():
+      return BatchJobState.RUNNING
+    if task.cancelled() or task.exception():
+      return BatchJobState.FAILED
+    return BatchJobState.SUCCEEDED
+
+  async def read_output(self, job_id: str) -> List[Dict[str, Any]]:
+    with open(self._output_path(job_id), encoding="utf-8") as f:
+      return [json.loads(line) for line in f if line.strip()]
+
+  async def cancel(self, job_id: str):
+    task = self._jobs[job_id]
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+class VertexBatchBackend(BatchBackend):
+  """Runs jobs with Vertex AI batch prediction, staging files in Cloud Storage.
+
+  Vertex AI doesn't pass custom fields through to the output, so the key of a
+  request is sent as one of its labels, which the output echoes.
+  """
+
+  KEY_LABEL = "batch_request_key"
+
+  def __init__(
+      self,
+      project: str,
+      location: str,
+      model_name: str,
+      gcs_uri_prefix: str,
+      credentials: SharedCredentials | None = None,
+  ):
+    """Initializes the VertexBatchBackend.
+
+    Args:
+      project: The GCP project to run the jobs in.
+      location: The GCP location to run the jobs in.
+      model_name: The name of the Vertex AI model to use.
+      gcs_uri_prefix: The "gs://bucket/path" under which input files are
+        uploaded and outputs written.
+      credentials: The credentials to use. Defaults to the application default
+        credentials shared by all models.
+    """
+    self.project = project
+    self.location = location
+    self.model_name = model_name
+    self.gcs_uri_prefix = gcs_uri_prefix.rstrip("/")
+    self.credentials = credentials or default_credentials
+    self._jobs: Dict[str, Any] = {}
+
+  def format_line(self, key: str, request: Dict[str, Any]) -> Dict[str, Any]:
+    return {"request": {**request, "labels": {self.KEY_LABEL: key}}}
+
+  def output_key(self, line: Dict[str, Any]) -> Optional[str]:
+    labels = (line.get("request") or {}).get("labels") or {}
+    return labels.get(self.KEY_LABEL)
+
+  def _storage_client(self):
+    from google.cloud import storage  # Only needed for batch prediction
+
+    return storage.Client(
+        project=self.project, credentials=self.credentials.get()
+    )
+
+  def _submit(self, input_path: str) -> str:
+    import vertexai
+    from vertexai.batch_prediction import BatchPredictionJob
+
+    input_uri = f"{self.gcs_uri_prefix}/{os.path.basename(input_path)}"
+    bucket_name, blob_name = input_uri[len("gs://") :].split("/", 1)
+    self._storage_client().bucket(bucket_name).blob(
+        blob_name
+    ).upload_from_filename(input_path)
+    vertexai.init(
+        project=self.project,
+        location=self.location,
+        credentials=self.credentials.get(),
+    )
+    job = BatchPredictionJob.submit(
+        source_model=self.model_name,
+        input_dataset=input_uri,
+        output_uri_prefix=f"{self.gcs_uri_prefix}/output",
+    )
+    self._jobs[job.resource_name] = job
+    return job.resource_name
+
+  async def submit(self, input_path: str) -> str:
+    return await asyncio.to_thread(self._submit, input_path)
+
+  async def get_state(self, job_id: str) -> BatchJobState:
+    job = self._jobs[job_id]
+    await asyncio.to_thread(job.refresh)
+    if not job.has_ended:
+      return BatchJobState.RUNNING
+    if not job.has_succeeded:
+      logging.error(f"Batch prediction job {job_id} failed: {job.error}")
+      return BatchJobState.FAILED
+    return BatchJobState.SUCCEEDED
+
+  def _read_output(self, job_id: str) -> List[Dict[str, Any]]:
+    output_uri = self._jobs[job_id].output_location
+    bucket_name, prefix = output_uri[len("gs://") :].split("/", 1)
+    lines = []
+    for blob in self._storage_client().list_blobs(bucket_name, prefix=prefix):
+      if blob.name.endswith(".jsonl"):
+        for line in blob.download_as_text().splitlines():
+          if line.strip():
+            lines.append(json.loads(line))
+    return lines
+
+  async def read_output(self, job_id: str) -> List[Dict[str, Any]]:
+    return await asyncio.to_thread(self._read_output, job_id)
+
+  async def cancel(self, job_id: str):
+    await asyncio.to_thread(self._jobs[job_id].cancel)
+
+
+class GenaiBatchBackend(BatchBackend):
+  """Runs jobs with the batch mode of the Gemini API."""
+
+  _STATES = {
+      "JOB_STATE_SUCCEEDED": BatchJobState.SUCCEEDED,
+      "JOB_STATE_PARTIALLY_SUCCEEDED": BatchJobState.SUCCEEDED,
+      "JOB_STATE_FAILED": BatchJobState.FAILED,
+      "JOB_STATE_CANCELLED": BatchJobState.FAILED,
+      "JOB_STATE_EXPIRED": BatchJobState.FAILED,
+  }
+
+  def __init__(self, client: Any, model_name: str):
+    """Initializes the GenaiBatchBackend.
+
+    Args:
+      client: The `genai.Client` to submit jobs with.
+      model_name: The name of the model to use.
+    """
+    self.client = client
+    self.model_name = model_name
+
+  async def submit(self, input_path: str) -> str:
+    uploaded_file = await self.client.aio.files.upload(
+        file=input_path, config={"mime_type": "jsonl"}
+    )
+    job = await self.client.aio.batches.create(
+        model=self.model_name, src=uploaded_file.name
+    )
+    return job.name
+
+  async def get_state(self, job_id: str) -> BatchJobState:
+    job = await self.client.aio.batches.get(name=job_id)
+    return self._STATES.get(job.state.name, BatchJobState.RUNNING)
+
+  async def read_output(self, job_id: str) -> List[Dict[str, Any]]:
+    job = await self.client.aio.batches.get(name=job_id)
+    content = await asyncio.to_thread(
+        self.client.files.download, file=job.dest.file_name
+    )
+    return [
+        json.loads(line)
+        for line in content.decode("utf-8").splitlines()
+        if line.strip()
+    ]
+
+  async def cancel(self, job_id: str):
+    await self.client.aio.batches.cancel(name=job_id)
@@ -0,0 +1,169 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import tempfile
+from typing import List
+import unittest
+from unittest.mock import MagicMock
+
+from models import batch_prediction
+from models import deadline
+from models.credentials import SharedCredentials
+from models.model import Model
+from models.response_cache import ResponseCache
+from models.vertex_model import VertexModel
+import pydantic
+
+
+class _Rating(pydantic.BaseModel):
+  answer: str
+
+
+class _EchoModel(Model):
+  """Answers with JSON echoing the prompt, and fails on prompts with "fail"."""
+
+  def __init__(self):
+    self.prompts: List[str] = []
+
+  async def generate_text(self, prompt: str) -> str:
+    self.prompts.append(prompt)
+    if "fail" in prompt:
+      raise ValueError("Simulated failure")
+    return f'{{"answer": "{prompt}"}}'
+
+  async def generate_data(self, prompt, schema):
+    raise NotImplementedError()
+
+
+class RunBatchTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_outputs_are_mapped_back_by_key(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      backend = batch_prediction.LocalBatchBackend(
+          _EchoModel(), temp_dir, parallelism=2
+      )
+      requests = {
+          key: batch_prediction.make_request(prompt)
+          for key, prompt in [("a", "first"), ("b", "fail"), ("c", "third")]
+      }
+
+      outputs = await batch_prediction.run_batch(backend, requests)
+
+    self.assertEqual(outputs["a"].text, '{"answer": "first"}')
+    self.assertEqual(outputs["c"].text, '{"answer": "third"}')
+    self.assertFalse(outputs["b"].ok)
+    self.assertIn("Simulated failure", outputs["b"].error)
+
+  async def test_failed_job_raises(self):
+    backend = MagicMock(spec=batch_prediction.BatchBackend)
+    backend.format_line.side_effect = lambda key, request: {"key": key}
+    backend.get_state.return_value = batch_prediction.BatchJobState.FAILED
+
+    with self.assertRaises(batch_prediction.BatchJobError):
+      await batch_prediction.run_batch(
+          backend, {"a": batch_prediction.make_request("prompt")}
+      )
+
+  async def test_job_that_times_out_is_cancelled(self):
+    started = asyncio.Event()
+    cancelled = []
+
+    class _HangingModel(_EchoModel):
+
+      async def generate_text(self, prompt: str) -> str:
+        started.set()
+        try:
+          await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+          cancelled.append(prompt)
+          raise
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      backend = batch_prediction.LocalBatchBackend(_HangingModel(), temp_dir)
+      with self.assertRaises(batch_prediction.BatchJobError):
+        await batch_prediction.run_batch(
+            backend,
+            {"a": batch_prediction.make_request("prompt")},
+            poll_interval_sec=0.01,
+            timeout_sec=0.05,
+        )
+
+      (job,) = backend._jobs.values()
+      self.assertTrue(started.is_set())
+      self.assertTrue(job.cancelled())
+      self.assertEqual(cancelled, ["prompt"])
+
+  async def test_job_is_cancelled_when_run_deadline_passes(self):
+    backend = MagicMock(spec=batch_prediction.BatchBackend)
+    backend.format_line.side_effect = lambda key, request: {"key": key}
+    backend.submit.return_value = "job"
+    backend.get_state.return_value = batch_prediction.BatchJobState.RUNNING
+
+    with deadline.run_deadline(0):
+      with self.assertRaises(deadline.DeadlineExceededError):
+        await batch_prediction.run_batch(
+            backend, {"a": batch_prediction.make_request("prompt")}
+        )
+
+    backend.cancel.assert_awaited_once_with("job")
+
+  def test_parse_output_line_reports_blocked_responses(self):
+    output = batch_prediction.parse_output_line(
+        "a", {"response": {"candidates": [{"finishReason": "SAFETY"}]}}
+    )
+
+    self.assertFalse(output.ok)
+    self.assertIn("SAFETY", output.error)
+
+  def test_vertex_backend_sends_key_as_label(self):
+    backend = batch_prediction.VertexBatchBackend(
+        "project", "location", "model", "gs://bucket/batch"
+    )
+
+    line = backend.format_line("key", batch_prediction.make_request("prompt"))
+
+    self.assertEqual(backend.output_key(line), "key")
+
+
+class VertexModelPredictBatchTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_predict_batch_parses_responses_and_uses_cache(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      echo_model = _EchoModel()
+      cache = ResponseCache(os.path.join(temp_dir, "cache.sqlite"))
+      model = VertexModel(
+          "project",
+          "location",
+          "model",
+          response_cache=cache,
+          credentials=MagicMock(spec=SharedCredentials),
+          batch_backend=batch_prediction.LocalBatchBackend(
+              echo_model, temp_dir
+          ),
+      )
+
+      results = await model.predict_batch(["yes", "fail"], _Rating)
+      await model.predict_batch(["yes"], _Rating)
+      cache.close()
+
+    self.assertEqual(results[0], _Rating(answer="yes"))
+    self.assertIsInstance(results[1], Exception)
+    # The second batch was answered from the cache
+    self.assertEqual(echo_model.prompts.count("yes"), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
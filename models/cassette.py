@@ -0,0 +1,58 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Recordings of model calls, for replaying runs offline."""
+
+from typing import Any, Dict, Optional
+
+from .job_journal import JobJournal, job_key
+
+
+def cassette_key(prompt: str, system_prompt: Optional[str] = None) -> str:
+  """Returns the hash a call is recorded under."""
+  return job_key("cassette", prompt, system_prompt)
+
+
+class Cassette(JobJournal):
+  """A JSONL file of model calls: response, latency and token usage by prompt.
+
+  Pass a cassette to `VertexModel` or `GenaiModel` to record every successful
+  call of a real run, and to `FakeModel` to replay them without credentials.
+  """
+
+  def record_call(
+      self,
+      prompt: str,
+      text: str,
+      latency_sec: float,
+      input_tokens: int,
+      output_tokens: int,
+      system_prompt: Optional[str] = None,
+  ):
+    """Records the response to a prompt and what it cost."""
+    self.record(
+        cassette_key(prompt, system_prompt),
+        {
+            "text": text,
+            "latency_sec": latency_sec,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+        },
+    )
+
+  def get_call(
+      self, prompt: str, system_prompt: Optional[str] = None
+  ) -> Optional[Dict[str, Any]]:
+    """Returns the recorded call for a prompt, or None."""
+    return self.get(cassette_key(prompt, system_prompt))
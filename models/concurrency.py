@@ -0,0 +1,142 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Adaptive (AIMD) concurrency control for LLM calls."""
+
+import asyncio
+import contextlib
+import logging
+import time
+from typing import AsyncIterator, Optional
+
+from .model_util import DEFAULT_VERTEX_PARALLELISM
+from .retry_policy import ErrorClass, classify_error
+
+# Weight of the newest latency sample in the moving latency baseline.
+LATENCY_EWMA_WEIGHT = 0.1
+
+
+def is_throttling_error(error: BaseException) -> bool:
+  """Returns whether an API error means the caller is sending too much."""
+  return classify_error(error) == ErrorClass.QUOTA
+
+
+class AdaptiveConcurrencyLimiter:
+  """Limits concurrent calls, adapting the limit with AIMD.
+
+  While calls succeed with stable latency, the limit grows additively by about
+  `increase_step` per limit's worth of successful calls. When a call is
+  throttled (429/RESOURCE_EXHAUSTED) or its latency spikes above
+  `latency_spike_factor` times the moving baseline, the limit is cut
+  multiplicatively by `decrease_factor`. At most one cut happens per baseline
+  latency, so a burst of failures from one overload counts once.
+
+  One limiter can be shared by every caller that hits the same quota.
+  """
+
+  def __init__(
+      self,
+      initial_limit: int = 10,
+      min_limit: int = 1,
+      max_limit: int = DEFAULT_VERTEX_PARALLELISM,
+      increase_step: float = 1.0,
+      decrease_factor: float = 0.5,
+      latency_spike_factor: float = 3.0,
+  ):
+    if not 0 < min_limit <= initial_limit <= max_limit:
+      raise ValueError(
+          "Concurrency limits must satisfy 0 < min_limit <= initial_limit <="
+          " max_limit."
+      )
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.increase_step = increase_step
+    self.decrease_factor = decrease_factor
+    self.latency_spike_factor = latency_spike_factor
+    self._limit = float(initial_limit)
+    self._in_flight = 0
+    self._baseline_latency_sec: Optional[float] = None
+    self._last_decrease_time = float("-inf")
+    self._condition = asyncio.Condition()
+
+  @property
+  def limit(self) -> int:
+    """The current maximum number of concurrent calls."""
+    return int(self._limit)
+
+  @property
+  def in_flight(self) -> int:
+    """The number of calls currently holding a slot."""
+    return self._in_flight
+
+  async def acquire(self):
+    """Waits for a free slot under the current limit."""
+    async with self._condition:
+      await self._condition.wait_for(lambda: self._in_flight < self.limit)
+      self._in_flight += 1
+
+  async def release(
+      self, latency_sec: Optional[float] = None, throttled: bool = False
+  ):
+    """Frees a slot and adapts the limit to the outcome of the call.
+
+    Args:
+      latency_sec: How long a successful call took, or None if the call failed
+        for a reason unrelated to load.
+      throttled: Whether the call was rejected for exceeding the quota.
+    """
+    async with self._condition:
+      self._in_flight -= 1
+      if throttled:
+        self._decrease("throttled")
+      elif latency_sec is not None:
+        self._on_success(latency_sec)
+      self._condition.notify_all()
+
+  @contextlib.asynccontextmanager
+  async def slot(self) -> AsyncIterator[None]:
+    """Holds a slot for the duration of one call and records its outcome."""
+    await self.acquire()
+    start_time = time.perf_counter()
+    try:
+      yield
+    except BaseException as error:
+      await self.release(throttled=is_throttling_error(error))
+      raise
+    await self.release(latency_sec=time.perf_counter() - start_time)
+
+  def _on_success(self, latency_sec: float):
+    baseline = self._baseline_latency_sec
+    if baseline is not None and latency_sec > baseline * (
+        self.latency_spike_factor
+    ):
+      self._decrease(f"latency spike of {latency_sec:.1f}s")
+      return
+    self._baseline_latency_sec = (
+        latency_sec
+        if baseline is None
+        else (1 - LATENCY_EWMA_WEIGHT) * baseline
+        + LATENCY_EWMA_WEIGHT * latency_sec
+    )
+    self._limit = min(
+        float(self.max_limit), self._limit + self.increase_step / self._limit
+    )
+
+  def _decrease(self, reason: str):
+    now = time.monotonic()
+    if now - self._last_decrease_time < (self._baseline_latency_sec or 0):
+      return
+    self._last_decrease_time = now
+    self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+    logging.info(f"Concurrency limit reduced to {self.limit} after a {reason}.")
@@ -0,0 +1,74 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from models.concurrency import AdaptiveConcurrencyLimiter, is_throttling_error
+
+
+class AdaptiveConcurrencyLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+  def test_is_throttling_error(self):
+    self.assertTrue(is_throttling_error(Exception("429 RESOURCE_EXHAUSTED")))
+    self.assertFalse(is_throttling_error(Exception("500 INTERNAL")))
+
+  async def test_limit_increases_additively_on_success(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+
+    # Equal latencies, as empty slots could be timed as latency spikes
+    for _ in range(4):
+      await limiter.acquire()
+      await limiter.release(latency_sec=0.1)
+
+    self.assertEqual(limiter.limit, 3)
+    self.assertEqual(limiter.in_flight, 0)
+
+  async def test_limit_decreases_multiplicatively_on_throttling(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+
+    with self.assertRaises(Exception):
+      async with limiter.slot():
+        raise Exception("429 Too Many Requests")
+    with self.assertRaises(ValueError):
+      async with limiter.slot():
+        raise ValueError("Invalid response")
+
+    self.assertEqual(limiter.limit, 4)
+    self.assertEqual(limiter.in_flight, 0)
+
+  async def test_limit_decreases_on_latency_spike(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    await limiter.acquire()
+    await limiter.release(latency_sec=1.0)
+    await limiter.acquire()
+    await limiter.release(latency_sec=10.0)
+
+    self.assertEqual(limiter.limit, 4)
+
+  async def test_acquire_waits_for_free_slot(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=1, max_limit=1)
+    await limiter.acquire()
+
+    waiter = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+    self.assertFalse(waiter.done())
+
+    await limiter.release(latency_sec=1.0)
+    await waiter
+    self.assertEqual(limiter.in_flight, 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
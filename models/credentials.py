@@ -0,0 +1,101 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Google Cloud credentials shared by all model clients in the process."""
+
+import asyncio
+import datetime
+import logging
+import threading
+
+import google.auth
+from google.auth.credentials import Credentials
+from google.auth.transport.requests import Request as AuthRequest
+from requests.adapters import HTTPAdapter
+import requests
+
+from .model_util import MAX_RETRIES
+
+# Token refreshes are rare and sequential, so a few connections are plenty.
+AUTH_POOL_SIZE = 4
+# How long before the token expires it is refreshed.
+DEFAULT_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def _make_auth_request() -> AuthRequest:
+  """Returns a google-auth transport with a small, reused connection pool."""
+  session = requests.Session()
+  adapter = HTTPAdapter(
+      pool_connections=1,
+      pool_maxsize=AUTH_POOL_SIZE,
+      max_retries=MAX_RETRIES,
+  )
+  session.mount("https://", adapter)
+  return AuthRequest(session=session)
+
+
+def _utcnow() -> datetime.datetime:
+  # google-auth stores the token expiry as a naive UTC datetime
+  return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class SharedCredentials:
+  """Application default credentials that are loaded and refreshed lazily.
+
+  Nothing is loaded until the credentials are first needed, so code paths that
+  never call a model don't need credentials. The token is refreshed
+  `refresh_margin` before it expires, in a worker thread when called from
+  async code, so model calls never block the event loop on a token refresh.
+  """
+
+  def __init__(
+      self, refresh_margin: datetime.timedelta = DEFAULT_REFRESH_MARGIN
+  ):
+    self.refresh_margin = refresh_margin
+    self._credentials: Credentials | None = None
+    self._auth_request: AuthRequest | None = None
+    # Makes concurrent refreshes from worker threads wait for a single one
+    self._lock = threading.Lock()
+
+  def _needs_refresh(self) -> bool:
+    credentials = self._credentials
+    if credentials is None or not credentials.token:
+      return True
+    expiry = credentials.expiry
+    return expiry is not None and expiry - self.refresh_margin <= _utcnow()
+
+  def get(self) -> Credentials:
+    """Returns valid credentials, loading or refreshing them if needed.
+
+    This blocks while credentials are loaded or refreshed. Use `get_async` in
+    async code.
+    """
+    with self._lock:
+      if self._credentials is None:
+        self._credentials, _ = google.auth.default()
+        self._auth_request = _make_auth_request()
+      if self._needs_refresh():
+        logging.info("Refreshing Google Cloud credentials.")
+        self._credentials.refresh(self._auth_request)
+      return self._credentials
+
+  async def get_async(self) -> Credentials:
+    """Returns valid credentials, refreshing them in a worker thread if needed."""
+    if not self._needs_refresh():
+      return self._credentials
+    return await asyncio.to_thread(self.get)
+
+
+# The credentials shared by all models in the process.
+default_credentials = SharedCredentials()
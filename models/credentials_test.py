@@ -0,0 +1,75 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+from models import credentials
+
+
+def _make_google_credentials(expires_in: datetime.timedelta) -> MagicMock:
+  google_credentials = MagicMock()
+  google_credentials.token = "token"
+  google_credentials.expiry = credentials._utcnow() + expires_in
+  return google_credentials
+
+
+class SharedCredentialsTest(unittest.IsolatedAsyncioTestCase):
+
+  def test_nothing_is_loaded_until_first_use(self):
+    with patch.object(credentials.google.auth, "default") as default:
+      credentials.SharedCredentials()
+
+    default.assert_not_called()
+
+  async def test_valid_token_is_not_refreshed(self):
+    google_credentials = _make_google_credentials(datetime.timedelta(hours=1))
+    shared = credentials.SharedCredentials()
+    with patch.object(
+        credentials.google.auth,
+        "default",
+        return_value=(google_credentials, "project"),
+    ):
+      shared.get()
+      google_credentials.refresh.reset_mock()
+
+      self.assertIs(await shared.get_async(), google_credentials)
+      self.assertIs(await shared.get_async(), google_credentials)
+
+    google_credentials.refresh.assert_not_called()
+
+  async def test_token_is_refreshed_ahead_of_expiry(self):
+    google_credentials = _make_google_credentials(datetime.timedelta(hours=1))
+    shared = credentials.SharedCredentials(
+        refresh_margin=datetime.timedelta(minutes=5)
+    )
+    with patch.object(
+        credentials.google.auth,
+        "default",
+        return_value=(google_credentials, "project"),
+    ):
+      shared.get()
+      google_credentials.refresh.reset_mock()
+      google_credentials.expiry = credentials._utcnow() + datetime.timedelta(
+          minutes=2
+      )
+
+      await shared.get_async()
+
+    google_credentials.refresh.assert_called_once()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,132 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-call timeouts and a run-level deadline for model calls.
+
+A run that must finish on a wall-clock budget wraps its work in
+`run_deadline`. Every model call made within it, including from tasks it
+starts, is cut off at the deadline, retries that can't start before it are
+skipped, and queued work is dropped once it has passed. Independently of the
+deadline, each call can have a timeout, so a hung connection can't stall a
+worker forever.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import time
+from typing import Awaitable, Callable, Iterator, Optional, TypeVar
+
+from . import metrics
+
+ResultType = TypeVar("ResultType")
+
+DEADLINE_EXCEEDED = metrics.default_registry.counter(
+    "llm_deadline_exceeded_total",
+    "Model calls cut off or not started because the run deadline passed.",
+)
+
+
+class DeadlineExceededError(asyncio.TimeoutError):
+  """The run deadline passed before a call could finish."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Deadline:
+  """A point in time, on the monotonic clock, by which a run must finish."""
+
+  expires_at: float
+
+  @classmethod
+  def after(cls, budget_sec: float) -> "Deadline":
+    return cls(time.monotonic() + budget_sec)
+
+  def remaining_sec(self) -> float:
+    return max(0.0, self.expires_at - time.monotonic())
+
+  @property
+  def expired(self) -> bool:
+    return self.remaining_sec() <= 0
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = (
+    contextvars.ContextVar("run_deadline", default=None)
+)
+
+
+@contextlib.contextmanager
+def run_deadline(budget_sec: float) -> Iterator[Deadline]:
+  """Bounds the model calls made within the context to `budget_sec` from now.
+
+  An enclosing deadline that passes earlier still applies.
+  """
+  deadline = Deadline.after(budget_sec)
+  enclosing = _current_deadline.get()
+  if enclosing is not None and enclosing.expires_at < deadline.expires_at:
+    deadline = enclosing
+  token = _current_deadline.set(deadline)
+  try:
+    yield deadline
+  finally:
+    _current_deadline.reset(token)
+
+
+def current_deadline() -> Optional[Deadline]:
+  """Returns the deadline of the current run, if it has one."""
+  return _current_deadline.get()
+
+
+def remaining_sec() -> Optional[float]:
+  """Returns how long until the run deadline, or None without a deadline."""
+  deadline = _current_deadline.get()
+  return deadline.remaining_sec() if deadline is not None else None
+
+
+def expired() -> bool:
+  """Returns whether the run deadline, if any, has passed."""
+  deadline = _current_deadline.get()
+  return deadline is not None and deadline.expired
+
+
+async def call_with_timeout(
+    make_call: Callable[[], Awaitable[ResultType]],
+    timeout_sec: Optional[float] = None,
+) -> ResultType:
+  """Runs a call, cutting it off after `timeout_sec` or at the run deadline.
+
+  Args:
+    make_call: Starts the call. It isn't started if the deadline has passed.
+    timeout_sec: The longest the call may take, if limited.
+
+  Raises:
+    asyncio.TimeoutError: If the call took longer than `timeout_sec`.
+    DeadlineExceededError: If the run deadline passed before the call
+      finished.
+  """
+  remaining = remaining_sec()
+  if remaining is not None and remaining <= 0:
+    DEADLINE_EXCEEDED.inc()
+    raise DeadlineExceededError("The run deadline has passed.")
+  if remaining is None or (timeout_sec is not None and timeout_sec < remaining):
+    if timeout_sec is None:
+      return await make_call()
+    return await asyncio.wait_for(make_call(), timeout_sec)
+  try:
+    return await asyncio.wait_for(make_call(), remaining)
+  except asyncio.TimeoutError as e:
+    DEADLINE_EXCEEDED.inc()
+    raise DeadlineExceededError(
+        "The run deadline passed before the call finished."
+    ) from e
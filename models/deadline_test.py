@@ -0,0 +1,90 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+from unittest.mock import AsyncMock
+
+from models import deadline
+
+
+class DeadlineTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_call_without_deadline_or_timeout_runs_to_completion(self):
+    async def make_call():
+      await asyncio.sleep(0.01)
+      return "result"
+
+    self.assertIsNone(deadline.current_deadline())
+    self.assertEqual(await deadline.call_with_timeout(make_call), "result")
+
+  async def test_call_timeout_is_not_a_deadline_error(self):
+    async def make_call():
+      await asyncio.sleep(3600)
+
+    with self.assertRaises(asyncio.TimeoutError) as context:
+      await deadline.call_with_timeout(make_call, timeout_sec=0.01)
+    self.assertNotIsInstance(context.exception, deadline.DeadlineExceededError)
+
+  async def test_run_deadline_cuts_off_calls(self):
+    cancelled = asyncio.Event()
+
+    async def make_call():
+      try:
+        await asyncio.sleep(3600)
+      except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+    with deadline.run_deadline(0.05):
+      with self.assertRaises(deadline.DeadlineExceededError):
+        await deadline.call_with_timeout(make_call, timeout_sec=600)
+
+    self.assertTrue(cancelled.is_set())
+
+  async def test_calls_are_not_started_after_run_deadline(self):
+    make_call = AsyncMock()
+
+    with deadline.run_deadline(0):
+      self.assertTrue(deadline.expired())
+      with self.assertRaises(deadline.DeadlineExceededError):
+        await deadline.call_with_timeout(make_call)
+
+    make_call.assert_not_called()
+    self.assertFalse(deadline.expired())
+
+  async def test_tasks_inherit_the_run_deadline(self):
+    with deadline.run_deadline(60) as run:
+      remaining_sec = await asyncio.create_task(_remaining())
+
+    self.assertLessEqual(remaining_sec, 60)
+    self.assertGreater(remaining_sec, 0)
+    self.assertIsNone(deadline.remaining_sec())
+    self.assertFalse(run.expired)
+
+  def test_enclosing_deadline_that_passes_first_applies(self):
+    with deadline.run_deadline(10) as outer:
+      with deadline.run_deadline(60) as inner:
+        self.assertIs(inner, outer)
+      with deadline.run_deadline(1) as inner:
+        self.assertLess(inner.expires_at, outer.expires_at)
+      self.assertIs(deadline.current_deadline(), outer)
+
+
+async def _remaining():
+  return deadline.remaining_sec()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,191 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Bounded-memory execution of an async function over a stream of items."""
+
+import asyncio
+import contextlib
+import dataclasses
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Set
+
+from . import metrics
+from .concurrency import AdaptiveConcurrencyLimiter
+from .job_journal import JobJournal, job_key
+from .model_util import DEFAULT_VERTEX_PARALLELISM
+
+
+@dataclasses.dataclass
+class Result:
+  """The value returned by the function for one item."""
+
+  index: int
+  item: Any
+  value: Any
+
+  @property
+  def ok(self) -> bool:
+    return True
+
+
+@dataclasses.dataclass
+class Error:
+  """The exception raised by the function for one item."""
+
+  index: int
+  item: Any
+  error: Exception
+
+  @property
+  def ok(self) -> bool:
+    return False
+
+
+async def _iterate(
+    items: Iterable[Any] | AsyncIterable[Any],
+) -> AsyncIterator[Any]:
+  if isinstance(items, AsyncIterable):
+    async for item in items:
+      yield item
+  else:
+    for item in items:
+      yield item
+
+
+async def stream_tasks(
+    items: Iterable[Any] | AsyncIterable[Any],
+    func: Callable,  # func should be an async function: async def func(item, *args, **kwargs)
+    *args: Any,
+    limit: int | AdaptiveConcurrencyLimiter = DEFAULT_VERTEX_PARALLELISM,
+    ordered: bool = True,
+    journal: JobJournal | None = None,
+    **kwargs: Any,
+) -> AsyncIterator[Result | Error]:
+  """Runs `func` on each item, yielding a `Result` or `Error` per item.
+
+  Items are pulled from `items` only when there is room for another task, so
+  at most `limit` tasks exist at any time and a lazy iterable is never read
+  ahead. An exception raised for one item is yielded as its `Error` and doesn't
+  stop the other items.
+
+  Args:
+    items: The items, as a sync or async iterable.
+    func: The async function to run on each item.
+    *args: Extra positional arguments for `func`.
+    limit: The maximum number of tasks in flight, or an adaptive limiter each
+      task holds a slot of. With a limiter, at most its `max_limit` tasks exist.
+    ordered: Whether to yield outcomes in input order. Outcomes that complete
+      ahead of a slow earlier item are held back, and no new items are started
+      while `limit` of them are held back. Otherwise outcomes are yielded as
+      they complete.
+    journal: If given, each successful result is recorded as soon as its task
+      completes, and items already recorded by a previous run with the same
+      function and extra arguments are returned from the journal without
+      calling `func` again. Results must then be JSON-serializable, and items
+      and extra arguments must have a stable representation, see
+      `model_util.fingerprint`. Items without one fail with a TypeError.
+    **kwargs: Extra keyword arguments for `func`.
+
+  Yields:
+    One `Result` or `Error` per item.
+  """
+  if isinstance(limit, AdaptiveConcurrencyLimiter):
+    max_in_flight = limit.max_limit
+    slot = limit.slot
+  else:
+    max_in_flight = limit
+    slot = contextlib.nullcontext
+  # Functions without a name, e.g. partials, can't be journaled
+  func_name = getattr(func, "__qualname__", func)
+  queue_labels = {"queue": "executor"}
+
+  async def run(index: int, item: Any) -> Result | Error:
+    key = None
+    if journal is not None:
+      try:
+        key = job_key(func_name, item, args, kwargs)
+      except TypeError as error:
+        return Error(
+            index, item, TypeError(f"Can't journal item {index}: {error}")
+        )
+      if key in journal:
+        return Result(index, item, journal.get(key))
+
+    metrics.QUEUE_DEPTH.inc(**queue_labels)
+    waiting = True
+    try:
+      async with slot():
+        metrics.QUEUE_DEPTH.dec(**queue_labels)
+        waiting = False
+        with metrics.track_in_flight(**queue_labels):
+          value = await func(item, *args, **kwargs)
+    except Exception as error:
+      return Error(index, item, error)
+    finally:
+      if waiting:
+        metrics.QUEUE_DEPTH.dec(**queue_labels)
+
+    if journal is not None:
+      journal.record(key, value)
+    return Result(index, item, value)
+
+  iterator = _iterate(items)
+  pending: Set[asyncio.Task] = set()
+  # Completed outcomes waiting for an earlier item, in ordered mode
+  held_back: Dict[int, Result | Error] = {}
+  started = 0
+  next_index = 0
+  exhausted = False
+  error_count = 0
+  try:
+    while True:
+      while (
+          not exhausted
+          and len(pending) < max_in_flight
+          and len(held_back) < max_in_flight
+      ):
+        try:
+          item = await anext(iterator)
+        except StopAsyncIteration:
+          exhausted = True
+          break
+        pending.add(asyncio.create_task(run(started, item)))
+        started += 1
+      if not pending:
+        break
+
+      done, pending = await asyncio.wait(
+          pending, return_when=asyncio.FIRST_COMPLETED
+      )
+      for task in sorted(done, key=lambda task: task.result().index):
+        outcome = task.result()
+        if isinstance(outcome, Error):
+          error_count += 1
+          logging.error(f"Task {outcome.index} failed: {outcome.error}")
+        if ordered:
+          held_back[outcome.index] = outcome
+        else:
+          yield outcome
+      while next_index in held_back:
+        yield held_back.pop(next_index)
+        next_index += 1
+  finally:
+    for task in pending:
+      task.cancel()
+    if pending:
+      await asyncio.gather(*pending, return_exceptions=True)
+    await iterator.aclose()
+    logging.info(
+        f"Finished {started - len(pending)} tasks with {error_count} errors."
+    )
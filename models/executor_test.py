@@ -0,0 +1,198 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+from models import executor
+import pydantic
+from models.job_journal import JobJournal
+
+
+class _Claim(pydantic.BaseModel):
+  text: str
+
+
+async def _double(item):
+  if item == 3:
+    raise ValueError("Bad item")
+  # Later items finish first
+  await asyncio.sleep(0.001 * (10 - item))
+  return item * 2
+
+
+class StreamTasksTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_ordered_yields_results_and_errors_in_input_order(self):
+    outcomes = [
+        outcome
+        async for outcome in executor.stream_tasks(range(6), _double, limit=3)
+    ]
+
+    self.assertEqual([outcome.index for outcome in outcomes], list(range(6)))
+    self.assertEqual(
+        [outcome.value for outcome in outcomes if outcome.ok], [0, 2, 4, 8, 10]
+    )
+    self.assertIsInstance(outcomes[3], executor.Error)
+    self.assertIsInstance(outcomes[3].error, ValueError)
+    self.assertEqual(outcomes[3].item, 3)
+
+  async def test_unordered_yields_as_completed(self):
+    may_finish = {item: asyncio.Event() for item in range(3)}
+
+    async def finish_when_allowed(item):
+      await may_finish[item].wait()
+      return item
+
+    may_finish[2].set()
+    completion_order = []
+    async for outcome in executor.stream_tasks(
+        range(3), finish_when_allowed, limit=3, ordered=False
+    ):
+      completion_order.append(outcome.item)
+      if outcome.item:
+        may_finish[outcome.item - 1].set()
+
+    self.assertEqual(completion_order, [2, 1, 0])
+
+  async def test_pulls_items_lazily_and_bounds_tasks_in_flight(self):
+    pulled = []
+    in_flight = 0
+    max_in_flight = 0
+
+    def items():
+      for item in range(20):
+        pulled.append(item)
+        yield item
+
+    async def track(item):
+      nonlocal in_flight, max_in_flight
+      in_flight += 1
+      max_in_flight = max(max_in_flight, in_flight)
+      await asyncio.sleep(0)
+      in_flight -= 1
+      return item
+
+    outcomes = executor.stream_tasks(items(), track, limit=4)
+    first = await anext(outcomes)
+    await outcomes.aclose()
+
+    self.assertEqual(first.value, 0)
+    self.assertLessEqual(len(pulled), 8)
+    self.assertLessEqual(max_in_flight, 4)
+
+  async def test_accepts_async_iterables(self):
+    async def items():
+      for item in (4, 5):
+        yield item
+
+    outcomes = [
+        outcome.value
+        async for outcome in executor.stream_tasks(items(), _double, limit=2)
+    ]
+
+    self.assertEqual(outcomes, [8, 10])
+
+  async def test_closing_the_stream_cancels_running_tasks(self):
+    cancelled = []
+
+    async def wait_forever(item):
+      try:
+        await asyncio.sleep(3600)
+      except asyncio.CancelledError:
+        cancelled.append(item)
+        raise
+
+    async def fail_fast(item):
+      if item == 0:
+        raise ValueError("Fails right away")
+      return await wait_forever(item)
+
+    outcomes = executor.stream_tasks(range(3), fail_fast, limit=3)
+    first = await anext(outcomes)
+    await outcomes.aclose()
+
+    self.assertFalse(first.ok)
+    self.assertCountEqual(cancelled, [1, 2])
+
+
+class JournaledStreamTasksTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.journal = JobJournal(os.path.join(self.temp_dir.name, "journal.jsonl"))
+    self.addCleanup(self.journal.close)
+
+  async def _run(self, items, func, *args, **kwargs):
+    return [
+        outcome
+        async for outcome in executor.stream_tasks(
+            items, func, *args, limit=2, journal=self.journal, **kwargs
+        )
+    ]
+
+  async def test_reuses_results_only_for_the_same_arguments(self):
+    calls = []
+
+    async def scale(item, factor, offset=0):
+      calls.append((item, factor, offset))
+      return item * factor + offset
+
+    await self._run([1, 2], scale, 2)
+    rerun = await self._run([1, 2], scale, 2)
+    other_args = await self._run([1, 2], scale, 3)
+    other_kwargs = await self._run([1, 2], scale, 3, offset=1)
+
+    self.assertEqual([outcome.value for outcome in rerun], [2, 4])
+    self.assertEqual([outcome.value for outcome in other_args], [3, 6])
+    self.assertEqual([outcome.value for outcome in other_kwargs], [4, 7])
+    self.assertEqual(len(calls), 6)
+
+  async def test_journals_distinct_pydantic_items_separately(self):
+    calls = []
+
+    async def read(claim):
+      calls.append(claim.text)
+      return claim.text
+
+    claims = [_Claim(text="a"), _Claim(text="b")]
+    outcomes = await self._run(claims, read)
+    rerun = await self._run(claims, read)
+
+    self.assertEqual([outcome.value for outcome in outcomes], ["a", "b"])
+    self.assertEqual([outcome.value for outcome in rerun], ["a", "b"])
+    self.assertEqual(calls, ["a", "b"])
+    self.assertEqual(len(self.journal), 2)
+
+  async def test_refuses_items_without_stable_representation(self):
+    calls = []
+
+    async def record(item):
+      calls.append(item)
+      return "done"
+
+    outcomes = await self._run([object(), "stable"], record)
+
+    self.assertIsInstance(outcomes[0], executor.Error)
+    self.assertIsInstance(outcomes[0].error, TypeError)
+    self.assertEqual(outcomes[1].value, "done")
+    self.assertEqual(calls, ["stable"])
+    self.assertEqual(len(self.journal), 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,355 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An offline model for benchmarks, profiling and load tests.
+
+`FakeModel` is a `VertexModel` whose client never leaves the process. It
+replays calls recorded in a `Cassette` by real `VertexModel` or `GenaiModel`
+runs, and synthesizes responses for prompts the cassette doesn't have. Latency
+and failures follow a configurable distribution, drawn from a seeded random
+generator. Retries, caching, hedging and concurrency limiting all run the same
+code as with the real model, so they can be load-tested without credentials or
+quota. Its `genai_client` answers the calls of a `GenaiModel` the same way.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import random
+import types
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from google import genai
+from vertexai.generative_models import FinishReason, GenerationConfig
+
+from .cassette import Cassette, cassette_key
+from .credentials import SharedCredentials
+from .retry_policy import ErrorClass
+from .token_estimator import TokenEstimator
+from .vertex_model import VertexModel, _generation_config
+
+# The status code and message of the injected errors, as the API returns them.
+_INJECTED_ERRORS = {
+    ErrorClass.QUOTA: (429, "Resource exhausted. Please try again later."),
+    ErrorClass.TRANSIENT: (503, "UNAVAILABLE: The service is unavailable."),
+    ErrorClass.DEADLINE: (504, "Deadline Exceeded"),
+    ErrorClass.INVALID_ARGUMENT: (
+        400,
+        "INVALID_ARGUMENT: Request contains an invalid argument.",
+    ),
+}
+
+# How many characters of a response each chunk of a streaming call holds.
+STREAM_CHUNK_CHARS = 100
+
+
+class FakeApiError(Exception):
+  """An error injected in place of a failed API call."""
+
+  def __init__(self, code: int, message: str):
+    super().__init__(f"{code} {message}")
+    self.code = code
+
+
+def lognormal_latency(
+    median_sec: float, p95_sec: float
+) -> Callable[[random.Random], float]:
+  """Returns a log-normal latency distribution with the given percentiles."""
+  sigma = math.log(p95_sec / median_sec) / 1.645
+  return lambda rng: rng.lognormvariate(math.log(median_sec), sigma)
+
+
+def example_from_schema(schema: Dict[str, Any]) -> Any:
+  """Returns a minimal value matching a response schema."""
+  if schema.get("enum"):
+    return schema["enum"][0]
+  options = schema.get("any_of") or schema.get("anyOf")
+  if options:
+    return example_from_schema(options[0])
+  schema_type = str(schema.get("type", "object")).lower()
+  if schema_type == "object":
+    return {
+        name: example_from_schema(property_schema)
+        for name, property_schema in schema.get("properties", {}).items()
+    }
+  if schema_type == "array":
+    return [example_from_schema(schema.get("items", {}))]
+  return {
+      "string": "synthetic",
+      "integer": 0,
+      "number": 0.0,
+      "boolean": False,
+  }.get(schema_type)
+
+
+def _make_response(
+    text: str, input_tokens: int, output_tokens: int
+) -> types.SimpleNamespace:
+  """Returns an object shaped like a GenerationResponse."""
+  candidate = types.SimpleNamespace(
+      content=types.SimpleNamespace(parts=[types.SimpleNamespace(text=text)]),
+      finish_reason=FinishReason.STOP,
+  )
+  return types.SimpleNamespace(
+      candidates=[candidate],
+      prompt_feedback=None,
+      text=text,
+      usage_metadata=types.SimpleNamespace(
+          prompt_token_count=input_tokens,
+          candidates_token_count=output_tokens,
+          total_token_count=input_tokens + output_tokens,
+      ),
+  )
+
+
+class _NoCredentials(SharedCredentials):
+
+  def get(self) -> None:
+    return None
+
+  async def get_async(self) -> None:
+    return None
+
+
+class _FakeClient:
+  """Stands in for the GenerativeModel client of a FakeModel."""
+
+  def __init__(self, model: "FakeModel"):
+    self._model = model
+
+  async def generate_content_async(
+      self,
+      prompt: str,
+      generation_config: GenerationConfig | None = None,
+      stream: bool = False,
+  ) -> types.SimpleNamespace | AsyncIterator[types.SimpleNamespace]:
+    if stream:
+      return self._model._fake_stream(prompt, generation_config)
+    return await self._model._fake_call(prompt, generation_config)
+
+
+def _to_generation_config(
+    config: Optional[genai.types.GenerateContentConfig],
+) -> Optional[GenerationConfig]:
+  """Returns the Vertex equivalent of the response format of a GenAI config."""
+  if config is None or not config.response_mime_type:
+    return None
+  schema = config.response_schema
+  if schema is None:
+    return GenerationConfig(response_mime_type=config.response_mime_type)
+  if not isinstance(schema, dict):
+    # Pydantic models and types get the same schema as with a VertexModel
+    return _generation_config(schema)
+  try:
+    return GenerationConfig(
+        response_mime_type=config.response_mime_type, response_schema=schema
+    )
+  except Exception as e:  # The SDK raises various errors on bad schemas
+    logging.debug(f"Can't convert response schema {schema}: {e}")
+    return GenerationConfig(response_mime_type=config.response_mime_type)
+
+
+class _FakeGenaiModels:
+  """Stands in for the `client.aio.models` of a GenaiModel."""
+
+  def __init__(self, model: "FakeModel"):
+    self._model = model
+
+  async def generate_content(
+      self,
+      model: str,
+      contents: str,
+      config: Optional[genai.types.GenerateContentConfig] = None,
+  ) -> types.SimpleNamespace:
+    return await self._model._fake_call(
+        contents,
+        _to_generation_config(config),
+        system_prompt=config.system_instruction if config else None,
+    )
+
+  async def generate_content_stream(
+      self,
+      model: str,
+      contents: str,
+      config: Optional[genai.types.GenerateContentConfig] = None,
+  ) -> AsyncIterator[types.SimpleNamespace]:
+    return self._model._fake_stream(
+        contents,
+        _to_generation_config(config),
+        system_prompt=config.system_instruction if config else None,
+    )
+
+
+class FakeModel(VertexModel):
+  """A VertexModel that replays or synthesizes responses offline."""
+
+  def __init__(
+      self,
+      cassette: Cassette | None = None,
+      latency: Callable[[random.Random], float] = lognormal_latency(2.0, 8.0),
+      throttle_rate: float = 0.0,
+      error_rates: Dict[ErrorClass, float] | None = None,
+      time_scale: float = 1.0,
+      seed: int = 0,
+      strict: bool = False,
+      model_name: str = "fake-model",
+      **kwargs: Any,
+  ):
+    """Initializes the FakeModel.
+
+    Args:
+      cassette: Recorded calls to replay, with their recorded latency.
+      latency: Draws the latency of a synthesized response, in seconds.
+      throttle_rate: The share of calls that fail with a 429 quota error.
+      error_rates: The share of calls that fail with other kinds of errors,
+        e.g. {ErrorClass.TRANSIENT: 0.01}.
+      time_scale: Multiplies all latencies and retry delays, e.g. 0 to run
+        without waiting.
+      seed: Seeds the draws of latencies and failures.
+      strict: Whether a prompt missing from the cassette fails as an invalid
+        request instead of getting a synthesized response.
+      model_name: The model name used in metrics and cache keys.
+      **kwargs: Further arguments of VertexModel, e.g. a concurrency limiter.
+    """
+    super().__init__(
+        "fake-project",
+        "fake-location",
+        model_name,
+        credentials=_NoCredentials(),
+        **kwargs,
+    )
+    self.replay_cassette = cassette
+    self.latency = latency
+    self.error_rates = {ErrorClass.QUOTA: throttle_rate, **(error_rates or {})}
+    unsupported = set(self.error_rates) - set(_INJECTED_ERRORS)
+    if unsupported:
+      raise ValueError(f"Can't inject errors of class {unsupported}.")
+    self.time_scale = time_scale
+    self.retry_delay_sec = self.retry_delay_sec * time_scale
+    self.strict = strict
+    self.token_estimator = TokenEstimator()
+    self.calls = 0
+    self.failures = 0
+    self._random = random.Random(seed)
+
+  def _make_llm(self, location: str, model_name: str) -> _FakeClient:
+    return _FakeClient(self)
+
+  def genai_client(self) -> types.SimpleNamespace:
+    """Returns a client that answers the calls of a GenaiModel like this model.
+
+    Set it as the `client` of a `GenaiModel` to load-test its scheduler, e.g.
+    `genai_model.client = fake.genai_client()`. Only content generation is
+    supported, not embeddings or token counting.
+    """
+    return types.SimpleNamespace(
+        aio=types.SimpleNamespace(models=_FakeGenaiModels(self))
+    )
+
+  def _draw_error(self) -> Optional[ErrorClass]:
+    draw = self._random.random()
+    for error_class, rate in self.error_rates.items():
+      if draw < rate:
+        return error_class
+      draw -= rate
+    return None
+
+  def _synthesize(
+      self, prompt: str, generation_config: GenerationConfig | None
+  ) -> str:
+    config = generation_config.to_dict() if generation_config else {}
+    if config.get("response_schema"):
+      return json.dumps(example_from_schema(config["response_schema"]))
+    if config.get("response_mime_type") == "application/json":
+      return "{}"
+    return f"Synthetic response to a prompt of {len(prompt)} characters."
+
+  async def _fake_call(
+      self,
+      prompt: str,
+      generation_config: GenerationConfig | None,
+      system_prompt: Optional[str] = None,
+  ) -> types.SimpleNamespace:
+    """Answers one call, or fails it as drawn."""
+    text, latency_sec, input_tokens, output_tokens = await self._draw_response(
+        prompt, generation_config, system_prompt
+    )
+    await asyncio.sleep(latency_sec * self.time_scale)
+    return _make_response(text, input_tokens, output_tokens)
+
+  async def _fake_stream(
+      self,
+      prompt: str,
+      generation_config: GenerationConfig | None,
+      system_prompt: Optional[str] = None,
+  ) -> AsyncIterator[types.SimpleNamespace]:
+    """Answers one streaming call in chunks spread over its latency."""
+    text, latency_sec, input_tokens, output_tokens = await self._draw_response(
+        prompt, generation_config, system_prompt
+    )
+    chunks = [
+        text[start : start + STREAM_CHUNK_CHARS]
+        for start in range(0, len(text), STREAM_CHUNK_CHARS)
+    ]
+    for chunk in chunks:
+      await asyncio.sleep(latency_sec * self.time_scale / len(chunks))
+      # Callers read the token usage of the call from the last chunk
+      yield _make_response(chunk, input_tokens, output_tokens)
+
+  async def _draw_response(
+      self,
+      prompt: str,
+      generation_config: GenerationConfig | None,
+      system_prompt: Optional[str] = None,
+  ) -> Tuple[str, float, int, int]:
+    """Returns the text, latency and token usage of a call, or fails it.
+
+    Recorded calls are looked up by prompt and system prompt, as they are
+    recorded.
+    """
+    self.calls += 1
+    error_class = self._draw_error()
+    if error_class:
+      self.failures += 1
+      # Errors come back right away, like a rejected request
+      await asyncio.sleep(0)
+      raise FakeApiError(*_INJECTED_ERRORS[error_class])
+
+    recorded = (
+        self.replay_cassette.get_call(prompt, system_prompt)
+        if self.replay_cassette is not None
+        else None
+    )
+    if recorded:
+      text = recorded["text"]
+      latency_sec = recorded["latency_sec"]
+      input_tokens = recorded["input_tokens"]
+      output_tokens = recorded["output_tokens"]
+    elif self.strict:
+      # Fails like an invalid request, so it isn't retried
+      raise FakeApiError(
+          400,
+          "INVALID_ARGUMENT: No recorded call for prompt"
+          f" {cassette_key(prompt, system_prompt)}.",
+      )
+    else:
+      logging.debug("No recorded call for the prompt, synthesizing one.")
+      text = self._synthesize(prompt, generation_config)
+      latency_sec = self.latency(self._random)
+      input_tokens = self.token_estimator.estimate(
+          prompt + (system_prompt or "")
+      )
+      output_tokens = self.token_estimator.estimate(text)
+    return text, latency_sec, input_tokens, output_tokens
@@ -0,0 +1,196 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+from typing import List, Optional
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from models import fake_model
+from models import genai_model
+from models.cassette import Cassette
+from models.credentials import SharedCredentials
+from models.retry_policy import ErrorClass, classify_error
+from models.vertex_model import VertexModel
+import pandas as pd
+import pydantic
+
+
+class _Claim(pydantic.BaseModel):
+  text: str
+  score: Optional[float] = None
+
+
+class _Topic(pydantic.BaseModel):
+  name: str
+  claims: List[_Claim]
+
+
+def _make_response(text: str) -> MagicMock:
+  response = MagicMock()
+  response.candidates[0].content.parts[0].text = text
+  response.text = text
+  response.usage_metadata.prompt_token_count = 12
+  response.usage_metadata.candidates_token_count = 3
+  return response
+
+
+class FakeModelTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_replays_calls_recorded_by_vertex_model(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cassette_path = os.path.join(temp_dir, "cassette.jsonl")
+      cassette = Cassette(cassette_path)
+      model = VertexModel(
+          "project",
+          "location",
+          "model",
+          credentials=MagicMock(spec=SharedCredentials),
+          cassette=cassette,
+      )
+      model.llm = MagicMock()
+      model.llm.generate_content_async = AsyncMock(
+          return_value=_make_response("recorded text")
+      )
+      await model.generate_text("prompt")
+      cassette.close()
+
+      replay_cassette = Cassette(cassette_path)
+      fake = fake_model.FakeModel(replay_cassette, time_scale=0, strict=True)
+      text = await fake.generate_text("prompt")
+      replay_cassette.close()
+
+    self.assertEqual(text, "recorded text")
+    self.assertEqual(replay_cassette.get_call("prompt")["input_tokens"], 12)
+
+  async def test_replays_calls_recorded_by_genai_model(self):
+    prompts = [{
+        "topic": "Topic",
+        "prompt": "prompt",
+        "allocations": 1,
+        "stats": {"topic": "Topic", "combined_tokens": 100},
+        "system_prompt": "system prompt",
+        "response_mime_type": None,
+        "response_schema": None,
+    }]
+
+    def parse_response(text):
+      return pd.DataFrame([{"proposition": text}])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cassette_path = os.path.join(temp_dir, "cassette.jsonl")
+      cassette = Cassette(cassette_path)
+      with patch.object(genai_model.genai, "Client"):
+        recording_model = genai_model.GenaiModel(
+            "api_key", "model", "embedding_model", cassette=cassette
+        )
+      response = MagicMock(prompt_feedback=None)
+      response.candidates[0].finish_reason.name = "STOP"
+      response.candidates[0].content.parts[0].text = "recorded text"
+      response.usage_metadata = MagicMock(
+          prompt_token_count=12, candidates_token_count=3, total_token_count=15
+      )
+      recording_model.client.aio.models.generate_content = AsyncMock(
+          return_value=response
+      )
+      await recording_model.process_prompts_concurrently(
+          prompts, parse_response, delay_between_calls_seconds=0
+      )
+      cassette.close()
+
+      replay_cassette = Cassette(cassette_path)
+      fake = fake_model.FakeModel(replay_cassette, time_scale=0, strict=True)
+      with patch.object(genai_model.genai, "Client"):
+        replaying_model = genai_model.GenaiModel(
+            "api_key", "model", "embedding_model"
+        )
+      replaying_model.client = fake.genai_client()
+      llm_response, _ = await replaying_model.process_prompts_concurrently(
+          prompts, parse_response, delay_between_calls_seconds=0
+      )
+      replay_cassette.close()
+
+    self.assertEqual(fake.calls, 1)
+    self.assertEqual(
+        list(llm_response["propositions"][0]["proposition"]), ["recorded text"]
+    )
+    self.assertEqual(list(llm_response["token_used"]), [15])
+    # Calls are recorded and replayed under their system prompt
+    self.assertIsNone(replay_cassette.get_call("prompt"))
+
+  async def test_synthesizes_data_matching_the_schema(self):
+    fake = fake_model.FakeModel(time_scale=0)
+
+    topic = await fake.generate_data("prompt", _Topic)
+
+    self.assertIsInstance(topic, _Topic)
+    self.assertEqual(len(topic.claims), 1)
+
+  async def test_injected_throttling_is_retried(self):
+    fake = fake_model.FakeModel(throttle_rate=0.3, time_scale=0, seed=1)
+
+    for _ in range(5):
+      await fake.generate_text("prompt")
+
+    self.assertGreater(fake.failures, 0)
+    self.assertEqual(fake.calls, 5 + fake.failures)
+
+  async def test_strict_replay_fails_for_unknown_prompts(self):
+    fake = fake_model.FakeModel(Cassette(os.devnull), time_scale=0, strict=True)
+
+    with self.assertRaises(Exception):
+      await fake.generate_text("unknown prompt")
+
+    self.assertEqual(fake.calls, 1)
+
+  def test_injected_errors_are_classified_like_api_errors(self):
+    for error_class, (code, message) in fake_model._INJECTED_ERRORS.items():
+      self.assertEqual(
+          classify_error(fake_model.FakeApiError(code, message)), error_class
+      )
+
+  def test_same_seed_draws_same_failures(self):
+    draws = []
+    for _ in range(2):
+      fake = fake_model.FakeModel(
+          error_rates={ErrorClass.TRANSIENT: 0.3}, seed=7
+      )
+      draws.append([fake._draw_error() for _ in range(20)])
+
+    self.assertEqual(draws[0], draws[1])
+    self.assertIn(ErrorClass.TRANSIENT, draws[0])
+
+  async def test_streams_recorded_response_in_chunks(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cassette = Cassette(os.path.join(temp_dir, "cassette.jsonl"))
+      names = ["Parks", "Roads", "Schools", "Housing"]
+      text = json.dumps([{"name": name, "claims": []} for name in names])
+      cassette.record_call("prompt", text, 1.0, 12, 20)
+      model = fake_model.FakeModel(cassette, time_scale=0)
+
+      chunks = [chunk async for chunk in model.generate_text_stream("prompt")]
+      topics = [
+          topic
+          async for topic in model.generate_data_stream("prompt", List[_Topic])
+      ]
+
+    self.assertEqual("".join(chunks), text)
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual([topic.name for topic in topics], names)
+
+
+if __name__ == "__main__":
+  unittest.main()
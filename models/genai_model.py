@@ -17,32 +17,104 @@ This module provides a wrapper around the Google Generative AI API.
 """
 
 import asyncio
+import contextlib
+import hashlib
+import json
 import logging
-import random
-from typing import Any, Callable, Tuple, Dict, List, Optional
+import time
+from typing import Any, AsyncContextManager, AsyncIterator, Callable, Tuple, Dict, Iterable, List, Optional, Sized
 from google import genai
+import numpy as np
 import pandas as pd
+from pydantic import TypeAdapter
+
+from . import batch_prediction
+from .batch_prediction import BatchBackend
+from .cassette import Cassette
+from .concurrency import AdaptiveConcurrencyLimiter
+from . import deadline
+from .hedging import Hedger
+from .job_journal import JobJournal, job_key
+from . import json_repair
+from . import metrics
+from .model_util import BLOCKED_FINISH_REASONS, CALL_TIMEOUT_SEC, JSON_MIME_TYPE
+from .prompt_packing import JobPacker, split_packed_response
+from .rate_limiter import RateLimiter
+from .response_cache import ResponseCache
+from .retry_policy import InvalidResponseError, ResponseBlockedError, RetryPolicy, classify_error
+from .scheduling import MakespanTracker, QueuePolicy, order_jobs
+from .single_flight import SingleFlight
+from . import streaming
+from .token_estimator import TokenEstimator
+from .vertex_model import _to_response_schema, _type_adapter
 
 # The maximum number of times an LLM call should be retried.
 MAX_LLM_RETRIES = 4
 # How long in seconds to wait between LLM calls. This is needed due to per
 # minute limits Vertex AI imposes.
 RETRY_DELAY_SEC = 60
-# How long in seconds to wait before first LLM calls.
+# Shortest time in seconds to wait before retrying a failed LLM call.
 INITIAL_RETRY_DELAY = 60
 # Maximum number of concurrent API calls. By default Genai limits to 10.
 MAX_CONCURRENT_CALLS = 5
+# Maximum number of texts the embedding API accepts in a single request.
+MAX_EMBEDDING_BATCH_SIZE = 100
+# Maximum number of concurrent embedding API calls.
+MAX_CONCURRENT_EMBEDDING_CALLS = 10
+# Maximum number of concurrent token counting API calls.
+MAX_CONCURRENT_TOKEN_COUNT_CALLS = 20
+
+
+def _batch_response_schema(schema: Any) -> Dict[str, Any]:
+  """Returns a response schema as the JSON of a batch request.
+
+  Online calls hand the schema to the SDK, which converts it. Batch requests
+  are written as JSON, so `Schema` objects are dumped, and classes and type
+  hints are converted through their TypeAdapter, like with a VertexModel.
+  """
+  if isinstance(schema, dict):
+    return schema
+  if isinstance(schema, genai.types.Schema):
+    return schema.to_json_dict()
+  return _to_response_schema(_type_adapter(schema).json_schema())
+
+
+async def _get_result(queue: asyncio.Queue, producer: asyncio.Task) -> Any:
+  """Returns the next result of the queue, or raises if the producer failed.
+
+  Without the producer the workers never get their 'None' sentinels, so a
+  failed producer would otherwise leave the consumer waiting forever.
+  """
+  if not producer.done():
+    get = asyncio.ensure_future(queue.get())
+    try:
+      await asyncio.wait({get, producer}, return_when=asyncio.FIRST_COMPLETED)
+      if get.done():
+        return get.result()
+    finally:
+      if not get.done():
+        get.cancel()
+  if not producer.cancelled() and producer.exception():
+    raise producer.exception()
+  return await queue.get()
 
 
 class GenaiModel:
   """A wrapper around the Google Generative AI API."""
 
+  # Longest time in seconds a single API call may take, if limited.
+  call_timeout_sec: Optional[float] = CALL_TIMEOUT_SEC
+
   def __init__(
       self,
       api_key: str,
       model_name: str,
       embedding_model_name: str,
       safety_filters_on: bool = False,
+      response_cache: Optional[ResponseCache] = None,
+      concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+      hedger: Optional[Hedger] = None,
+      cassette: Optional[Cassette] = None,
   ):
     """Initializes the GenaiModel.
 
@@ -50,10 +122,29 @@ class GenaiModel:
       api_key: The Google Generative AI API key.
       model_name: The name of the model to use.
       embedding_model_name: The name of the embedding model to use.
+      safety_filters_on: Whether to block harmful content.
+      response_cache: An optional cache consulted before calling the model.
+      concurrency_limiter: An optional adaptive limiter every model call waits
+        for. It sets how many calls run at once, up to its `max_limit`, and
+        can be shared with other models that use the same quota.
+      hedger: An optional hedger that sends a duplicate of unusually slow
+        calls.
+      cassette: An optional cassette every successful model call is recorded
+        in, to replay the run with `FakeModel`.
     """
     self.client = genai.Client(api_key=api_key)
     self.model = model_name
     self.embedding_model = embedding_model_name
+    self.response_cache = response_cache
+    self.concurrency_limiter = concurrency_limiter
+    self.hedger = hedger
+    self.cassette = cassette
+    self._in_flight = SingleFlight()
+    # Exact token counts by prompt hash, and an estimator calibrated on them
+    self._token_counts: Dict[str, int] = {}
+    self.token_estimator = TokenEstimator()
+    # Predicted versus actual makespan of the last run
+    self.last_makespan_report: Optional[Dict[str, Any]] = None
     self.safety_settings = (
         [
             genai.types.SafetySetting(
@@ -81,178 +172,606 @@ class GenaiModel:
       self,
       worker_id: int,
       queue: asyncio.Queue,
-      results_list: list,
-      stats_list: list,
+      result_queue: asyncio.Queue,
       stop_event: asyncio.Event,
       response_parser: Callable[[str], pd.DataFrame],
+      rate_limiter: Optional[RateLimiter] = None,
+      journal: Optional[JobJournal] = None,
+      makespan_tracker: Optional[MakespanTracker] = None,
   ):
     """
     Consumes jobs from the queue, calls the Gemini API with retry logic,
-    and appends results to shared lists.
+    and puts each successful result on the result queue.
+
+    If a shared `rate_limiter` is given, every attempt first draws its
+    `combined_tokens` from it and the fixed delay between calls is skipped.
+    The worker puts a 'None' on the result queue once it has finished.
     """
     logging.info(f"[Worker-{worker_id}] Started.")
-    while not stop_event.is_set():
-      try:
-        # Use a timeout to periodically check the stop_event
-        job = await asyncio.wait_for(queue.get(), timeout=1.0)
-      except asyncio.TimeoutError:
-        continue  # No job in queue, check stop_event and loop again
-
-      # The 'None' sentinel means the producer is done
-      if job is None:
-        break
+    queue_labels = {"queue": "genai_stream"}
+    try:
+      while not stop_event.is_set():
+        try:
+          # Use a timeout to periodically check the stop_event
+          job = await asyncio.wait_for(queue.get(), timeout=1.0)
+        except asyncio.TimeoutError:
+          continue  # No job in queue, check stop_event and loop again
 
-      topic_num = job["topic_num"]
-      topic = job["topic"]
-      prompt = job["prompt"]
-      allocations = job["allocations"]
-      stats = job["stats"]
-      combined_tokens = stats["combined_tokens"]
-      retry_attempts = job["retry_attempts"]
-      initial_retry_delay = job["initial_retry_delay"]
-      delay_between_calls_seconds = job["delay_between_calls_seconds"]
-      system_prompt = job["system_prompt"]
-      response_mime_type = job["response_mime_type"]
-      response_schema = job["response_schema"]
-
-      # Retry logic
-
-      for attempt in range(retry_attempts):
-        if stop_event.is_set():
-          logging.info(
-              f"[T#{topic_num} Worker-{worker_id}] Stop event received,"
-              " terminating."
-          )
+        # The 'None' sentinel means the producer is done
+        if job is None:
           break
+        metrics.QUEUE_DEPTH.set(queue.qsize(), **queue_labels)
 
-        try:
-          logging.info(
-              f"[T#{topic_num} Worker-{worker_id}] Processing topic '{topic}'"
-              f" (Attempt {attempt + 1})..."
+        start_time = time.perf_counter()
+        with metrics.track_in_flight(**queue_labels):
+          if "packed_jobs" in job:
+            results = await self._process_packed_job(
+                worker_id,
+                job,
+                stop_event,
+                response_parser,
+                rate_limiter,
+                journal,
+            )
+          else:
+            results = [
+                await self._process_job(
+                    worker_id,
+                    job,
+                    stop_event,
+                    response_parser,
+                    rate_limiter,
+                    journal,
+                )
+            ]
+        if makespan_tracker and any(results):
+          makespan_tracker.record(
+              job["stats"]["combined_tokens"], time.perf_counter() - start_time
           )
+        for result_data in results:
+          if result_data:
+            await result_queue.put(result_data)
 
-          # Make the actual API call
-          resp = await self._call_gemini(
-              prompt=prompt,
-              topic=topic,
-              system_prompt=system_prompt,
-              response_mime_type=response_mime_type,
-              response_schema=response_schema,
-          )
-          if not resp or not resp["text"]:
-            raise Exception("Empty response from API")
+        queue.task_done()
+    except Exception as e:
+      logging.error(f"[Worker-{worker_id}] Stopped unexpectedly: {e}")
 
-          extracted_statements_df = response_parser(resp["text"])
+    # Nobody reads the results anymore once the stop event is set
+    if not stop_event.is_set():
+      await result_queue.put(None)
+    logging.info(f"[Worker-{worker_id}] Finished.")
 
-          # On success, process the result and add it to the list
-          result_data = {
-              "topic": topic,
-              "propositions": extracted_statements_df,
-              "allocations": allocations,
-              "token_used": resp["input_token_count"],
-          }
-          results_list.append(result_data)
-          stats_list.append(stats)
+  async def _process_job(
+      self,
+      worker_id: int,
+      job: Dict[str, Any],
+      stop_event: asyncio.Event,
+      response_parser: Callable[[str], pd.DataFrame],
+      rate_limiter: Optional[RateLimiter] = None,
+      journal: Optional[JobJournal] = None,
+  ) -> Optional[Dict[str, Any]]:
+    """Runs a single job with retries, returning its result or None on failure.
+
+    Successful responses are recorded in the `journal`, if given.
+    """
+    topic_num = job["topic_num"]
+    topic = job["topic"]
+    prompt = job["prompt"]
+    stats = job["stats"]
+    combined_tokens = stats["combined_tokens"]
+    retry_attempts = job["retry_attempts"]
+    initial_retry_delay = job["initial_retry_delay"]
+    delay_between_calls_seconds = job["delay_between_calls_seconds"]
+    system_prompt = job["system_prompt"]
+    response_mime_type = job["response_mime_type"]
+    response_schema = job["response_schema"]
 
-          logging.info(
-              f"✅ [T#{topic_num} Worker-{worker_id}] Successfully processed"
-              f" topic '{topic}'."
+    # Retry logic
+    policy = RetryPolicy(
+        max_attempts=retry_attempts, base_delay_sec=initial_retry_delay
+    )
+    delay = None
+
+    for attempt in range(retry_attempts):
+      if stop_event.is_set():
+        logging.info(
+            f"[T#{topic_num} Worker-{worker_id}] Stop event received,"
+            " terminating."
+        )
+        break
+      if deadline.expired():
+        logging.warning(
+            f"[T#{topic_num} Worker-{worker_id}] Run deadline passed,"
+            f" skipping topic '{topic}'."
+        )
+        break
+
+      try:
+        logging.info(
+            f"[T#{topic_num} Worker-{worker_id}] Processing topic '{topic}'"
+            f" (Attempt {attempt + 1})..."
+        )
+
+        if rate_limiter:
+          await deadline.call_with_timeout(
+              lambda: rate_limiter.acquire(combined_tokens)
           )
 
-          # Add a delay after a successful call
+        # Make the actual API call
+        policy.record_attempt(attempt + 1)
+        resp = await self._call_gemini(
+            prompt=prompt,
+            topic=topic,
+            system_prompt=system_prompt,
+            response_mime_type=response_mime_type,
+            response_schema=response_schema,
+        )
+        if not resp or not resp["text"]:
+          raise InvalidResponseError("Empty response from API")
+
+        # On success, process the result
+        result_data = self._build_result(job, resp, response_parser)
+        if journal is not None:
+          journal.record(job["journal_key"], resp)
+
+        logging.info(
+            f"✅ [T#{topic_num} Worker-{worker_id}] Successfully processed"
+            f" topic '{topic}'."
+        )
+
+        # Without a shared rate limiter, add a delay after a successful call
+        if not rate_limiter:
           await asyncio.sleep(delay_between_calls_seconds)
 
-          # Break the retry loop on success
-          break
+        return result_data
 
-        except Exception as e:
+      except Exception as e:
+        logging.error(
+            f"❌ [T#{topic_num} Worker-{worker_id}] Error on topic '{topic}',"
+            f" input_token: {combined_tokens}, attempt {attempt + 1}: {e}"
+        )
+        metric_labels = {
+            "backend": "genai",
+            "model": self.model,
+            "error_class": classify_error(e).value,
+        }
+        delay = policy.next_delay(e, attempt + 1, delay)
+        if delay is None:
+          metrics.LLM_FAILURES.inc(**metric_labels)
           logging.error(
-              f"❌ [T#{topic_num} Worker-{worker_id}] Error on topic '{topic}',"
-              f" input_token: {combined_tokens}, attempt {attempt + 1}: {e}"
+              f"Failed to process topic '{topic}' after {attempt + 1} attempts."
           )
-          if attempt < retry_attempts - 1:
-            # Exponential backoff with a bit of randomness (jitter)
-            delay = (initial_retry_delay**attempt) + random.uniform(0, 1)
-            logging.info(f"   Retrying in {delay:.2f} seconds...")
-            await asyncio.sleep(delay)
-          else:
-            logging.error(
-                f"Failed to process topic '{topic}' after {retry_attempts}"
-                " attempts."
-            )
+          break
+        metrics.LLM_RETRIES.inc(**metric_labels)
+        logging.info(f"   Retrying in {delay:.2f} seconds...")
+        await asyncio.sleep(delay)
 
-      queue.task_done()
+    return None
 
-    logging.info(f"[Worker-{worker_id}] Finished.")
+  async def _process_packed_job(
+      self,
+      worker_id: int,
+      pack: Dict[str, Any],
+      stop_event: asyncio.Event,
+      response_parser: Callable[[str], pd.DataFrame],
+      rate_limiter: Optional[RateLimiter] = None,
+      journal: Optional[JobJournal] = None,
+  ) -> List[Optional[Dict[str, Any]]]:
+    """Runs several packed jobs in a single call.
 
-  async def process_prompts_concurrently(
+    Failed calls are retried with the backoff of the RetryPolicy. If the packed
+    call still fails or its response cannot be split and parsed, each packed
+    job is run on its own, concurrently as far as the concurrency limiter
+    allows.
+    """
+    jobs = pack["packed_jobs"]
+    topic_nums = ", ".join(f"T#{job['topic_num']}" for job in jobs)
+    policy = RetryPolicy(
+        max_attempts=pack["retry_attempts"],
+        base_delay_sec=pack["initial_retry_delay"],
+    )
+    delay = None
+    results = None
+    for attempt in range(pack["retry_attempts"]):
+      if stop_event.is_set() or deadline.expired():
+        return [None] * len(jobs)
+      try:
+        logging.info(
+            f"[{topic_nums} Worker-{worker_id}] Processing {len(jobs)} packed"
+            f" topics in a single call (Attempt {attempt + 1})..."
+        )
+        if rate_limiter:
+          await deadline.call_with_timeout(
+              lambda: rate_limiter.acquire(pack["stats"]["combined_tokens"])
+          )
+
+        policy.record_attempt(attempt + 1)
+        resp = await self._call_gemini(
+            prompt=pack["prompt"],
+            topic=pack["topic"],
+            system_prompt=pack["system_prompt"],
+            response_mime_type=pack["response_mime_type"],
+            response_schema=pack["response_schema"],
+        )
+        if not resp or not resp["text"]:
+          raise InvalidResponseError("Empty response from API")
+      except Exception as e:
+        delay = policy.next_delay(e, attempt + 1, delay)
+        if delay is None:
+          logging.warning(
+              f"[{topic_nums} Worker-{worker_id}] Packed call failed, falling"
+              f" back to individual calls: {e}"
+          )
+          break
+        metrics.LLM_RETRIES.inc(
+            backend="genai",
+            model=self.model,
+            error_class=classify_error(e).value,
+        )
+        logging.warning(
+            f"[{topic_nums} Worker-{worker_id}] Packed call failed, retrying in"
+            f" {delay:.2f} seconds: {e}"
+        )
+        await asyncio.sleep(delay)
+        continue
+
+      try:
+        # Split the tokens used across the jobs by their share of the input
+        total_tokens = max(1, pack["stats"]["combined_tokens"])
+        results = []
+        for job, text in zip(
+            jobs, split_packed_response(resp["text"], len(jobs))
+        ):
+          job_resp = {
+              "text": text,
+              "input_token_count": round(
+                  resp["input_token_count"]
+                  * job["stats"]["combined_tokens"]
+                  / total_tokens
+              ),
+          }
+          results.append((
+              job,
+              job_resp,
+              self._build_result(job, job_resp, response_parser),
+          ))
+      except Exception as e:
+        logging.warning(
+            f"[{topic_nums} Worker-{worker_id}] Could not split the packed"
+            f" response, falling back to individual calls: {e}"
+        )
+        results = None
+      break
+
+    if results is None:
+      # The pack already waited between calls, the individual calls back off
+      # through their own RetryPolicy instead.
+      individual_jobs = [
+          dict(job, delay_between_calls_seconds=0) for job in jobs
+      ]
+
+      async def process(job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return await self._process_job(
+            worker_id, job, stop_event, response_parser, rate_limiter, journal
+        )
+
+      if self.concurrency_limiter:
+        fallback = await asyncio.gather(*map(process, individual_jobs))
+      else:
+        fallback = [await process(job) for job in individual_jobs]
+      if not rate_limiter:
+        await asyncio.sleep(pack["delay_between_calls_seconds"])
+      return list(fallback)
+
+    if journal is not None:
+      for job, job_resp, _ in results:
+        journal.record(job["journal_key"], job_resp)
+    logging.info(
+        f"✅ [{topic_nums} Worker-{worker_id}] Successfully processed"
+        f" {len(jobs)} packed topics."
+    )
+    if not rate_limiter:
+      await asyncio.sleep(pack["delay_between_calls_seconds"])
+    return [result_data for _, _, result_data in results]
+
+  def _build_result(
       self,
-      prompts: List[Dict[str, Any]],
+      job: Dict[str, Any],
+      resp: Dict[str, Any],
+      response_parser: Callable[[str], pd.DataFrame],
+  ) -> Dict[str, Any]:
+    """Parses a model response into the result of a job.
+
+    If the parser rejects a JSON response, the response is repaired locally
+    where possible and parsed again, and the result lists the repairs under
+    "salvaged". Only responses that can't be repaired raise.
+    """
+    text = resp["text"]
+    repairs = []
+    try:
+      propositions = response_parser(text)
+    except Exception as e:
+      if job["response_mime_type"] != JSON_MIME_TYPE:
+        raise
+      try:
+        salvaged = json_repair.repair_json(
+            text, truncated=resp.get("truncated", False)
+        )
+      except ValueError:
+        raise e from None
+      if not salvaged.salvaged:
+        raise
+      propositions = response_parser(
+          json.dumps(salvaged.value, ensure_ascii=False)
+      )
+      repairs = salvaged.repairs
+      json_repair.record_salvage(salvaged, backend="genai", model=self.model)
+
+    result = {
+        "topic": job["topic"],
+        "propositions": propositions,
+        "allocations": job["allocations"],
+        "token_used": resp["input_token_count"],
+        "stats": job["stats"],
+    }
+    if repairs:
+      result["salvaged"] = repairs
+    return result
+
+  async def stream_prompts_concurrently(
+      self,
+      prompts: Iterable[Dict[str, Any]],
       response_parser: Callable[[str], pd.DataFrame],
       max_concurrent_calls: int = MAX_CONCURRENT_CALLS,
       retry_attempts: int = MAX_LLM_RETRIES,
       initial_retry_delay: int = INITIAL_RETRY_DELAY,
       delay_between_calls_seconds: int = RETRY_DELAY_SEC,
-  ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+      requests_per_minute: Optional[int] = None,
+      tokens_per_minute: Optional[int] = None,
+      journal_path: Optional[str] = None,
+      pack_token_budget: Optional[int] = None,
+      queue_policy: QueuePolicy | str = QueuePolicy.FIFO,
+  ) -> AsyncIterator[Dict[str, Any]]:
     """
-    Orchestrates the process of generating prompts and processing them
-    using a queue and concurrent workers.
+    Processes prompts with concurrent workers, yielding each result as soon as
+    its worker finishes it.
+
+    Each yielded dict holds the job's "topic", parsed "propositions",
+    "allocations", "token_used" and input "stats". Jobs that fail after all
+    retries are skipped. Prompts are pulled lazily through a bounded queue, so
+    memory stays flat regardless of the number of prompts.
+
+    When `requests_per_minute` or `tokens_per_minute` is set, all workers share
+    a token-bucket limiter sized to that quota, and each job is charged its
+    `stats["combined_tokens"]` before the call goes out. Otherwise every worker
+    sleeps `delay_between_calls_seconds` after each successful call.
+
+    When `journal_path` is set, every completed job is appended to a journal at
+    that path. A restarted run with the same journal path replays the recorded
+    responses of completed jobs and only calls the model for the remainder.
+
+    When `pack_token_budget` is set, small JSON jobs that share a system prompt
+    and response schema are packed into a single call of up to that many input
+    tokens, and the keyed response is split back into per-job results. Jobs of
+    a pack that fails are retried with individual calls.
+
+    `queue_policy` sets the order in which jobs reach the workers: input order,
+    largest `combined_tokens` first, or shortest first. Running the largest jobs
+    first keeps one big job from running alone at the end of the run. Any policy
+    other than FIFO reads all prompts up front. At the end of the run, a report
+    of predicted versus actual makespan is logged and kept in
+    `last_makespan_report`.
+
+    With a `concurrency_limiter`, there is a worker per slot the limiter can
+    grow to, and the limiter instead of `max_concurrent_calls` sets how many
+    calls run at once. Either way, there are no more workers than prompts if
+    `prompts` has a length.
     """
-    # Queue to hold all the jobs
-    queue: asyncio.Queue = asyncio.Queue()
-    # Lists to aggregate results from all workers
-    final_results: List[Dict] = []
-    final_stats: List[Dict] = []
+    if self.concurrency_limiter:
+      num_workers = self.concurrency_limiter.max_limit
+      expected_concurrency = self.concurrency_limiter.limit
+    else:
+      num_workers = expected_concurrency = max_concurrent_calls
+    if isinstance(prompts, Sized):
+      num_workers = max(1, min(num_workers, len(prompts)))
+    # Bounded queues so neither jobs nor results pile up in memory
+    queue: asyncio.Queue = asyncio.Queue(maxsize=num_workers * 2)
+    result_queue: asyncio.Queue = asyncio.Queue(maxsize=num_workers)
     stop_event = asyncio.Event()
+    rate_limiter = (
+        RateLimiter(requests_per_minute, tokens_per_minute)
+        if requests_per_minute or tokens_per_minute
+        else None
+    )
+    journal = JobJournal(journal_path) if journal_path else None
+    packer = JobPacker(pack_token_budget) if pack_token_budget else None
+    makespan_tracker = MakespanTracker(queue_policy, expected_concurrency)
 
-    # Create and start the worker tasks
+    async def enqueue(job: Dict[str, Any]):
+      makespan_tracker.plan(
+          job["topic_num"] - 1, job["stats"]["combined_tokens"]
+      )
+      await queue.put(job)
+
+    async def produce_jobs():
+      indexed_prompts = enumerate(prompts)
+      if QueuePolicy(queue_policy) != QueuePolicy.FIFO:
+        indexed_prompts = order_jobs(
+            list(indexed_prompts),
+            queue_policy,
+            lambda indexed_prompt: indexed_prompt[1]["stats"][
+                "combined_tokens"
+            ],
+        )
+      for i, prompt_data in indexed_prompts:
+        if stop_event.is_set():
+          logging.info("Stopping generation process.")
+          break
+        if deadline.expired():
+          logging.warning("Run deadline passed, not starting further jobs.")
+          break
+
+        job = {
+            "topic_num": i + 1,
+            "topic": prompt_data["topic"],
+            "prompt": prompt_data["prompt"],
+            "allocations": prompt_data["allocations"],
+            "stats": prompt_data["stats"],
+            "retry_attempts": retry_attempts,
+            "initial_retry_delay": initial_retry_delay,
+            "delay_between_calls_seconds": delay_between_calls_seconds,
+            "system_prompt": prompt_data["system_prompt"],
+            "response_mime_type": prompt_data["response_mime_type"],
+            "response_schema": prompt_data["response_schema"],
+            "journal_key": (
+                job_key(
+                    self.model,
+                    prompt_data["topic"],
+                    prompt_data["prompt"],
+                    prompt_data["system_prompt"],
+                    prompt_data["response_mime_type"],
+                    prompt_data["response_schema"],
+                )
+                if journal is not None
+                else None
+            ),
+        }
+
+        # Replay jobs completed by a previous run instead of calling the model
+        if journal is not None and job["journal_key"] in journal:
+          try:
+            await result_queue.put(
+                self._build_result(
+                    job, journal.get(job["journal_key"]), response_parser
+                )
+            )
+            continue
+          except Exception as e:
+            logging.warning(
+                f"Could not replay journaled topic '{job['topic']}', running"
+                f" it again: {e}"
+            )
+
+        if packer:
+          for ready_job in packer.add(job):
+            await enqueue(ready_job)
+        else:
+          await enqueue(job)
+
+      if packer:
+        for ready_job in packer.flush():
+          await enqueue(ready_job)
+
+      # --- Signal workers to stop once the queue is empty ---
+      for _ in range(num_workers):
+        await queue.put(None)
+
+    # Create and start the producer and worker tasks
+    producer = asyncio.create_task(produce_jobs())
     workers: List[asyncio.Task] = [
         asyncio.create_task(
             self._api_worker_with_retry(
                 i,
                 queue,
-                final_results,
-                final_stats,
+                result_queue,
                 stop_event,
                 response_parser,
+                rate_limiter,
+                journal,
+                makespan_tracker,
             )
         )
-        for i in range(max_concurrent_calls)
+        for i in range(num_workers)
     ]
 
-    for i, prompt_data in enumerate(prompts):
-      if stop_event.is_set():
-        logging.info("Stopping generation process.")
-        break
+    try:
+      finished_workers = 0
+      while finished_workers < num_workers:
+        result_data = await _get_result(result_queue, producer)
+        # Each worker puts a 'None' once it is done
+        if result_data is None:
+          finished_workers += 1
+          continue
+        yield result_data
+    finally:
+      # Stops the workers early if the consumer stopped iterating or failed
+      stop_event.set()
+      producer.cancel()
+      for worker in workers:
+        worker.cancel()
+      await asyncio.gather(producer, *workers, return_exceptions=True)
+      if journal is not None:
+        journal.close()
+      self.last_makespan_report = report = makespan_tracker.report()
+      by_policy = ", ".join(
+          f"{policy} {makespan_sec:.1f}s"
+          for policy, makespan_sec in report[
+              "predicted_makespan_sec_by_policy"
+          ].items()
+      )
+      logging.info(
+          f"Makespan with queue policy '{report['policy']}': predicted"
+          f" {report['predicted_makespan_sec']:.1f}s, actual"
+          f" {report['actual_makespan_sec']:.1f}s. Predicted by policy:"
+          f" {by_policy}."
+      )
+      if self.response_cache:
+        self.response_cache.log_stats()
 
-      job = {
-          "topic_num": i + 1,
-          "topic": prompt_data["topic"],
-          "prompt": prompt_data["prompt"],
-          "allocations": prompt_data["allocations"],
-          "stats": prompt_data["stats"],
-          "retry_attempts": retry_attempts,
-          "initial_retry_delay": initial_retry_delay,
-          "delay_between_calls_seconds": delay_between_calls_seconds,
-          "system_prompt": prompt_data["system_prompt"],
-          "response_mime_type": prompt_data["response_mime_type"],
-          "response_schema": prompt_data["response_schema"],
-      }
-      await queue.put(job)
+  async def process_prompts_concurrently(
+      self,
+      prompts: List[Dict[str, Any]],
+      response_parser: Callable[[str], pd.DataFrame],
+      max_concurrent_calls: int = MAX_CONCURRENT_CALLS,
+      retry_attempts: int = MAX_LLM_RETRIES,
+      initial_retry_delay: int = INITIAL_RETRY_DELAY,
+      delay_between_calls_seconds: int = RETRY_DELAY_SEC,
+      requests_per_minute: Optional[int] = None,
+      tokens_per_minute: Optional[int] = None,
+      journal_path: Optional[str] = None,
+      pack_token_budget: Optional[int] = None,
+      queue_policy: QueuePolicy | str = QueuePolicy.FIFO,
+      batch_backend: Optional[BatchBackend] = None,
+  ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Orchestrates the process of generating prompts and processing them
+    using a queue and concurrent workers.
 
-    # --- Signal workers to stop once the queue is empty ---
-    for _ in range(max_concurrent_calls):
-      await queue.put(None)
+    This collects all results of `stream_prompts_concurrently` into a results
+    DataFrame and a stats DataFrame.
 
-    # --- Wait for all workers to finish their tasks ---
-    try:
-      await asyncio.gather(*workers)
-    except KeyboardInterrupt:
-      logging.info("\nKeyboardInterrupt received. Stopping workers...")
-      stop_event.set()
-      # Wait for workers to finish gracefully
-      await asyncio.gather(*workers, return_exceptions=True)
-      logging.info("Workers stopped.")
+    When `batch_backend` is set, all prompts instead run as a single offline
+    batch prediction job of that backend, which doesn't use the online quota
+    but can take hours. Prompts that fail in the job are skipped.
+    """
+    # Lists to aggregate results from all workers
+    final_results: List[Dict] = []
+    final_stats: List[Dict] = []
+
+    if batch_backend:
+      results = self._process_prompts_in_batch(
+          prompts, response_parser, batch_backend
+      )
+    else:
+      results = self.stream_prompts_concurrently(
+          prompts,
+          response_parser,
+          max_concurrent_calls=max_concurrent_calls,
+          retry_attempts=retry_attempts,
+          initial_retry_delay=initial_retry_delay,
+          delay_between_calls_seconds=delay_between_calls_seconds,
+          requests_per_minute=requests_per_minute,
+          tokens_per_minute=tokens_per_minute,
+          journal_path=journal_path,
+          pack_token_budget=pack_token_budget,
+          queue_policy=queue_policy,
+      )
+    # Closing the results right away stops queued and in-flight calls if this
+    # is cancelled
+    async with contextlib.aclosing(results):
+      async for result_data in results:
+        final_stats.append(result_data.pop("stats"))
+        final_results.append(result_data)
 
     # --- Create final DataFrames from the aggregated results ---
     llm_response = pd.DataFrame(final_results)
@@ -260,6 +779,62 @@ class GenaiModel:
 
     return llm_response, llm_response_stats
 
+  async def _process_prompts_in_batch(
+      self,
+      prompts: Iterable[Dict[str, Any]],
+      response_parser: Callable[[str], pd.DataFrame],
+      batch_backend: BatchBackend,
+  ) -> AsyncIterator[Dict[str, Any]]:
+    """Runs prompts as one batch prediction job, yielding each parsed result."""
+    jobs: Dict[str, Dict[str, Any]] = {}
+    requests = {}
+    for i, prompt_data in enumerate(prompts):
+      generation_config: Dict[str, Any] = {"temperature": 0.0}
+      if prompt_data["response_mime_type"]:
+        generation_config["responseMimeType"] = prompt_data[
+            "response_mime_type"
+        ]
+      if prompt_data["response_schema"]:
+        generation_config["responseSchema"] = _batch_response_schema(
+            prompt_data["response_schema"]
+        )
+      key = str(i)
+      jobs[key] = prompt_data
+      requests[key] = batch_prediction.make_request(
+          prompt_data["prompt"],
+          system_prompt=prompt_data["system_prompt"],
+          generation_config=generation_config,
+      )
+
+    outputs = await batch_prediction.run_batch(batch_backend, requests)
+    for key, job in jobs.items():
+      output = outputs[key]
+      if not output.ok:
+        logging.error(
+            f"❌ Batch request for topic '{job['topic']}' failed:"
+            f" {output.error}"
+        )
+        continue
+      resp = {
+          "text": output.text,
+          "input_token_count": (
+              output.input_token_count + output.output_token_count
+          ),
+      }
+      try:
+        yield self._build_result(job, resp, response_parser)
+      except Exception as e:
+        logging.error(
+            f"❌ Could not parse the batch response for topic '{job['topic']}':"
+            f" {e}"
+        )
+
+  def _call_slot(self) -> AsyncContextManager:
+    """Returns a context holding a concurrency slot for one model call."""
+    if self.concurrency_limiter:
+      return self.concurrency_limiter.slot()
+    return contextlib.nullcontext()
+
   async def _call_gemini(
       self,
       prompt: str,
@@ -277,75 +852,396 @@ class GenaiModel:
       temperature: The temperature to use for the model.
 
     Returns:
-      A dictionary containing the model's response and token count,
-      or None if an error occurred.
+      A dictionary containing the model's response and token count, and
+      "truncated" if a JSON response was cut off by the output token limit,
+      or None if the model returned no usable response.
+
+    Raises:
+      ResponseBlockedError: If the prompt or the response was blocked.
+      Errors of the API call itself, for the caller to classify and retry.
     """
     if not prompt:
       raise ValueError("Prompt must be present to call Gemini.")
 
-    try:
-      response = await self.client.aio.models.generate_content(
-          model=self.model,
-          contents=prompt,
-          config=genai.types.GenerateContentConfig(
-              system_instruction=system_prompt,
-              temperature=temperature,
-              safety_settings=self.safety_settings,
-              response_mime_type=response_mime_type,
-              response_schema=response_schema,
-          ),
-      )
-      if not response.candidates:
-        logging.error("The response from the API contained no candidates.")
-        logging.error("This might be due to a problem with the prompt itself.")
-        try:
-          logging.error(f"Prompt Feedback: {response.prompt_feedback}")
-        except ValueError:
-          pass  # No prompt feedback available
-        return None
-
-      candidate = response.candidates[0]
+    cache_key = ResponseCache.make_key(
+        self.model,
+        prompt,
+        system_prompt=system_prompt,
+        response_schema=response_schema,
+        response_mime_type=response_mime_type,
+        temperature=temperature,
+    )
+    if self.response_cache:
+      cached_response = self.response_cache.get(cache_key)
+      if cached_response is not None:
+        logging.info(f"Using cached response for topic: {topic}")
+        return cached_response
 
-      if candidate.finish_reason.name != "STOP":
-        logging.error(
-            "The model stopped generating for a reason: '%s' for topic: %s",
-            candidate.finish_reason.name,
+    # Concurrent identical calls share a single call and its response
+    return await self._in_flight.run(
+        cache_key,
+        lambda: self._call_gemini_uncached(
+            prompt,
             topic,
+            temperature,
+            system_prompt,
+            response_mime_type,
+            response_schema,
+            cache_key,
+        ),
+        backend="genai",
+        model=self.model,
+    )
+
+  async def _call_gemini_uncached(
+      self,
+      prompt: str,
+      topic: str,
+      temperature: float,
+      system_prompt: Optional[str],
+      response_mime_type: Optional[str],
+      response_schema: Optional[Dict[str, Any]],
+      cache_key: str,
+  ) -> Optional[Dict[str, Any]]:
+    """Makes the call of `_call_gemini`, and caches and records its response."""
+    metric_labels = {"backend": "genai", "model": self.model}
+
+    async def generate_once() -> genai.types.GenerateContentResponse:
+      async with self._call_slot():
+        with metrics.track_llm_call(**metric_labels):
+          # A hung connection fails the attempt instead of stalling it
+          return await deadline.call_with_timeout(
+              lambda: self.client.aio.models.generate_content(
+                  model=self.model,
+                  contents=prompt,
+                  config=genai.types.GenerateContentConfig(
+                      system_instruction=system_prompt,
+                      temperature=temperature,
+                      safety_settings=self.safety_settings,
+                      response_mime_type=response_mime_type,
+                      response_schema=response_schema,
+                  ),
+              ),
+              self.call_timeout_sec,
+          )
+
+    start_time = time.perf_counter()
+    if self.hedger:
+      response = await self.hedger.run(
+          generate_once,
+          is_valid=lambda response: bool(response.candidates),
+          **metric_labels,
+      )
+    else:
+      response = await generate_once()
+    latency_sec = time.perf_counter() - start_time
+    if response.usage_metadata:
+      metrics.record_llm_tokens(
+          response.usage_metadata.prompt_token_count,
+          response.usage_metadata.candidates_token_count,
+          **metric_labels,
+      )
+    if not response.candidates:
+      logging.error("The response from the API contained no candidates.")
+      logging.error("This might be due to a problem with the prompt itself.")
+      prompt_feedback = getattr(response, "prompt_feedback", None)
+      logging.error(f"Prompt Feedback: {prompt_feedback}")
+      if getattr(prompt_feedback, "block_reason", None):
+        raise ResponseBlockedError(
+            f"Prompt blocked: {prompt_feedback.block_reason}"
         )
-        logging.error(f"Safety Ratings: {candidate.safety_ratings}")
-        return None
+      return None
 
-      return {
-          "text": candidate.content.parts[0].text,
-          "input_token_count": response.usage_metadata.total_token_count,
-      }
-    except Exception as e:
+    candidate = response.candidates[0]
+    # A truncated JSON response may still be salvaged by the caller
+    truncated = bool(
+        candidate.finish_reason.name == "MAX_TOKENS"
+        and response_mime_type == JSON_MIME_TYPE
+        and candidate.content
+        and candidate.content.parts
+    )
+
+    if candidate.finish_reason.name != "STOP" and not truncated:
       logging.error(
-          "An unexpected error occurred during content generation: %s", e
+          "The model stopped generating for a reason: '%s' for topic: %s",
+          candidate.finish_reason.name,
+          topic,
       )
+      logging.error(f"Safety Ratings: {candidate.safety_ratings}")
+      if candidate.finish_reason.name in BLOCKED_FINISH_REASONS:
+        raise ResponseBlockedError(
+            f"Response blocked: {candidate.finish_reason.name}"
+        )
       return None
 
-  def call_gemini_embedding(
-      self, texts: List[str]
-  ) -> Optional[List[List[float]]]:
-    """Calls the Gemini embedding model with the given texts.
+    if response.usage_metadata.prompt_token_count:
+      self.token_estimator.observe(
+          prompt + (system_prompt or ""),
+          response.usage_metadata.prompt_token_count,
+      )
+
+    result = {
+        "text": candidate.content.parts[0].text,
+        "input_token_count": response.usage_metadata.total_token_count,
+    }
+    if truncated:
+      logging.warning(
+          f"The response for topic '{topic}' was truncated at the output"
+          " token limit."
+      )
+      # Only truncated responses may be closed after their last complete item
+      result["truncated"] = True
+    else:
+      if self.response_cache:
+        self.response_cache.put(cache_key, result)
+      if self.cassette is not None:
+        self.cassette.record_call(
+            prompt,
+            result["text"],
+            latency_sec,
+            response.usage_metadata.prompt_token_count,
+            response.usage_metadata.candidates_token_count,
+            system_prompt=system_prompt,
+        )
+    return result
+
+  async def generate_text_stream(
+      self,
+      prompt: str,
+      system_prompt: Optional[str] = None,
+      temperature: float = 0.0,
+      response_mime_type: Optional[str] = None,
+      response_schema: Any = None,
+      max_attempts: int = MAX_LLM_RETRIES,
+      initial_retry_delay: float = INITIAL_RETRY_DELAY,
+  ) -> AsyncIterator[str]:
+    """Streams the response text to a single prompt, as the model produces it.
+
+    Failed attempts are retried until the first chunk arrives. An error after
+    that is raised to the caller, which may have used the chunks yielded so
+    far. Streaming calls aren't hedged.
 
     Args:
-      texts: A list of strings to embed.
+      prompt: The prompt to send to the model.
+      system_prompt: An optional system instruction.
+      temperature: The temperature to use for the model.
+      response_mime_type: The MIME type of the response, e.g. JSON.
+      response_schema: The schema the response must match, if any.
+      max_attempts: The maximum number of attempts to start the stream.
+      initial_retry_delay: The shortest delay in seconds before a retry.
 
-    Returns:
-      A list of embeddings, or None if an error occurred.
+    Yields:
+      The chunks of the response text. A cached response is a single chunk.
+
+    Raises:
+      ResponseBlockedError: If the prompt or the response was blocked.
     """
-    try:
-      response = self.client.embed_content(
-          model=self.embedding_model, content=texts
+    cache_key = None
+    if self.response_cache:
+      cache_key = ResponseCache.make_key(
+          self.model,
+          prompt,
+          system_prompt=system_prompt,
+          response_schema=response_schema,
+          response_mime_type=response_mime_type,
+          temperature=temperature,
       )
-      return response["embeddings"][0]
-    except Exception as e:
-      logging.error(
-          "An unexpected error occurred during embedding generation: %s", e
+      cached_response = self.response_cache.get(cache_key)
+      if cached_response is not None:
+        logging.info("Using cached response for streaming call.")
+        yield cached_response["text"]
+        return
+
+    metric_labels = {"backend": "genai", "model": self.model}
+    config = genai.types.GenerateContentConfig(
+        system_instruction=system_prompt,
+        temperature=temperature,
+        safety_settings=self.safety_settings,
+        response_mime_type=response_mime_type,
+        response_schema=response_schema,
+    )
+    policy = RetryPolicy(
+        max_attempts=max_attempts, base_delay_sec=initial_retry_delay
+    )
+    delay = None
+    start_time = time.perf_counter()
+    for attempt in range(1, max_attempts + 1):
+      policy.record_attempt(attempt)
+      try:
+        stream = await streaming.open_stream(
+            lambda: self.client.aio.models.generate_content_stream(
+                model=self.model, contents=prompt, config=config
+            ),
+            self._call_slot(),
+            self.call_timeout_sec,
+            **metric_labels,
+        )
+        break
+      except Exception as e:
+        logging.error(f"Attempt {attempt} to start a stream failed: {e}")
+        error_labels = {**metric_labels, "error_class": classify_error(e).value}
+        delay = policy.next_delay(e, attempt, delay)
+        if delay is None:
+          metrics.LLM_FAILURES.inc(**error_labels)
+          raise
+        metrics.LLM_RETRIES.inc(**error_labels)
+        logging.info(f"   Retrying in {delay:.2f} seconds...")
+        await asyncio.sleep(delay)
+
+    texts = []
+    last_chunk = None
+    finish_reason = None
+    async with contextlib.aclosing(aiter(stream)) as chunks:
+      async for chunk in chunks:
+        last_chunk = chunk
+        block_reason = getattr(chunk.prompt_feedback, "block_reason", None)
+        if block_reason:
+          raise ResponseBlockedError(f"Prompt blocked: {block_reason}")
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+          # Only the last chunk of a response has a finish reason
+          finish_reason = chunk.candidates[0].finish_reason.name
+          if finish_reason in BLOCKED_FINISH_REASONS:
+            raise ResponseBlockedError(f"Response blocked: {finish_reason}")
+        if chunk.text:
+          texts.append(chunk.text)
+          yield chunk.text
+
+    # Usage is reported with the last chunk
+    usage = last_chunk.usage_metadata if last_chunk is not None else None
+    if not usage:
+      return
+    metrics.record_llm_tokens(
+        usage.prompt_token_count, usage.candidates_token_count, **metric_labels
+    )
+    if finish_reason != "STOP":
+      # E.g. truncated at the output token limit, which isn't worth keeping
+      logging.warning(
+          f"The model stopped streaming for a reason: '{finish_reason}'. Not"
+          " caching the response."
       )
-      return None
+      return
+    response_text = "".join(texts)
+    if self.response_cache:
+      self.response_cache.put(
+          cache_key,
+          {"text": response_text, "input_token_count": usage.total_token_count},
+      )
+    if self.cassette is not None:
+      self.cassette.record_call(
+          prompt,
+          response_text,
+          time.perf_counter() - start_time,
+          usage.prompt_token_count,
+          usage.candidates_token_count,
+          system_prompt=system_prompt,
+      )
+
+  async def generate_data_stream(
+      self,
+      prompt: str,
+      schema: Any,
+      system_prompt: Optional[str] = None,
+      temperature: float = 0.0,
+  ) -> AsyncIterator[Any]:
+    """Streams a list response, yielding each element once it is complete.
+
+    Args:
+      prompt: The prompt to send to the model.
+      schema: The list schema to constrain and parse the response with, e.g.
+        `List[Topic]`.
+      system_prompt: An optional system instruction.
+      temperature: The temperature to use for the model.
+
+    Yields:
+      The elements of the list, each validated as the schema's element type.
+
+    Raises:
+      ValueError: If the response isn't a complete list of valid elements.
+        Elements before the error have been yielded already.
+    """
+    item_adapter = TypeAdapter(streaming.list_item_schema(schema))
+    chunks = self.generate_text_stream(
+        prompt,
+        system_prompt=system_prompt,
+        temperature=temperature,
+        response_mime_type=JSON_MIME_TYPE,
+        response_schema=schema,
+    )
+    async with contextlib.aclosing(chunks):
+      async for item in streaming.parse_json_array(chunks, item_adapter):
+        yield item
+
+  async def embed_many(
+      self,
+      texts: List[str],
+      task_type: Optional[str] = None,
+      batch_size: int = MAX_EMBEDDING_BATCH_SIZE,
+      max_concurrent_calls: int = MAX_CONCURRENT_EMBEDDING_CALLS,
+  ) -> np.ndarray:
+    """Embeds all texts using batched, concurrent calls to the embedding model.
+
+    Args:
+      texts: The strings to embed.
+      task_type: The optional embedding task type, e.g. "CLUSTERING".
+      batch_size: How many texts to send per request. Must not exceed the API's
+        maximum batch size.
+      max_concurrent_calls: Maximum number of requests in flight at once.
+
+    Returns:
+      A contiguous float32 matrix with one row per input text, in input order.
+    """
+    if not texts:
+      return np.empty((0, 0), dtype=np.float32)
+
+    batch_size = min(batch_size, MAX_EMBEDDING_BATCH_SIZE)
+    semaphore = asyncio.Semaphore(max_concurrent_calls)
+    config = (
+        genai.types.EmbedContentConfig(task_type=task_type)
+        if task_type
+        else None
+    )
+
+    async def embed_batch(start: int) -> Tuple[int, List[List[float]]]:
+      batch = texts[start : start + batch_size]
+      async with semaphore:
+        response = await deadline.call_with_timeout(
+            lambda: self.client.aio.models.embed_content(
+                model=self.embedding_model, contents=batch, config=config
+            ),
+            self.call_timeout_sec,
+        )
+      if not response.embeddings or len(response.embeddings) != len(batch):
+        raise ValueError(
+            f"Expected {len(batch)} embeddings for texts {start} to"
+            f" {start + len(batch) - 1}, got"
+            f" {len(response.embeddings or [])}."
+        )
+      return start, [embedding.values for embedding in response.embeddings]
+
+    logging.info(
+        f"Embedding {len(texts)} texts in batches of {batch_size} with up to"
+        f" {max_concurrent_calls} concurrent calls..."
+    )
+    embeddings: Optional[np.ndarray] = None
+    tasks = [
+        asyncio.create_task(embed_batch(start))
+        for start in range(0, len(texts), batch_size)
+    ]
+    try:
+      for completed in asyncio.as_completed(tasks):
+        start, values = await completed
+        batch_matrix = np.asarray(values, dtype=np.float32)
+        if embeddings is None:
+          embeddings = np.empty(
+              (len(texts), batch_matrix.shape[1]), dtype=np.float32
+          )
+        embeddings[start : start + len(values)] = batch_matrix
+    finally:
+      # After a failed batch, stop the others from spending further quota
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+    return embeddings
 
   def calculate_token_count_needed(
       self, prompt: str, temperature: float = 0.0
@@ -358,10 +1254,82 @@ class GenaiModel:
     Returns:
       The number of tokens needed for the prompt.
     """
-    return self.client.models.count_tokens(
-        model=self.model,
-        contents=prompt,
-        config=genai.types.GenerateContentConfig(
-            temperature=temperature, safety_settings=self.safety_settings
-        ),
-    ).total_tokens
+    key = self._token_count_key(prompt)
+    if key not in self._token_counts:
+      token_count = self.client.models.count_tokens(
+          model=self.model,
+          contents=prompt,
+          config=genai.types.GenerateContentConfig(
+              temperature=temperature, safety_settings=self.safety_settings
+          ),
+      ).total_tokens
+      self._record_token_count(key, prompt, token_count)
+    return self._token_counts[key]
+
+  async def count_tokens_many(
+      self,
+      prompts: List[str],
+      approximate: bool = False,
+      temperature: float = 0.0,
+      max_concurrent_calls: int = MAX_CONCURRENT_TOKEN_COUNT_CALLS,
+  ) -> List[int]:
+    """Counts the tokens of many prompts concurrently.
+
+    Exact counts are cached by prompt hash, so each distinct prompt is only
+    counted once per model instance. Every exact count also calibrates the
+    local `token_estimator`.
+
+    Args:
+      prompts: The prompts to count tokens for.
+      approximate: If True, estimate all counts locally without calling the
+        API. Good enough for scheduling and budgeting.
+      temperature: The temperature to count tokens with.
+      max_concurrent_calls: Maximum number of count requests in flight.
+
+    Returns:
+      The token count of each prompt, in input order. Prompts whose count
+      request fails get an estimated count.
+    """
+    if approximate:
+      return [self.token_estimator.estimate(prompt) for prompt in prompts]
+
+    semaphore = asyncio.Semaphore(max_concurrent_calls)
+    config = genai.types.GenerateContentConfig(
+        temperature=temperature, safety_settings=self.safety_settings
+    )
+
+    async def count_tokens(key: str, prompt: str):
+      async with semaphore:
+        try:
+          response = await deadline.call_with_timeout(
+              lambda: self.client.aio.models.count_tokens(
+                  model=self.model, contents=prompt, config=config
+              ),
+              self.call_timeout_sec,
+          )
+        except Exception as e:
+          logging.warning(f"Token count failed, using an estimate: {e}")
+          return
+      self._record_token_count(key, prompt, response.total_tokens)
+
+    keys = [self._token_count_key(prompt) for prompt in prompts]
+    # Count each distinct uncached prompt once
+    missing = {
+        key: prompt
+        for key, prompt in zip(keys, prompts)
+        if key not in self._token_counts
+    }
+    await asyncio.gather(
+        *[count_tokens(key, prompt) for key, prompt in missing.items()]
+    )
+    return [
+        self._token_counts.get(key, self.token_estimator.estimate(prompt))
+        for key, prompt in zip(keys, prompts)
+    ]
+
+  def _token_count_key(self, prompt: str) -> str:
+    return hashlib.sha256(f"{self.model}\n{prompt}".encode("utf-8")).hexdigest()
+
+  def _record_token_count(self, key: str, prompt: str, token_count: int):
+    self._token_counts[key] = token_count
+    self.token_estimator.observe(prompt, token_count)
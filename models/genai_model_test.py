@@ -0,0 +1,611 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from models import batch_prediction
+from models.concurrency import AdaptiveConcurrencyLimiter
+from models import deadline
+from models import genai_model
+from models import retry_policy
+import numpy as np
+import pandas as pd
+import pydantic
+
+
+def _make_genai_model(**kwargs) -> genai_model.GenaiModel:
+  with patch.object(genai_model.genai, "Client"):
+    return genai_model.GenaiModel(
+        "api_key", "model", "embedding_model", **kwargs
+    )
+
+
+def _make_prompts(count: int) -> list[dict]:
+  return [
+      {
+          "topic": f"Topic {i}",
+          "prompt": f"Prompt {i}",
+          "allocations": i,
+          "stats": {"topic": f"Topic {i}", "combined_tokens": 100},
+          "system_prompt": "System prompt",
+          "response_mime_type": "application/json",
+          "response_schema": None,
+      }
+      for i in range(count)
+  ]
+
+
+def _parse_response(text: str) -> pd.DataFrame:
+  return pd.DataFrame([{"proposition": text}])
+
+
+class GenaiModelTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_stream_prompts_concurrently_yields_each_result(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        side_effect=lambda prompt, **kwargs: {
+            "text": f"Response to {prompt}",
+            "input_token_count": 10,
+        }
+    )
+
+    results = [
+        result
+        async for result in model.stream_prompts_concurrently(
+            _make_prompts(5),
+            _parse_response,
+            max_concurrent_calls=2,
+            delay_between_calls_seconds=0,
+        )
+    ]
+
+    self.assertCountEqual(
+        [result["topic"] for result in results],
+        [f"Topic {i}" for i in range(5)],
+    )
+    for result in results:
+      self.assertEqual(result["token_used"], 10)
+      self.assertEqual(result["stats"]["combined_tokens"], 100)
+
+  async def test_stream_prompts_concurrently_stops_when_consumer_stops(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        return_value={"text": "Response", "input_token_count": 10}
+    )
+
+    stream = model.stream_prompts_concurrently(
+        _make_prompts(100),
+        _parse_response,
+        max_concurrent_calls=2,
+        delay_between_calls_seconds=0,
+    )
+    async for _ in stream:
+      break
+    await stream.aclose()
+
+    self.assertLess(model._call_gemini.call_count, 100)
+
+  async def test_process_prompts_concurrently_raises_for_malformed_prompt(
+      self,
+  ):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock()
+
+    with self.assertRaises(KeyError):
+      await asyncio.wait_for(
+          model.process_prompts_concurrently(
+              [{"topic": "t", "prompt": "p"}],
+              _parse_response,
+              delay_between_calls_seconds=0,
+          ),
+          timeout=5,
+      )
+    model._call_gemini.assert_not_called()
+
+  async def test_concurrency_limiter_sets_number_of_concurrent_calls(self):
+    model = _make_genai_model(
+        concurrency_limiter=AdaptiveConcurrencyLimiter(
+            initial_limit=3, max_limit=3
+        )
+    )
+    in_flight = 0
+    peak_in_flight = 0
+
+    async def call_gemini(prompt, **kwargs):
+      nonlocal in_flight, peak_in_flight
+      async with model._call_slot():
+        in_flight += 1
+        peak_in_flight = max(peak_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+      return {"text": "Response", "input_token_count": 10}
+
+    model._call_gemini = call_gemini
+
+    llm_response, _ = await model.process_prompts_concurrently(
+        _make_prompts(9),
+        _parse_response,
+        max_concurrent_calls=1,
+        delay_between_calls_seconds=0,
+    )
+
+    self.assertEqual(len(llm_response), 9)
+    self.assertEqual(peak_in_flight, 3)
+
+  async def test_concurrency_limiter_starts_no_more_workers_than_prompts(self):
+    model = _make_genai_model(
+        concurrency_limiter=AdaptiveConcurrencyLimiter(
+            initial_limit=3, max_limit=1000
+        )
+    )
+    model._call_gemini = AsyncMock(
+        return_value={"text": "Response", "input_token_count": 10}
+    )
+    worker_ids = []
+    run_worker = model._api_worker_with_retry
+
+    async def counting_worker(worker_id, *args):
+      worker_ids.append(worker_id)
+      await run_worker(worker_id, *args)
+
+    model._api_worker_with_retry = counting_worker
+
+    llm_response, _ = await model.process_prompts_concurrently(
+        _make_prompts(2), _parse_response, delay_between_calls_seconds=0
+    )
+
+    self.assertEqual(len(llm_response), 2)
+    self.assertEqual(worker_ids, [0, 1])
+
+  async def test_process_prompts_concurrently_returns_dataframes(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        side_effect=[
+            None,
+            {"text": "Response", "input_token_count": 10},
+            {"text": "Response", "input_token_count": 10},
+        ]
+    )
+
+    with patch.object(genai_model.asyncio, "sleep", AsyncMock()):
+      llm_response, llm_response_stats = (
+          await model.process_prompts_concurrently(
+              _make_prompts(2),
+              _parse_response,
+              max_concurrent_calls=1,
+              initial_retry_delay=0,
+              delay_between_calls_seconds=0,
+          )
+      )
+
+    self.assertEqual(list(llm_response["topic"]), ["Topic 0", "Topic 1"])
+    self.assertNotIn("stats", llm_response.columns)
+    self.assertEqual(list(llm_response_stats["combined_tokens"]), [100, 100])
+
+  async def test_process_prompts_concurrently_in_batch_job(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock()
+    prompt_model = MagicMock()
+    prompt_model.generate_text = AsyncMock(
+        side_effect=lambda prompt: f"Response to {prompt.split()[-1]}"
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+      llm_response, llm_response_stats = (
+          await model.process_prompts_concurrently(
+              _make_prompts(3),
+              _parse_response,
+              batch_backend=batch_prediction.LocalBatchBackend(
+                  prompt_model, temp_dir
+              ),
+          )
+      )
+
+    model._call_gemini.assert_not_called()
+    self.assertEqual(
+        list(llm_response["topic"]), ["Topic 0", "Topic 1", "Topic 2"]
+    )
+    self.assertEqual(
+        list(llm_response["propositions"][2]["proposition"]), ["Response to 2"]
+    )
+    self.assertEqual(len(llm_response_stats), 3)
+
+  async def test_batch_job_sends_pydantic_schema_as_json(self):
+    class Proposition(pydantic.BaseModel):
+      text: str
+
+    model = _make_genai_model()
+    prompts = _make_prompts(2)
+    for prompt_data in prompts:
+      prompt_data["response_schema"] = list[Proposition]
+    prompt_model = MagicMock()
+    prompt_model.generate_text = AsyncMock(return_value='[{"text": "A"}]')
+
+    with tempfile.TemporaryDirectory() as temp_dir, patch.object(
+        batch_prediction,
+        "make_request",
+        wraps=batch_prediction.make_request,
+    ) as make_request:
+      llm_response, _ = await model.process_prompts_concurrently(
+          prompts,
+          lambda text: pd.DataFrame(json.loads(text)),
+          batch_backend=batch_prediction.LocalBatchBackend(
+              prompt_model, temp_dir
+          ),
+      )
+
+    schema = make_request.call_args.kwargs["generation_config"][
+        "responseSchema"
+    ]
+    self.assertEqual(schema["type"], "array")
+    self.assertIn("text", schema["items"]["properties"])
+    self.assertEqual(list(llm_response["propositions"][1]["text"]), ["A"])
+
+  async def test_blocked_response_is_not_retried(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        side_effect=retry_policy.ResponseBlockedError("SAFETY")
+    )
+
+    results = [
+        result
+        async for result in model.stream_prompts_concurrently(
+            _make_prompts(1), _parse_response, delay_between_calls_seconds=0
+        )
+    ]
+
+    self.assertEqual(results, [])
+    self.assertEqual(model._call_gemini.call_count, 1)
+
+  async def test_truncated_json_response_is_salvaged_without_retry(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        return_value={
+            "text": '[{"claim": "a"}, {"claim": "b"}, {"cla',
+            "input_token_count": 10,
+            "truncated": True,
+        }
+    )
+
+    results = [
+        result
+        async for result in model.stream_prompts_concurrently(
+            _make_prompts(1),
+            lambda text: pd.DataFrame(json.loads(text)),
+            delay_between_calls_seconds=0,
+        )
+    ]
+
+    self.assertEqual(model._call_gemini.call_count, 1)
+    self.assertEqual(list(results[0]["propositions"]["claim"]), ["a", "b"])
+    self.assertEqual(results[0]["salvaged"], ["closed_truncated"])
+
+  async def test_process_prompts_concurrently_resumes_from_journal(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      journal_path = os.path.join(temp_dir, "journal.jsonl")
+      model = _make_genai_model()
+      model._call_gemini = AsyncMock(
+          return_value={"text": "Response", "input_token_count": 10}
+      )
+      await model.process_prompts_concurrently(
+          _make_prompts(3),
+          _parse_response,
+          delay_between_calls_seconds=0,
+          journal_path=journal_path,
+      )
+
+      model._call_gemini.reset_mock()
+      llm_response, _ = await model.process_prompts_concurrently(
+          _make_prompts(4),
+          _parse_response,
+          delay_between_calls_seconds=0,
+          journal_path=journal_path,
+      )
+
+      self.assertEqual(model._call_gemini.call_count, 1)
+      self.assertEqual(
+          model._call_gemini.call_args.kwargs["prompt"], "Prompt 3"
+      )
+      self.assertEqual(len(llm_response), 4)
+
+  async def test_process_prompts_concurrently_starts_no_jobs_after_deadline(
+      self,
+  ):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        return_value={"text": "Response", "input_token_count": 10}
+    )
+
+    with deadline.run_deadline(0):
+      llm_response, _ = await model.process_prompts_concurrently(
+          _make_prompts(3),
+          _parse_response,
+          delay_between_calls_seconds=0,
+      )
+
+    model._call_gemini.assert_not_called()
+    self.assertTrue(llm_response.empty)
+
+  async def test_process_prompts_concurrently_packs_small_jobs(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        return_value={
+            "text": '{"task_1": "A", "task_2": "B", "task_3": "C"}',
+            "input_token_count": 30,
+        }
+    )
+
+    llm_response, _ = await model.process_prompts_concurrently(
+        _make_prompts(3),
+        lambda text: pd.DataFrame([{"proposition": json.loads(text)}]),
+        delay_between_calls_seconds=0,
+        pack_token_budget=1000,
+    )
+
+    self.assertEqual(model._call_gemini.call_count, 1)
+    self.assertEqual(
+        [df["proposition"][0] for df in llm_response["propositions"]],
+        ["A", "B", "C"],
+    )
+    self.assertEqual(list(llm_response["token_used"]), [10, 10, 10])
+
+  async def test_failed_pack_falls_back_to_individual_calls(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        side_effect=[
+            {"text": "not json", "input_token_count": 30},
+            {"text": '"A"', "input_token_count": 10},
+            {"text": '"B"', "input_token_count": 10},
+        ]
+    )
+
+    llm_response, _ = await model.process_prompts_concurrently(
+        _make_prompts(2),
+        lambda text: pd.DataFrame([{"proposition": json.loads(text)}]),
+        delay_between_calls_seconds=0,
+        pack_token_budget=1000,
+    )
+
+    self.assertEqual(model._call_gemini.call_count, 3)
+    self.assertEqual(list(llm_response["topic"]), ["Topic 0", "Topic 1"])
+
+  async def test_failed_pack_call_is_retried_with_backoff(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        side_effect=[
+            Exception("429 Resource exhausted."),
+            {"text": '{"task_1": "A", "task_2": "B"}', "input_token_count": 20},
+        ]
+    )
+
+    llm_response, _ = await model.process_prompts_concurrently(
+        _make_prompts(2),
+        lambda text: pd.DataFrame([{"proposition": json.loads(text)}]),
+        initial_retry_delay=0,
+        delay_between_calls_seconds=0,
+        pack_token_budget=1000,
+    )
+
+    self.assertEqual(model._call_gemini.call_count, 2)
+    self.assertEqual(
+        [df["proposition"][0] for df in llm_response["propositions"]],
+        ["A", "B"],
+    )
+
+  async def test_pack_fallback_runs_jobs_concurrently_without_fixed_delay(
+      self,
+  ):
+    model = _make_genai_model(
+        concurrency_limiter=AdaptiveConcurrencyLimiter(
+            initial_limit=3, min_limit=1, max_limit=3
+        )
+    )
+    in_flight = 0
+    max_in_flight = 0
+
+    async def call_gemini(prompt, **kwargs):
+      nonlocal in_flight, max_in_flight
+      if "task_1" in prompt:
+        return {"text": "not json", "input_token_count": 30}
+      async with model.concurrency_limiter.slot():
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+      return {"text": '"A"', "input_token_count": 10}
+
+    model._call_gemini = AsyncMock(side_effect=call_gemini)
+    real_sleep = asyncio.sleep
+    sleeps = []
+
+    async def record_sleep(delay, *args):
+      sleeps.append(delay)
+      await real_sleep(0 if delay >= 1 else delay)
+
+    with patch.object(genai_model.asyncio, "sleep", side_effect=record_sleep):
+      llm_response, _ = await model.process_prompts_concurrently(
+          _make_prompts(3),
+          lambda text: pd.DataFrame([{"proposition": json.loads(text)}]),
+          delay_between_calls_seconds=60,
+          pack_token_budget=1000,
+      )
+
+    self.assertEqual(len(llm_response), 3)
+    self.assertEqual(max_in_flight, 3)
+    self.assertEqual(sleeps.count(60), 1)
+
+  async def test_largest_first_queue_policy_runs_big_jobs_first(self):
+    model = _make_genai_model()
+    model._call_gemini = AsyncMock(
+        return_value={"text": "Response", "input_token_count": 10}
+    )
+    prompts = _make_prompts(3)
+    prompts[2]["stats"]["combined_tokens"] = 1000
+
+    await model.process_prompts_concurrently(
+        prompts,
+        _parse_response,
+        max_concurrent_calls=1,
+        delay_between_calls_seconds=0,
+        queue_policy="largest_first",
+    )
+
+    self.assertEqual(
+        [call.kwargs["prompt"] for call in model._call_gemini.call_args_list],
+        ["Prompt 2", "Prompt 0", "Prompt 1"],
+    )
+    self.assertEqual(model.last_makespan_report["policy"], "largest_first")
+    self.assertEqual(model.last_makespan_report["completed_jobs"], 3)
+
+  async def test_embed_many_batches_and_preserves_order(self):
+    model = _make_genai_model()
+
+    async def embed_content(model, contents, config):
+      response = MagicMock()
+      response.embeddings = [
+          MagicMock(values=[float(text), 0.5]) for text in contents
+      ]
+      return response
+
+    model.client.aio.models.embed_content = AsyncMock(side_effect=embed_content)
+
+    embeddings = await model.embed_many(
+        [str(i) for i in range(250)], batch_size=100
+    )
+
+    self.assertEqual(model.client.aio.models.embed_content.call_count, 3)
+    self.assertEqual(embeddings.shape, (250, 2))
+    self.assertEqual(embeddings.dtype, np.float32)
+    self.assertTrue(embeddings.flags["C_CONTIGUOUS"])
+    np.testing.assert_array_equal(embeddings[:, 0], np.arange(250))
+
+  async def test_embed_many_cancels_other_batches_when_one_fails(self):
+    model = _make_genai_model()
+    cancelled = []
+
+    async def embed_content(model, contents, config):
+      if contents[0] == "0":
+        raise ValueError("Bad batch")
+      try:
+        await asyncio.sleep(3600)
+      except asyncio.CancelledError:
+        cancelled.append(contents[0])
+        raise
+
+    model.client.aio.models.embed_content = AsyncMock(side_effect=embed_content)
+
+    with self.assertRaises(ValueError):
+      await asyncio.wait_for(
+          model.embed_many([str(i) for i in range(3)], batch_size=1), 5
+      )
+
+    self.assertCountEqual(cancelled, ["1", "2"])
+
+  async def test_count_tokens_many_caches_counts(self):
+    model = _make_genai_model()
+    model.client.aio.models.count_tokens = AsyncMock(
+        side_effect=lambda model, contents, config: MagicMock(
+            total_tokens=len(contents)
+        )
+    )
+
+    counts = await model.count_tokens_many(["aa", "bbbb", "aa"])
+    counts_again = await model.count_tokens_many(["bbbb"])
+
+    self.assertEqual(counts, [2, 4, 2])
+    self.assertEqual(counts_again, [4])
+    self.assertEqual(model.client.aio.models.count_tokens.call_count, 2)
+
+  async def test_count_tokens_many_approximate_skips_api(self):
+    model = _make_genai_model()
+    model.client.aio.models.count_tokens = AsyncMock()
+
+    counts = await model.count_tokens_many(["a" * 40], approximate=True)
+
+    self.assertEqual(counts, [10])
+    model.client.aio.models.count_tokens.assert_not_called()
+
+  async def test_generate_data_stream_yields_items(self):
+    model = _make_genai_model()
+
+    def make_chunk(text):
+      chunk = MagicMock(text=text, prompt_feedback=None)
+      chunk.candidates[0].finish_reason.name = "STOP"
+      return chunk
+
+    async def stream():
+      for text in ['["a",', ' "b"', "]"]:
+        yield make_chunk(text)
+
+    model.client.aio.models.generate_content_stream = AsyncMock(
+        return_value=stream()
+    )
+
+    items = [item async for item in model.generate_data_stream("p", list[str])]
+
+    self.assertEqual(items, ["a", "b"])
+    config = model.client.aio.models.generate_content_stream.call_args.kwargs[
+        "config"
+    ]
+    self.assertEqual(config.response_mime_type, "application/json")
+
+  async def test_generate_text_stream_raises_for_blocked_response(self):
+    model = _make_genai_model()
+    chunk = MagicMock(text="", prompt_feedback=None)
+    chunk.candidates[0].finish_reason.name = "SAFETY"
+
+    async def stream():
+      yield chunk
+
+    model.client.aio.models.generate_content_stream = AsyncMock(
+        return_value=stream()
+    )
+
+    with self.assertRaises(retry_policy.ResponseBlockedError):
+      async for _ in model.generate_text_stream("prompt"):
+        pass
+
+  async def test_truncated_stream_is_not_cached_or_recorded(self):
+    response_cache = MagicMock()
+    response_cache.get.return_value = None
+    cassette = MagicMock()
+    model = _make_genai_model(response_cache=response_cache, cassette=cassette)
+    chunk = MagicMock(text="truncat", prompt_feedback=None)
+    chunk.candidates[0].finish_reason.name = "MAX_TOKENS"
+    chunk.usage_metadata = MagicMock(
+        prompt_token_count=10, candidates_token_count=5, total_token_count=15
+    )
+
+    async def stream():
+      yield chunk
+
+    model.client.aio.models.generate_content_stream = AsyncMock(
+        return_value=stream()
+    )
+
+    chunks = [chunk async for chunk in model.generate_text_stream("prompt")]
+
+    self.assertEqual(chunks, ["truncat"])
+    response_cache.put.assert_not_called()
+    cassette.record_call.assert_not_called()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,156 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hedged LLM calls, to cut the tail latency of large parallel runs."""
+
+import asyncio
+import collections
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from . import metrics
+
+ResultType = TypeVar("ResultType")
+
+HEDGED_CALLS = metrics.default_registry.counter(
+    "llm_hedged_calls_total", "Duplicate LLM calls sent for slow calls."
+)
+HEDGE_WINS = metrics.default_registry.counter(
+    "llm_hedge_wins_total", "Hedged calls that returned before the original."
+)
+
+
+class Hedger:
+  """Sends a duplicate of a call that is slower than usual.
+
+  Once a call has been running for longer than the given percentile of recent
+  call latencies, a duplicate is sent. The first valid response wins and the
+  other call is cancelled. Duplicates are capped at `max_hedge_fraction` of
+  all calls, so hedging can't double the load on a slow endpoint.
+
+  One hedger should be shared by the calls of a single endpoint, as it learns
+  the latency distribution from them.
+  """
+
+  def __init__(
+      self,
+      percentile: float = 95.0,
+      max_hedge_fraction: float = 0.05,
+      min_samples: int = 20,
+      window_size: int = 1000,
+  ):
+    """Initializes the Hedger.
+
+    Args:
+      percentile: The latency percentile after which a duplicate is sent.
+      max_hedge_fraction: The maximum share of calls that get a duplicate.
+      min_samples: How many latencies must be known before hedging starts.
+      window_size: How many recent latencies the percentile is computed over.
+    """
+    self.percentile = percentile
+    self.max_hedge_fraction = max_hedge_fraction
+    self.min_samples = min_samples
+    self._latencies = collections.deque(maxlen=window_size)
+    self.calls = 0
+    self.hedges = 0
+
+  def hedge_delay_sec(self) -> Optional[float]:
+    """Returns how long a call may run before it is hedged, if known yet."""
+    if len(self._latencies) < self.min_samples:
+      return None
+    latencies = sorted(self._latencies)
+    index = math.ceil(self.percentile / 100 * len(latencies)) - 1
+    return latencies[min(max(index, 0), len(latencies) - 1)]
+
+  def record_latency(self, latency_sec: float):
+    self._latencies.append(latency_sec)
+
+  async def run(
+      self,
+      make_call: Callable[[], Awaitable[ResultType]],
+      is_valid: Callable[[ResultType], bool] = lambda result: True,
+      **metric_labels: Any,
+  ) -> ResultType:
+    """Runs a call, hedging it with a duplicate if it is slow.
+
+    Args:
+      make_call: Starts one attempt of the call. Called a second time for the
+        duplicate.
+      is_valid: Whether a result may win. If the first result is invalid, the
+        other attempt is awaited.
+      **metric_labels: Labels of the hedging metrics, e.g. the model name.
+
+    Returns:
+      The first valid result, or the result of the original call if neither is
+      valid.
+
+    Raises:
+      The error of the original call, if neither call returned a result.
+    """
+    self.calls += 1
+    # Set once the hedge won, so only the cancellation of the losing original
+    # is timed, not one by the caller or the run deadline
+    original_lost = False
+
+    async def timed_call() -> ResultType:
+      # Only the original call is timed, as a hedge is only sent for slow
+      # calls and would skew the latencies toward fast ones
+      start_time = time.perf_counter()
+      try:
+        result = await make_call()
+      except asyncio.CancelledError:
+        if original_lost:
+          # A call that lost to its hedge took at least this long, and leaving
+          # it out would lower the percentile and hedge ever more calls
+          self.record_latency(time.perf_counter() - start_time)
+        raise
+      self.record_latency(time.perf_counter() - start_time)
+      return result
+
+    original = asyncio.create_task(timed_call())
+    tasks = [original]
+    try:
+      delay_sec = self.hedge_delay_sec()
+      if delay_sec is not None:
+        await asyncio.wait([original], timeout=delay_sec)
+        if not original.done() and (
+            self.hedges < self.max_hedge_fraction * self.calls
+        ):
+          self.hedges += 1
+          HEDGED_CALLS.inc(**metric_labels)
+          logging.info(
+              f"Call still running after {delay_sec:.1f}s, sending a hedge."
+          )
+          tasks.append(asyncio.create_task(make_call()))
+
+      pending = set(tasks)
+      while pending:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+          if task.exception() is None and is_valid(task.result()):
+            if task is not original:
+              HEDGE_WINS.inc(**metric_labels)
+              original_lost = True
+            return task.result()
+      # Neither attempt returned a valid result
+      return original.result()
+    finally:
+      for task in tasks:
+        if not task.done():
+          task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
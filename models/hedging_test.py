@@ -0,0 +1,118 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from models import hedging
+
+
+def _make_hedger(**kwargs) -> hedging.Hedger:
+  hedger = hedging.Hedger(min_samples=5, **kwargs)
+  for _ in range(5):
+    hedger.record_latency(0.01)
+  hedger.calls = 100  # Leave room under the hedge cap
+  return hedger
+
+
+class HedgerTest(unittest.IsolatedAsyncioTestCase):
+
+  def test_hedge_delay_is_latency_percentile(self):
+    hedger = hedging.Hedger(percentile=90, min_samples=10)
+    for latency in range(1, 10):
+      hedger.record_latency(latency)
+    self.assertIsNone(hedger.hedge_delay_sec())
+
+    hedger.record_latency(10)
+
+    self.assertEqual(hedger.hedge_delay_sec(), 9)
+
+  async def test_slow_call_is_hedged_and_loser_cancelled(self):
+    hedger = _make_hedger()
+    cancelled = []
+    calls = 0
+
+    async def make_call():
+      nonlocal calls
+      calls += 1
+      if calls == 1:
+        try:
+          await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+          cancelled.append(True)
+          raise
+      return "hedge"
+
+    labels = {"model": "slow-call-is-hedged"}
+    self.assertEqual(await hedger.run(make_call, **labels), "hedge")
+    self.assertEqual(cancelled, [True])
+    # The cancelled original is recorded as at least the hedge delay, and the
+    # hedge isn't recorded
+    self.assertEqual(len(hedger._latencies), 6)
+    self.assertGreaterEqual(hedger._latencies[-1], 0.01)
+    self.assertEqual(hedging.HEDGED_CALLS.value(**labels), 1)
+    self.assertEqual(hedging.HEDGE_WINS.value(**labels), 1)
+
+  async def test_call_cancelled_by_caller_is_not_recorded(self):
+    hedger = _make_hedger()
+    started = asyncio.Event()
+
+    async def make_call():
+      started.set()
+      await asyncio.sleep(3600)
+
+    run = asyncio.create_task(hedger.run(make_call))
+    await started.wait()
+    run.cancel()
+    with self.assertRaises(asyncio.CancelledError):
+      await run
+
+    self.assertEqual(len(hedger._latencies), 5)
+
+  async def test_fast_call_is_not_hedged(self):
+    hedger = _make_hedger()
+
+    async def make_call():
+      return "original"
+
+    self.assertEqual(await hedger.run(make_call), "original")
+    self.assertEqual(hedger.hedges, 0)
+
+  async def test_invalid_result_waits_for_the_other_call(self):
+    hedger = _make_hedger()
+    calls = 0
+
+    async def make_call():
+      nonlocal calls
+      calls += 1
+      if calls == 1:
+        await asyncio.sleep(0.1)
+        return "valid"
+      return ""
+
+    self.assertEqual(await hedger.run(make_call, is_valid=bool), "valid")
+
+  async def test_hedges_are_capped(self):
+    hedger = _make_hedger(max_hedge_fraction=0.0)
+
+    async def make_call():
+      await asyncio.sleep(0.05)
+      return "original"
+
+    self.assertEqual(await hedger.run(make_call), "original")
+    self.assertEqual(hedger.hedges, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
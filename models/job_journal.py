@@ -0,0 +1,98 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Append-only journal of completed jobs, used to resume interrupted runs."""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Dict
+
+from .model_util import fingerprint
+
+
+def job_key(*parts: Any) -> str:
+  """Returns a stable hash identifying a job by its inputs.
+
+  Raises:
+    TypeError: If a part has no representation that is the same in every run,
+      so the job couldn't be found again after a restart.
+  """
+  payload = json.dumps(
+      fingerprint(list(parts), strict=True), sort_keys=True, ensure_ascii=False
+  )
+  return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JobJournal:
+  """A JSONL file recording the result of every completed job.
+
+  Each line holds one `{"key": ..., "value": ...}` record and is flushed to disk
+  as soon as the job completes. On startup, previously recorded jobs are loaded
+  so a restarted run with the same journal path only schedules the remainder. A
+  partially written last line, e.g. after a crash, is ignored.
+  """
+
+  def __init__(self, path: str):
+    """Initializes the JobJournal, loading any jobs recorded at `path`.
+
+    Args:
+      path: The JSONL file to append completed jobs to.
+    """
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.path = path
+    self._completed: Dict[str, Any] = {}
+    if os.path.exists(path):
+      with open(path, "r", encoding="utf-8") as journal_file:
+        for line_num, line in enumerate(journal_file, start=1):
+          try:
+            record = json.loads(line)
+            self._completed[record["key"]] = record["value"]
+          except (json.JSONDecodeError, KeyError, TypeError):
+            logging.warning(
+                f"Skipping unreadable line {line_num} in journal {path}."
+            )
+      logging.info(
+          f"Loaded {len(self._completed)} completed jobs from journal {path}."
+      )
+    self._file = open(path, "a", encoding="utf-8")
+    # Terminate a partially written last line so new records start cleanly
+    if self._file.tell() > 0:
+      with open(path, "rb") as journal_file:
+        journal_file.seek(-1, os.SEEK_END)
+        if journal_file.read(1) != b"\n":
+          self._file.write("\n")
+
+  def __contains__(self, key: str) -> bool:
+    return key in self._completed
+
+  def __len__(self) -> int:
+    return len(self._completed)
+
+  def get(self, key: str) -> Any:
+    """Returns the recorded value of a completed job, or None."""
+    return self._completed.get(key)
+
+  def record(self, key: str, value: Any):
+    """Durably records a completed job. `value` must be JSON-serializable."""
+    line = json.dumps({"key": key, "value": value}, ensure_ascii=False)
+    self._file.write(line + "\n")
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    self._completed[key] = value
+
+  def close(self):
+    self._file.close()
@@ -0,0 +1,66 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from models.job_journal import JobJournal, job_key
+
+
+class JobJournalTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.path = os.path.join(self.temp_dir.name, "journal.jsonl")
+
+  def test_job_key_is_stable_and_input_dependent(self):
+    self.assertEqual(job_key("a", {"b": 1}), job_key("a", {"b": 1}))
+    self.assertNotEqual(job_key("a", {"b": 1}), job_key("a", {"b": 2}))
+
+  def test_job_key_refuses_values_without_stable_representation(self):
+    with self.assertRaises(TypeError):
+      job_key("a", object())
+
+  def test_recorded_jobs_survive_restart(self):
+    journal = JobJournal(self.path)
+    journal.record("key1", {"text": "response"})
+    journal.close()
+
+    restarted_journal = JobJournal(self.path)
+    self.assertIn("key1", restarted_journal)
+    self.assertNotIn("key2", restarted_journal)
+    self.assertEqual(restarted_journal.get("key1"), {"text": "response"})
+    restarted_journal.close()
+
+  def test_partially_written_line_is_ignored(self):
+    journal = JobJournal(self.path)
+    journal.record("key1", "value1")
+    journal.close()
+    with open(self.path, "a", encoding="utf-8") as journal_file:
+      journal_file.write('{"key": "key2", "val')
+
+    journal = JobJournal(self.path)
+    journal.record("key3", "value3")
+    journal.close()
+
+    restarted_journal = JobJournal(self.path)
+    self.assertEqual(len(restarted_journal), 2)
+    self.assertEqual(restarted_journal.get("key3"), "value3")
+    restarted_journal.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,271 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Salvaging of near-miss JSON responses without calling the LLM again.
+
+Models sometimes return JSON that is almost right: wrapped in prose or code
+fences, with trailing commas, cut off by the output token limit, or with one
+field that fails validation. Re-calling the model for these costs a whole
+request, so they are repaired locally where possible. Every salvaged response
+is counted in the `llm_json_salvaged_total` metric.
+"""
+
+import dataclasses
+import json
+import logging
+from typing import Any, List, Optional, Tuple
+
+from pydantic import TypeAdapter, ValidationError
+
+from . import metrics
+
+# Names of the repairs, as listed in `SalvageResult.repairs`.
+STRIPPED_PROSE = "stripped_prose"
+TRAILING_COMMAS = "trailing_commas"
+CLOSED_TRUNCATED = "closed_truncated"
+DROPPED_INVALID_ITEMS = "dropped_invalid_items"
+DROPPED_INVALID_FIELD = "dropped_invalid_field"
+
+_CLOSING_BRACKETS = {"[": "]", "{": "}"}
+
+JSON_SALVAGED = metrics.default_registry.counter(
+    "llm_json_salvaged_total",
+    "LLM responses repaired locally instead of calling the LLM again.",
+)
+
+
+@dataclasses.dataclass
+class SalvageResult:
+  """A parsed response and the repairs needed to parse it."""
+
+  value: Any
+  repairs: List[str]
+
+  @property
+  def salvaged(self) -> bool:
+    return bool(self.repairs)
+
+
+def _decode_prefix(text: str) -> Tuple[Any, bool]:
+  """Decodes the JSON value at the start of `text`.
+
+  Returns:
+    The value, and whether anything other than whitespace follows it.
+  """
+  value, end = json.JSONDecoder().raw_decode(text)
+  return value, bool(text[end:].strip())
+
+
+def _strip_leading_prose(text: str) -> str:
+  """Returns `text` from its first bracket on."""
+  starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+  if not starts:
+    raise ValueError("Response contains no JSON object or array.")
+  return text[min(starts) :]
+
+
+def _remove_trailing_commas(text: str) -> str:
+  """Removes commas directly followed by a closing bracket."""
+  output = []
+  in_string = False
+  escaped = False
+  for index, char in enumerate(text):
+    if in_string:
+      if escaped:
+        escaped = False
+      elif char == "\\":
+        escaped = True
+      elif char == '"':
+        in_string = False
+    elif char == '"':
+      in_string = True
+    elif char == ",":
+      rest = text[index + 1 :].lstrip()
+      if rest[:1] in ("]", "}"):
+        continue
+    output.append(char)
+  return "".join(output)
+
+
+def _close_truncated(text: str) -> str:
+  """Cuts a truncated response after its last complete element and closes it.
+
+  Raises:
+    ValueError: If no element was completed before the response was cut off.
+  """
+  stack = []
+  in_string = False
+  escaped = False
+  last_complete: Optional[Tuple[int, Tuple[str, ...]]] = None
+  for index, char in enumerate(text):
+    if in_string:
+      if escaped:
+        escaped = False
+      elif char == "\\":
+        escaped = True
+      elif char == '"':
+        in_string = False
+    elif char == '"':
+      in_string = True
+    elif char in _CLOSING_BRACKETS:
+      stack.append(char)
+    elif char in ("]", "}"):
+      if not stack or _CLOSING_BRACKETS[stack.pop()] != char:
+        raise ValueError(f"Unbalanced '{char}' at position {index}.")
+      if not stack:
+        return text[: index + 1]
+      last_complete = (index + 1, tuple(stack))
+    elif char == ",":
+      last_complete = (index, tuple(stack))
+  if last_complete is None:
+    raise ValueError("Truncated response has no complete element.")
+  end, open_brackets = last_complete
+  closing = "".join(_CLOSING_BRACKETS[char] for char in reversed(open_brackets))
+  return text[:end] + closing
+
+
+def repair_json(text: str, truncated: bool = False) -> SalvageResult:
+  """Parses JSON, repairing common near misses if it isn't valid as is.
+
+  Args:
+    text: The response text, which should be JSON.
+    truncated: Whether the response was cut off by the output token limit. Only
+      then is it cut after its last complete element and closed, as other
+      malformed JSON isn't missing just its end.
+
+  Raises:
+    ValueError: If the text can't be repaired into valid JSON.
+  """
+  try:
+    return SalvageResult(json.loads(text), [])
+  except json.JSONDecodeError as e:
+    error = e
+
+  candidate = _strip_leading_prose(text)
+  has_leading_prose = bool(text[: len(text) - len(candidate)].strip())
+  repairs = []
+  steps = [(TRAILING_COMMAS, _remove_trailing_commas)]
+  if truncated:
+    steps.append((CLOSED_TRUNCATED, _close_truncated))
+  steps.append((None, None))
+  for repair, step in steps:
+    try:
+      value, has_trailing_prose = _decode_prefix(candidate)
+    except json.JSONDecodeError as e:
+      error = e
+    else:
+      if has_leading_prose or has_trailing_prose:
+        repairs.insert(0, STRIPPED_PROSE)
+      return SalvageResult(value, repairs)
+    if step is None:
+      break
+    repaired = step(candidate)
+    if repaired != candidate:
+      repairs.append(repair)
+      candidate = repaired
+  raise ValueError(f"Can't repair JSON response: {error}")
+
+
+def _drop_invalid_parts(
+    value: Any, error: ValidationError, drop_invalid_items: bool
+) -> Tuple[Any, str]:
+  """Drops the list items or the single object field that failed validation.
+
+  Raises:
+    ValueError: If the errors can't be fixed by dropping parts of the value.
+  """
+  locations = [details["loc"] for details in error.errors()]
+  if not all(locations):
+    raise ValueError("Validation failed for the response as a whole.")
+  if (
+      drop_invalid_items
+      and isinstance(value, list)
+      and all(isinstance(location[0], int) for location in locations)
+  ):
+    invalid_indices = {location[0] for location in locations}
+    if len(invalid_indices) < len(value):
+      return [
+          item
+          for index, item in enumerate(value)
+          if index not in invalid_indices
+      ], DROPPED_INVALID_ITEMS
+  fields = {location[0] for location in locations}
+  if isinstance(value, dict) and len(fields) == 1:
+    field = fields.pop()
+    if field in value:
+      return {
+          key: item for key, item in value.items() if key != field
+      }, DROPPED_INVALID_FIELD
+  raise ValueError(
+      "Validation failed for more than dropping invalid parts fixes."
+  )
+
+
+def salvage(
+    text: str,
+    adapter: Optional[TypeAdapter] = None,
+    truncated: bool = False,
+    drop_invalid_items: bool = False,
+    **metric_labels: Any,
+) -> SalvageResult:
+  """Parses and optionally validates a response, repairing it if needed.
+
+  Args:
+    text: The response text, which should be JSON.
+    adapter: An optional adapter the parsed value is validated with. If a
+      single object field fails validation, it is dropped, which works for
+      fields that have a default.
+    truncated: Whether the response was cut off by the output token limit, see
+      `repair_json`.
+    drop_invalid_items: Whether list items that fail validation are dropped,
+      for callers that can do with fewer items.
+    **metric_labels: Labels of the salvage metric, e.g. the model name.
+
+  Returns:
+    The parsed (and validated) value, and the repairs that were needed.
+
+  Raises:
+    ValueError: If the response can't be salvaged and the LLM must be called
+      again.
+  """
+  if adapter is not None:
+    try:
+      return SalvageResult(adapter.validate_json(text), [])
+    except ValidationError:
+      pass
+
+  result = repair_json(text, truncated)
+  if adapter is not None:
+    try:
+      result.value = adapter.validate_python(result.value)
+    except ValidationError as error:
+      value, repair = _drop_invalid_parts(
+          result.value, error, drop_invalid_items
+      )
+      try:
+        result.value = adapter.validate_python(value)
+      except ValidationError as e:
+        raise ValueError(f"Response failed validation: {error}") from e
+      result.repairs.append(repair)
+
+  record_salvage(result, **metric_labels)
+  return result
+
+
+def record_salvage(result: SalvageResult, **metric_labels: Any):
+  """Logs and counts a response that was salvaged instead of retried."""
+  if result.salvaged:
+    repairs = ",".join(result.repairs)
+    logging.warning(f"Salvaged a malformed JSON response with: {repairs}")
+    JSON_SALVAGED.inc(repairs=repairs, **metric_labels)
@@ -0,0 +1,103 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List, Optional
+import unittest
+
+from models import json_repair
+import pydantic
+
+
+class _Claim(pydantic.BaseModel):
+  text: str
+  score: Optional[float] = None
+
+
+class JsonRepairTest(unittest.TestCase):
+
+  def test_valid_json_needs_no_repairs(self):
+    result = json_repair.repair_json('{"a": [1, 2]}')
+
+    self.assertEqual(result.value, {"a": [1, 2]})
+    self.assertFalse(result.salvaged)
+
+  def test_strips_prose_code_fences_and_trailing_commas(self):
+    result = json_repair.repair_json(
+        'Here you go:\n```json\n{"a": [1, 2,], "b": "x, ]",}\n```\nDone.'
+    )
+
+    self.assertEqual(result.value, {"a": [1, 2], "b": "x, ]"})
+    self.assertEqual(
+        result.repairs,
+        [json_repair.STRIPPED_PROSE, json_repair.TRAILING_COMMAS],
+    )
+
+  def test_closes_truncated_array_after_last_complete_item(self):
+    text = '[{"a": 1}, {"a": [2, 3]}, {"a": "tru'
+
+    result = json_repair.repair_json(text, truncated=True)
+
+    self.assertEqual(result.value, [{"a": 1}, {"a": [2, 3]}])
+    self.assertEqual(result.repairs, [json_repair.CLOSED_TRUNCATED])
+    # Malformed JSON that wasn't truncated isn't closed
+    with self.assertRaises(ValueError):
+      json_repair.repair_json(text)
+
+  def test_unrecoverable_text_raises(self):
+    for text in ("No JSON here", '{"a": "cut, off'):
+      with self.subTest(text=text):
+        with self.assertRaises(ValueError):
+          json_repair.repair_json(text, truncated=True)
+
+  def test_salvage_drops_invalid_list_items_if_asked(self):
+    text = '[{"text": "a"}, {"text": 5}, {"text": "c"}]'
+    adapter = pydantic.TypeAdapter(List[_Claim])
+
+    result = json_repair.salvage(text, adapter, drop_invalid_items=True)
+
+    self.assertEqual([claim.text for claim in result.value], ["a", "c"])
+    self.assertEqual(result.repairs, [json_repair.DROPPED_INVALID_ITEMS])
+    with self.assertRaises(ValueError):
+      json_repair.salvage(text, adapter)
+
+  def test_salvage_drops_single_invalid_field_with_default(self):
+    result = json_repair.salvage(
+        '{"text": "a", "score": "high"}', pydantic.TypeAdapter(_Claim)
+    )
+
+    self.assertEqual(result.value, _Claim(text="a"))
+    self.assertEqual(result.repairs, [json_repair.DROPPED_INVALID_FIELD])
+
+  def test_salvage_raises_when_required_field_is_invalid(self):
+    with self.assertRaises(ValueError):
+      json_repair.salvage('{"text": 5}', pydantic.TypeAdapter(_Claim))
+
+  def test_salvage_counts_saved_calls(self):
+    labels = {"backend": "test", "model": "salvage-counts"}
+
+    json_repair.salvage('{"text": "a"}', pydantic.TypeAdapter(_Claim), **labels)
+    json_repair.salvage(
+        '{"text": "a",}', pydantic.TypeAdapter(_Claim), **labels
+    )
+
+    self.assertEqual(
+        json_repair.JSON_SALVAGED.value(
+            repairs=json_repair.TRAILING_COMMAS, **labels
+        ),
+        1,
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
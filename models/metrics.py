@@ -0,0 +1,357 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process metrics for the models layer.
+
+Metrics are kept in a `MetricsRegistry` and can be dumped as JSON or in the
+Prometheus text exposition format, on demand or when the process exits. The
+model wrappers record into `default_registry`.
+"""
+
+import atexit
+import bisect
+import contextlib
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Upper bounds in seconds of the default latency histogram buckets.
+DEFAULT_LATENCY_BUCKETS_SEC = (
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    50.0,
+    100.0,
+    250.0,
+)
+
+LabelsType = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, Any]) -> LabelsType:
+  return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _escape_label_value(value: str) -> str:
+  return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: LabelsType, extra: LabelsType = ()) -> str:
+  all_labels = labels + extra
+  if not all_labels:
+    return ""
+  formatted = ",".join(
+      f'{name}="{_escape_label_value(value)}"' for name, value in all_labels
+  )
+  return "{" + formatted + "}"
+
+
+class _Metric:
+  """A named metric with one value per set of labels."""
+
+  type_name = ""
+
+  def __init__(self, name: str, description: str):
+    self.name = name
+    self.description = description
+    self._values: Dict[LabelsType, Any] = {}
+
+  def _series(self) -> Iterable[Tuple[LabelsType, Any]]:
+    return sorted(self._values.items())
+
+  def value(self, **labels: Any) -> Any:
+    """Returns the current value for the given labels."""
+    return self._values.get(_labels_key(labels), 0)
+
+  def to_dict(self, uptime_sec: float) -> Dict[str, Any]:
+    return {
+        "type": self.type_name,
+        "description": self.description,
+        "series": [
+            {"labels": dict(labels), "value": value}
+            for labels, value in self._series()
+        ],
+    }
+
+  def to_prometheus(self) -> List[str]:
+    lines = [
+        f"# HELP {self.name} {self.description}",
+        f"# TYPE {self.name} {self.type_name}",
+    ]
+    for labels, value in self._series():
+      lines.append(f"{self.name}{_format_labels(labels)} {value}")
+    return lines
+
+
+class Counter(_Metric):
+  """A value that only goes up, e.g. the number of retries."""
+
+  type_name = "counter"
+
+  def inc(self, amount: float = 1, **labels: Any):
+    key = _labels_key(labels)
+    self._values[key] = self._values.get(key, 0) + amount
+
+  def to_dict(self, uptime_sec: float) -> Dict[str, Any]:
+    metric_dict = super().to_dict(uptime_sec)
+    for series in metric_dict["series"]:
+      series["rate_per_sec"] = series["value"] / uptime_sec if uptime_sec else 0
+    return metric_dict
+
+
+class Gauge(_Metric):
+  """A value that goes up and down, e.g. the number of calls in flight."""
+
+  type_name = "gauge"
+
+  def set(self, value: float, **labels: Any):
+    self._values[_labels_key(labels)] = value
+
+  def inc(self, amount: float = 1, **labels: Any):
+    key = _labels_key(labels)
+    self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels: Any):
+    self.inc(-amount, **labels)
+
+
+class _HistogramValue:
+
+  def __init__(self, bucket_count: int):
+    self.bucket_counts = [0] * bucket_count
+    self.count = 0
+    self.sum = 0.0
+
+
+class Histogram(_Metric):
+  """A distribution of observed values, e.g. call latencies."""
+
+  type_name = "histogram"
+
+  def __init__(
+      self,
+      name: str,
+      description: str,
+      buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS_SEC,
+  ):
+    super().__init__(name, description)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value: float, **labels: Any):
+    key = _labels_key(labels)
+    if key not in self._values:
+      self._values[key] = _HistogramValue(len(self.buckets))
+    histogram_value = self._values[key]
+    bucket_index = bisect.bisect_left(self.buckets, value)
+    if bucket_index < len(self.buckets):
+      histogram_value.bucket_counts[bucket_index] += 1
+    histogram_value.count += 1
+    histogram_value.sum += value
+
+  def value(self, **labels: Any) -> Optional[_HistogramValue]:
+    return self._values.get(_labels_key(labels))
+
+  def _cumulative_counts(self, histogram_value: _HistogramValue) -> List[int]:
+    cumulative_counts = []
+    total = 0
+    for bucket_count in histogram_value.bucket_counts:
+      total += bucket_count
+      cumulative_counts.append(total)
+    return cumulative_counts
+
+  def to_dict(self, uptime_sec: float) -> Dict[str, Any]:
+    series = []
+    for labels, histogram_value in self._series():
+      buckets = dict(
+          zip(
+              [str(bound) for bound in self.buckets],
+              self._cumulative_counts(histogram_value),
+          )
+      )
+      buckets["+Inf"] = histogram_value.count
+      series.append({
+          "labels": dict(labels),
+          "count": histogram_value.count,
+          "sum": histogram_value.sum,
+          "mean": (
+              histogram_value.sum / histogram_value.count
+              if histogram_value.count
+              else 0
+          ),
+          "buckets": buckets,
+      })
+    return {
+        "type": self.type_name,
+        "description": self.description,
+        "series": series,
+    }
+
+  def to_prometheus(self) -> List[str]:
+    lines = [
+        f"# HELP {self.name} {self.description}",
+        f"# TYPE {self.name} {self.type_name}",
+    ]
+    for labels, histogram_value in self._series():
+      for bound, cumulative_count in zip(
+          self.buckets, self._cumulative_counts(histogram_value)
+      ):
+        lines.append(
+            f"{self.name}_bucket{_format_labels(labels, (('le', str(bound)),))}"
+            f" {cumulative_count}"
+        )
+      lines.append(
+          f"{self.name}_bucket{_format_labels(labels, (('le', '+Inf'),))}"
+          f" {histogram_value.count}"
+      )
+      lines.append(
+          f"{self.name}_sum{_format_labels(labels)} {histogram_value.sum}"
+      )
+      lines.append(
+          f"{self.name}_count{_format_labels(labels)} {histogram_value.count}"
+      )
+    return lines
+
+
+class MetricsRegistry:
+  """A collection of named metrics that can be exported together."""
+
+  def __init__(self):
+    self._metrics: Dict[str, _Metric] = {}
+    self.start_time = time.time()
+
+  def _get_or_create(self, metric_class: type, name: str, *args) -> Any:
+    metric = self._metrics.get(name)
+    if metric is None:
+      metric = self._metrics[name] = metric_class(name, *args)
+    elif not isinstance(metric, metric_class):
+      raise ValueError(f"Metric {name} is already a {metric.type_name}.")
+    return metric
+
+  def counter(self, name: str, description: str) -> Counter:
+    return self._get_or_create(Counter, name, description)
+
+  def gauge(self, name: str, description: str) -> Gauge:
+    return self._get_or_create(Gauge, name, description)
+
+  def histogram(
+      self,
+      name: str,
+      description: str,
+      buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS_SEC,
+  ) -> Histogram:
+    return self._get_or_create(Histogram, name, description, buckets)
+
+  def to_dict(self) -> Dict[str, Any]:
+    uptime_sec = time.time() - self.start_time
+    return {
+        "uptime_sec": uptime_sec,
+        "metrics": {
+            name: metric.to_dict(uptime_sec)
+            for name, metric in sorted(self._metrics.items())
+        },
+    }
+
+  def to_json(self) -> str:
+    return json.dumps(self.to_dict(), indent=2)
+
+  def to_prometheus(self) -> str:
+    lines = []
+    for _, metric in sorted(self._metrics.items()):
+      lines.extend(metric.to_prometheus())
+    return "\n".join(lines) + "\n"
+
+  def dump(self, path: str):
+    """Writes all metrics to `path`, as Prometheus text if it ends in .prom
+    and as JSON otherwise."""
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    content = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+    with open(path, "w", encoding="utf-8") as metrics_file:
+      metrics_file.write(content)
+    logging.info(f"Metrics saved to {path}")
+
+  def dump_at_exit(self, path: str):
+    """Writes all metrics to `path` when the process exits."""
+    atexit.register(self.dump, path)
+
+
+# The registry all model wrappers record into by default.
+default_registry = MetricsRegistry()
+
+# Metrics shared by the model wrappers.
+LLM_CALL_LATENCY = default_registry.histogram(
+    "llm_call_latency_seconds", "Latency of individual LLM API calls."
+)
+LLM_INPUT_TOKENS = default_registry.counter(
+    "llm_input_tokens_total", "Input tokens sent to LLM APIs."
+)
+LLM_OUTPUT_TOKENS = default_registry.counter(
+    "llm_output_tokens_total", "Output tokens received from LLM APIs."
+)
+LLM_RETRIES = default_registry.counter(
+    "llm_retries_total", "Failed LLM call attempts that were retried."
+)
+LLM_FAILURES = default_registry.counter(
+    "llm_failures_total", "LLM calls that failed after all retries."
+)
+LLM_CALLS_IN_FLIGHT = default_registry.gauge(
+    "llm_calls_in_flight", "LLM API calls currently waiting for a response."
+)
+QUEUE_DEPTH = default_registry.gauge(
+    "llm_queue_depth", "Jobs or tasks waiting to be started."
+)
+TASKS_IN_FLIGHT = default_registry.gauge(
+    "llm_tasks_in_flight", "Jobs or tasks currently running."
+)
+
+
+@contextlib.contextmanager
+def track_in_flight(**labels: Any) -> Iterator[None]:
+  """Counts a job or task as running while the context is open."""
+  TASKS_IN_FLIGHT.inc(**labels)
+  try:
+    yield
+  finally:
+    TASKS_IN_FLIGHT.dec(**labels)
+
+
+@contextlib.contextmanager
+def track_llm_call(**labels: Any) -> Iterator[None]:
+  """Tracks one LLM API call as in flight and records its latency."""
+  LLM_CALLS_IN_FLIGHT.inc(**labels)
+  start_time = time.perf_counter()
+  outcome = "error"
+  try:
+    yield
+    outcome = "success"
+  finally:
+    LLM_CALLS_IN_FLIGHT.dec(**labels)
+    LLM_CALL_LATENCY.observe(
+        time.perf_counter() - start_time, outcome=outcome, **labels
+    )
+
+
+def record_llm_tokens(
+    input_tokens: Optional[int], output_tokens: Optional[int], **labels: Any
+):
+  """Records the token usage of one LLM API call."""
+  LLM_INPUT_TOKENS.inc(input_tokens or 0, **labels)
+  LLM_OUTPUT_TOKENS.inc(output_tokens or 0, **labels)
@@ -0,0 +1,123 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+
+from models import metrics
+
+
+class MetricsRegistryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.registry = metrics.MetricsRegistry()
+
+  def test_counter_and_gauge_track_values_per_label_set(self):
+    counter = self.registry.counter("retries_total", "Retries.")
+    counter.inc(error_class="TimeoutError")
+    counter.inc(2, error_class="TimeoutError")
+    counter.inc(error_class="ValueError")
+    gauge = self.registry.gauge("in_flight", "In flight.")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+
+    self.assertEqual(counter.value(error_class="TimeoutError"), 3)
+    self.assertEqual(counter.value(error_class="ValueError"), 1)
+    self.assertEqual(counter.value(error_class="KeyError"), 0)
+    self.assertEqual(gauge.value(), 1)
+
+  def test_get_or_create_returns_same_metric_and_rejects_other_type(self):
+    counter = self.registry.counter("calls_total", "Calls.")
+
+    self.assertIs(self.registry.counter("calls_total", "Calls."), counter)
+    with self.assertRaises(ValueError):
+      self.registry.gauge("calls_total", "Calls.")
+
+  def test_histogram_buckets_are_cumulative(self):
+    histogram = self.registry.histogram(
+        "latency_seconds", "Latency.", buckets=(1.0, 5.0)
+    )
+    for value in (0.5, 1.0, 3.0, 10.0):
+      histogram.observe(value, model="m")
+
+    series = self.registry.to_dict()["metrics"]["latency_seconds"]["series"]
+
+    self.assertEqual(series[0]["buckets"], {"1.0": 2, "5.0": 3, "+Inf": 4})
+    self.assertEqual(series[0]["count"], 4)
+    self.assertAlmostEqual(series[0]["sum"], 14.5)
+
+  def test_to_prometheus(self):
+    self.registry.counter("tokens_total", "Tokens.").inc(7, model='a"b')
+    histogram = self.registry.histogram(
+        "latency_seconds", "Latency.", buckets=(1.0,)
+    )
+    histogram.observe(0.5)
+
+    self.assertEqual(
+        self.registry.to_prometheus(),
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{le="1.0"} 1\n'
+        'latency_seconds_bucket{le="+Inf"} 1\n'
+        "latency_seconds_sum 0.5\n"
+        "latency_seconds_count 1\n"
+        "# HELP tokens_total Tokens.\n"
+        "# TYPE tokens_total counter\n"
+        'tokens_total{model="a\\"b"} 7\n',
+    )
+
+  def test_dump_picks_format_from_extension(self):
+    self.registry.counter("calls_total", "Calls.").inc()
+    with tempfile.TemporaryDirectory() as temp_dir:
+      json_path = os.path.join(temp_dir, "metrics.json")
+      prom_path = os.path.join(temp_dir, "metrics.prom")
+      self.registry.dump(json_path)
+      self.registry.dump(prom_path)
+
+      with open(json_path) as f:
+        dumped = json.load(f)
+      with open(prom_path) as f:
+        prometheus_text = f.read()
+
+    series = dumped["metrics"]["calls_total"]["series"][0]
+    self.assertEqual(series["value"], 1)
+    self.assertIn("rate_per_sec", series)
+    self.assertIn("calls_total 1\n", prometheus_text)
+
+
+class TrackLlmCallTest(unittest.TestCase):
+
+  def test_records_latency_by_outcome_and_in_flight(self):
+    labels = {"backend": "test", "model": "track-llm-call"}
+
+    with metrics.track_llm_call(**labels):
+      self.assertEqual(metrics.LLM_CALLS_IN_FLIGHT.value(**labels), 1)
+    with self.assertRaises(RuntimeError):
+      with metrics.track_llm_call(**labels):
+        raise RuntimeError("boom")
+
+    self.assertEqual(metrics.LLM_CALLS_IN_FLIGHT.value(**labels), 0)
+    self.assertEqual(
+        metrics.LLM_CALL_LATENCY.value(outcome="success", **labels).count, 1
+    )
+    self.assertEqual(
+        metrics.LLM_CALL_LATENCY.value(outcome="error", **labels).count, 1
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
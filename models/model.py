@@ -15,9 +15,15 @@
 """Abstract class to interact with LLMs."""
 
 from abc import ABC, abstractmethod
-from typing import TypeVar
+import contextlib
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
 from pydantic import BaseModel
 
+from . import executor
+from . import split_merge
+from .model_util import DEFAULT_VERTEX_PARALLELISM
+
 # Generic type variable to use as a schema for LLM response, constrained to Pydantic models inheriting from BaseModel.
 SchemaType = TypeVar("SchemaType", bound=BaseModel)
 # Lists of Pydantic models (can be List[BaseModel] or List[AnyScalarType])
@@ -33,6 +39,11 @@ class Model(ABC):
 
   # The best batch size to use for categorization.
   categorization_batch_size: int = 100
+  # The input token limit of the model, if known. Longer prompts are sharded
+  # by `generate_data_in_shards` before the model is called.
+  max_input_tokens: Optional[int] = None
+  # How many prompts of a batch the default batch methods run at the same time.
+  batch_parallelism: int = DEFAULT_VERTEX_PARALLELISM
 
   @abstractmethod
   async def generate_text(self, prompt: str) -> str:
@@ -61,3 +72,202 @@ class Model(ABC):
         The model response parsed as an instance of the schema.
     """
     pass
+
+  async def generate_text_stream(self, prompt: str) -> AsyncIterator[str]:
+    """Generates a text response in chunks, as the model produces it.
+
+    By default the whole response is yielded as a single chunk. Models that
+    support streaming override this to yield the first chunk much earlier.
+
+    Args:
+        prompt: The instructions and data to process as a prompt.
+
+    Yields:
+        The chunks of the response text, in order.
+    """
+    yield await self.generate_text(prompt)
+
+  async def generate_data_stream(
+      self, prompt: str, schema: type[ListSchemaType]
+  ) -> AsyncIterator[Any]:
+    """Generates a list response and yields each element once it is complete.
+
+    By default the whole list is generated before its first element is
+    yielded. Models that support streaming override this to parse the list
+    incrementally.
+
+    Args:
+        prompt: The instructions and data to process as a prompt.
+        schema: The list schema to parse the response as, e.g. `List[Topic]`.
+
+    Yields:
+        The elements of the list, each parsed as the schema's element type.
+    """
+    for item in await self.generate_data(prompt, schema):
+      yield item
+
+  async def generate_data_in_shards(
+      self,
+      items: Sequence[Any],
+      make_prompt: Callable[[List[Any]], str],
+      schema: type[ListSchemaType],
+      reducer: Callable[[List[Any]], Any] = split_merge.concatenate,
+  ) -> Any:
+    """Generates structured data for a prompt built from a list of items.
+
+    If the prompt is over the model's input token limit, the items are split
+    into shards that fit, the shards are processed concurrently, and their
+    results are merged with `reducer`.
+
+    Args:
+        items: The items the prompt is built from, e.g. comments.
+        make_prompt: Builds the prompt for a list of items, including an empty
+          one.
+        schema: The list schema to parse each response as.
+        reducer: Merges the results of all shards, in item order. Defaults to
+          concatenating the lists.
+
+    Returns:
+        The model response for all items, parsed as the schema.
+    """
+    return await split_merge.generate_data_sharded(
+        self,
+        items,
+        make_prompt,
+        schema,
+        reducer=reducer,
+        max_prompt_tokens=self.max_input_tokens,
+    )
+
+  async def predict_batch(
+      self,
+      prompts: List[str],
+      schema: type[SchemaType] | type[ListSchemaType] | None = None,
+  ) -> List[Any]:
+    """Runs the prompts as a single offline batch prediction job.
+
+    Batch jobs don't use the online quota and are cheaper, but can take hours
+    to finish. Models that don't support them raise NotImplementedError.
+
+    Args:
+        prompts: The instructions and data to process, one prompt per request.
+        schema: The Pydantic model (or a list of Pydantic models/scalars) to
+          parse the responses as. If None, the responses are returned as text.
+
+    Returns:
+        The response to each prompt, in order, or the exception it failed with.
+    """
+    raise NotImplementedError(
+        f"{type(self).__name__} doesn't support batch prediction."
+    )
+
+  async def generate_text_batch(
+      self, prompts: Sequence[str]
+  ) -> List[str | Exception]:
+    """Generates a text response for each prompt of a batch.
+
+    Args:
+        prompts: The instructions and data to process, one prompt per response.
+
+    Returns:
+        The response to each prompt, in order, or the exception it failed with.
+    """
+    responses, _ = await self.generate_text_batch_timed(prompts)
+    return responses
+
+  async def generate_text_batch_timed(
+      self, prompts: Sequence[str]
+  ) -> Tuple[List[str | Exception], List[Optional[float]]]:
+    """Generates a text response for each prompt of a batch, timing each.
+
+    By default the prompts run concurrently through `generate_text`. Models
+    override this to run a batch more efficiently, e.g. as a batch job.
+
+    Args:
+        prompts: The instructions and data to process, one prompt per response.
+
+    Returns:
+        The response to each prompt, in order, or the exception it failed with,
+        and how long the call for each prompt took in seconds, or None for
+        prompts that weren't timed, e.g. in an offline batch job.
+    """
+    return await self._run_batch(prompts, self.generate_text)
+
+  async def generate_data_batch(
+      self,
+      prompts: Sequence[str],
+      schema: type[SchemaType] | type[ListSchemaType],
+  ) -> List[SchemaType | ListSchemaType | Exception]:
+    """Generates structured data for each prompt of a batch.
+
+    Args:
+        prompts: The instructions and data to process, one prompt per response.
+        schema: The Pydantic model (or a list of Pydantic models/scalars) to
+          parse every response as.
+
+    Returns:
+        The response to each prompt, in order, parsed as the schema, or the
+        exception it failed with.
+    """
+    responses, _ = await self.generate_data_batch_timed(prompts, schema)
+    return responses
+
+  async def generate_data_batch_timed(
+      self,
+      prompts: Sequence[str],
+      schema: type[SchemaType] | type[ListSchemaType],
+  ) -> Tuple[
+      List[SchemaType | ListSchemaType | Exception], List[Optional[float]]
+  ]:
+    """Generates structured data for each prompt of a batch, timing each.
+
+    By default the prompts run concurrently through `generate_data`. Models
+    override this to run a batch more efficiently, e.g. as a batch job.
+
+    Args:
+        prompts: The instructions and data to process, one prompt per response.
+        schema: The Pydantic model (or a list of Pydantic models/scalars) to
+          parse every response as.
+
+    Returns:
+        The response to each prompt, in order, parsed as the schema, or the
+        exception it failed with, and how long the call for each prompt took in
+        seconds, or None for prompts that weren't timed.
+    """
+    return await self._run_batch(prompts, self.generate_data, schema)
+
+  async def _run_batch(
+      self, prompts: Sequence[str], func: Callable, *args: Any
+  ) -> Tuple[List[Any], List[Optional[float]]]:
+    """Runs `func` once per distinct prompt, `batch_parallelism` at a time.
+
+    Returns:
+      The response to each prompt, and how long its call took in seconds.
+    """
+    # Repeated prompts share a single call
+    unique_prompts = list(dict.fromkeys(prompts))
+    responses: Dict[str, Any] = {}
+    runtimes_sec: Dict[str, float] = {}
+
+    async def timed_func(prompt: str, *args: Any) -> Any:
+      start_time = time.perf_counter()
+      try:
+        return await func(prompt, *args)
+      finally:
+        runtimes_sec[prompt] = time.perf_counter() - start_time
+
+    async with contextlib.aclosing(
+        executor.stream_tasks(
+            unique_prompts, timed_func, *args, limit=self.batch_parallelism
+        )
+    ) as outcomes:
+      async for outcome in outcomes:
+        responses[outcome.item] = (
+            outcome.error
+            if isinstance(outcome, executor.Error)
+            else outcome.value
+        )
+    return (
+        [responses[prompt] for prompt in prompts],
+        [runtimes_sec.get(prompt) for prompt in prompts],
+    )
@@ -14,7 +14,10 @@
 
 # Util class for models
 
+import dataclasses
 import os
+import typing
+from typing import Any, Optional
 
 # The maximum number of times a task should be retried.
 MAX_RETRIES = 4
@@ -22,9 +25,83 @@ MAX_RETRIES = 4
 MAX_LLM_RETRIES = 4
 # How long in seconds to wait between LLM calls.
 RETRY_DELAY_SEC = 10
+# How long in seconds a single LLM call may take before it is abandoned.
+CALL_TIMEOUT_SEC = 600
+# The MIME type of JSON responses.
+JSON_MIME_TYPE = "application/json"
+# Finish reasons of responses that would be blocked again on retry.
+BLOCKED_FINISH_REASONS = frozenset(
+    {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII"}
+)
 
 # Set default vertex parallelism (number of concurrent LLM calls) based on similarly named env var, or use default value
 parallelism_env_var = os.environ.get("DEFAULT_VERTEX_PARALLELISM")
 DEFAULT_VERTEX_PARALLELISM = (
     int(parallelism_env_var) if parallelism_env_var else 1000
 )
+
+# Input token limits of known models, by model name prefix.
+MAX_INPUT_TOKENS_BY_MODEL = {
+    "gemini-1.5-flash": 1_048_576,
+    "gemini-1.5-pro": 2_097_152,
+    "gemini-2.0-flash": 1_048_576,
+    "gemini-2.5-flash": 1_048_576,
+    "gemini-2.5-pro": 1_048_576,
+}
+
+
+def max_input_tokens(model_name: str) -> Optional[int]:
+  """Returns the input token limit of a known model, or None if unknown."""
+  prefixes = [
+      prefix
+      for prefix in MAX_INPUT_TOKENS_BY_MODEL
+      if model_name.startswith(prefix)
+  ]
+  if not prefixes:
+    return None
+  return MAX_INPUT_TOKENS_BY_MODEL[max(prefixes, key=len)]
+
+
+def fingerprint(value: Any, strict: bool = False) -> Any:
+  """Returns a JSON-serializable, stable representation of a value.
+
+  Used to build content hashes of requests and jobs, e.g. for caching.
+
+  Args:
+    value: The value to represent.
+    strict: Whether to raise for values that can't describe themselves,
+      instead of falling back to their repr, which may differ between runs,
+      e.g. by including an object address. Classes and type hints are still
+      represented by their repr, which is their qualified name.
+
+  Raises:
+    TypeError: If `strict` is set and the value has no stable representation.
+  """
+  if value is None or isinstance(value, (str, int, float, bool)):
+    return value
+  if isinstance(value, dict):
+    return {str(k): fingerprint(v, strict) for k, v in value.items()}
+  if isinstance(value, (list, tuple)):
+    return [fingerprint(v, strict) for v in value]
+  # Pydantic models and SDK schema objects can describe themselves as JSON:
+  # classes by their JSON schema, instances by their content.
+  if isinstance(value, type):
+    calls = [("model_json_schema", {})]
+  else:
+    calls = [("model_dump", {"mode": "json"}), ("to_json_dict", {})]
+  for method_name, kwargs in calls:
+    method = getattr(value, method_name, None)
+    if callable(method):
+      try:
+        return fingerprint(method(**kwargs), strict)
+      except TypeError:
+        continue
+  if strict:
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+      return fingerprint(dataclasses.asdict(value), strict)
+    if not isinstance(value, type) and typing.get_origin(value) is None:
+      raise TypeError(
+          f"A {type(value).__name__} has no stable representation to identify"
+          " it by."
+      )
+  return repr(value)
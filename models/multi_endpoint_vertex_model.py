@@ -0,0 +1,266 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A VertexModel that spreads calls over several locations and models."""
+
+import dataclasses
+import logging
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from vertexai.generative_models import (
+    GenerationConfig,
+    GenerativeModel,
+    GenerationResponse,
+)
+
+from . import metrics
+from .concurrency import AdaptiveConcurrencyLimiter
+from .credentials import SharedCredentials
+from .hedging import Hedger
+from .response_cache import ResponseCache
+from .retry_policy import NON_RETRYABLE_ERROR_CLASSES, classify_error
+from .vertex_model import VertexModel
+
+# Weight of the newest latency sample in an endpoint's moving latency average.
+LATENCY_EWMA_WEIGHT = 0.1
+
+ENDPOINT_AVAILABLE = metrics.default_registry.gauge(
+    "llm_endpoint_available",
+    "Whether an endpoint currently receives calls (1) or is failed over (0).",
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class VertexEndpoint:
+  """A model in a GCP location, and its share of the calls."""
+
+  location: str
+  model_name: str
+  weight: float = 1.0
+
+
+class _EndpointState:
+  """The client and health of one endpoint."""
+
+  def __init__(
+      self,
+      endpoint: VertexEndpoint,
+      make_llm: Callable[[str, str], GenerativeModel],
+  ):
+    self.endpoint = endpoint
+    self._make_llm = make_llm
+    self._llm: GenerativeModel | None = None
+    self.metric_labels = {
+        "backend": "vertex",
+        "model": endpoint.model_name,
+        "location": endpoint.location,
+    }
+    self.latency_sec: Optional[float] = None
+    self.consecutive_failures = 0
+    # Monotonic time until which the endpoint gets no calls
+    self.unavailable_until = 0.0
+    self.calls = 0
+    self.failures = 0
+
+  @property
+  def llm(self) -> GenerativeModel:
+    """The endpoint's client, created on first use."""
+    if self._llm is None:
+      self._llm = self._make_llm(
+          self.endpoint.location, self.endpoint.model_name
+      )
+    return self._llm
+
+  @llm.setter
+  def llm(self, llm: GenerativeModel):
+    self._llm = llm
+
+  def is_available(self, now: float) -> bool:
+    return self.unavailable_until <= now
+
+
+class MultiEndpointVertexModel(VertexModel):
+  """Spreads calls over several Vertex AI endpoints and fails over between them.
+
+  Each endpoint is a model in a location, so its calls count against that
+  location's quota. Calls go to a random available endpoint, with a chance
+  proportional to its weight divided by its relative latency. An endpoint that
+  fails `failure_threshold` calls in a row gets no calls for `cooldown_sec`,
+  and a failed call is retried right away on another available endpoint.
+  Errors caused by the request itself, like invalid arguments or blocked
+  content, don't count against an endpoint.
+  """
+
+  def __init__(
+      self,
+      project: str,
+      endpoints: List[VertexEndpoint],
+      response_cache: ResponseCache | None = None,
+      concurrency_limiter: AdaptiveConcurrencyLimiter | None = None,
+      hedger: Hedger | None = None,
+      credentials: SharedCredentials | None = None,
+      failure_threshold: int = 3,
+      cooldown_sec: float = 60.0,
+  ):
+    """Initializes the MultiEndpointVertexModel.
+
+    Args:
+      project: The GCP project to run the models in.
+      endpoints: The endpoints to spread calls over.
+      response_cache: An optional cache consulted before calling the model.
+      concurrency_limiter: An optional adaptive limiter every call waits for,
+        whichever endpoint it goes to.
+      hedger: An optional hedger that sends a duplicate of unusually slow
+        calls.
+      credentials: The credentials to call the models with. Defaults to the
+        application default credentials shared by all models.
+      failure_threshold: How many calls in a row must fail before an endpoint
+        is failed over.
+      cooldown_sec: How long a failed over endpoint gets no calls.
+    """
+    if not endpoints:
+      raise ValueError("At least one endpoint is required.")
+    first_endpoint = endpoints[0]
+    super().__init__(
+        project,
+        first_endpoint.location,
+        first_endpoint.model_name,
+        response_cache=response_cache,
+        concurrency_limiter=concurrency_limiter,
+        hedger=hedger,
+        credentials=credentials,
+    )
+    # Cached responses are shared by all endpoints
+    self.model_name = ",".join(
+        dict.fromkeys(endpoint.model_name for endpoint in endpoints)
+    )
+    self.failure_threshold = failure_threshold
+    self.cooldown_sec = cooldown_sec
+    self._endpoints = [
+        _EndpointState(endpoint, self._make_llm) for endpoint in endpoints
+    ]
+    for state in self._endpoints:
+      ENDPOINT_AVAILABLE.set(1, **state.metric_labels)
+
+  def _readmit_cooled_down(self, now: float):
+    """Puts endpoints whose cooldown is over back into rotation."""
+    for state in self._endpoints:
+      if state.unavailable_until and state.is_available(now):
+        state.unavailable_until = 0.0
+        ENDPOINT_AVAILABLE.set(1, **state.metric_labels)
+        logging.info(f"Endpoint {state.endpoint} is back after its cooldown.")
+
+  def _pick_endpoint(self, excluded: List[_EndpointState]) -> _EndpointState:
+    """Picks an endpoint for the next call, preferring fast ones."""
+    now = time.monotonic()
+    self._readmit_cooled_down(now)
+    candidates = [
+        state
+        for state in self._endpoints
+        if state.is_available(now) and state not in excluded
+    ]
+    if not candidates:
+      # Everything is failed over, so try the endpoint that recovers first
+      candidates = [
+          min(
+              (state for state in self._endpoints if state not in excluded),
+              key=lambda state: state.unavailable_until,
+          )
+      ]
+    known_latencies = [
+        state.latency_sec for state in candidates if state.latency_sec
+    ]
+    typical_latency = (
+        sum(known_latencies) / len(known_latencies) if known_latencies else 1.0
+    )
+    weights = [
+        state.endpoint.weight
+        * typical_latency
+        / (state.latency_sec or typical_latency)
+        for state in candidates
+    ]
+    return random.choices(candidates, weights=weights)[0]
+
+  def _record_success(self, state: _EndpointState, latency_sec: float):
+    state.calls += 1
+    state.consecutive_failures = 0
+    state.latency_sec = (
+        latency_sec
+        if state.latency_sec is None
+        else (1 - LATENCY_EWMA_WEIGHT) * state.latency_sec
+        + LATENCY_EWMA_WEIGHT * latency_sec
+    )
+    if state.unavailable_until:
+      state.unavailable_until = 0.0
+      ENDPOINT_AVAILABLE.set(1, **state.metric_labels)
+      logging.info(f"Endpoint {state.endpoint} recovered.")
+
+  def _record_failure(self, state: _EndpointState, error: Exception):
+    state.calls += 1
+    state.failures += 1
+    state.consecutive_failures += 1
+    if state.consecutive_failures >= self.failure_threshold:
+      state.unavailable_until = time.monotonic() + self.cooldown_sec
+      ENDPOINT_AVAILABLE.set(0, **state.metric_labels)
+      logging.warning(
+          f"Endpoint {state.endpoint} failed {state.consecutive_failures}"
+          f" calls in a row, failing over for {self.cooldown_sec}s: {error}"
+      )
+
+  async def _generate_content(
+      self, prompt: str, generation_config: GenerationConfig | None
+  ) -> GenerationResponse:
+    """Calls an endpoint, failing over to the others if it fails."""
+    await self.credentials.get_async()
+    tried = []
+    while True:
+      state = self._pick_endpoint(tried)
+      tried.append(state)
+      start_time = time.perf_counter()
+      try:
+        response = await self._generate_with(
+            state.llm, prompt, generation_config, state.metric_labels
+        )
+      except Exception as error:
+        # Errors caused by the request fail the same way on every endpoint
+        if classify_error(error) in NON_RETRYABLE_ERROR_CLASSES:
+          raise
+        self._record_failure(state, error)
+        if len(tried) == len(self._endpoints):
+          raise
+        logging.warning(
+            f"Call to endpoint {state.endpoint} failed, failing over: {error}"
+        )
+        continue
+      self._record_success(state, time.perf_counter() - start_time)
+      return response
+
+  def endpoint_stats(self) -> List[Dict[str, Any]]:
+    """Returns the health and latency of each endpoint."""
+    now = time.monotonic()
+    self._readmit_cooled_down(now)
+    return [
+        {
+            "location": state.endpoint.location,
+            "model_name": state.endpoint.model_name,
+            "weight": state.endpoint.weight,
+            "available": state.is_available(now),
+            "latency_sec": state.latency_sec,
+            "calls": state.calls,
+            "failures": state.failures,
+        }
+        for state in self._endpoints
+    ]
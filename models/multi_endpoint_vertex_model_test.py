@@ -0,0 +1,147 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from models import multi_endpoint_vertex_model
+from models.credentials import SharedCredentials
+from models.multi_endpoint_vertex_model import (
+    ENDPOINT_AVAILABLE,
+    MultiEndpointVertexModel,
+    VertexEndpoint,
+)
+
+
+def _make_model(**kwargs) -> MultiEndpointVertexModel:
+  endpoints = [
+      VertexEndpoint("us-central1", "model"),
+      VertexEndpoint("europe-west4", "model"),
+  ]
+  model = MultiEndpointVertexModel(
+      "project",
+      endpoints,
+      credentials=MagicMock(spec=SharedCredentials),
+      **kwargs,
+  )
+  for state in model._endpoints:
+    state.llm = MagicMock()
+  return model
+
+
+def _make_response(text: str) -> MagicMock:
+  response = MagicMock()
+  response.candidates[0].content.parts[0].text = text
+  response.text = text
+  return response
+
+
+class MultiEndpointVertexModelTest(unittest.IsolatedAsyncioTestCase):
+
+  def _llms(self, model: MultiEndpointVertexModel):
+    return [state.llm for state in model._endpoints]
+
+  async def test_fails_over_to_another_endpoint(self):
+    model = _make_model()
+    broken, healthy = self._llms(model)
+    broken.generate_content_async = AsyncMock(
+        side_effect=Exception("503 UNAVAILABLE")
+    )
+    healthy.generate_content_async = AsyncMock(
+        return_value=_make_response("text")
+    )
+
+    for _ in range(5):
+      self.assertEqual(await model.generate_text("prompt"), "text")
+
+    self.assertEqual(healthy.generate_content_async.call_count, 5)
+    stats = {stats["location"]: stats for stats in model.endpoint_stats()}
+    self.assertEqual(stats["europe-west4"]["failures"], 0)
+    self.assertEqual(
+        stats["us-central1"]["failures"],
+        broken.generate_content_async.call_count,
+    )
+
+  async def test_failing_endpoint_is_taken_out_of_rotation(self):
+    model = _make_model(failure_threshold=2, cooldown_sec=600)
+    broken, healthy = self._llms(model)
+    broken.generate_content_async = AsyncMock(
+        side_effect=Exception("429 Resource exhausted")
+    )
+    healthy.generate_content_async = AsyncMock(
+        return_value=_make_response("text")
+    )
+    model._endpoints[1].unavailable_until = float("inf")
+
+    # Only the broken endpoint is available until it is failed over
+    for _ in range(2):
+      await model.generate_text("prompt")
+    model._endpoints[1].unavailable_until = 0.0
+    for _ in range(10):
+      await model.generate_text("prompt")
+
+    self.assertEqual(broken.generate_content_async.call_count, 2)
+    self.assertFalse(model.endpoint_stats()[0]["available"])
+
+  async def test_endpoint_is_reported_available_after_its_cooldown(self):
+    model = _make_model(failure_threshold=1, cooldown_sec=600)
+    broken, healthy = self._llms(model)
+    broken.generate_content_async = AsyncMock(
+        side_effect=Exception("503 UNAVAILABLE")
+    )
+    healthy.generate_content_async = AsyncMock(
+        return_value=_make_response("text")
+    )
+    model._endpoints[1].unavailable_until = float("inf")
+    await model.generate_text("prompt")
+    model._endpoints[1].unavailable_until = 0.0
+    labels = model._endpoints[0].metric_labels
+    self.assertEqual(ENDPOINT_AVAILABLE.value(**labels), 0)
+
+    # The cooldown ends, and the next call goes to the other endpoint
+    model._endpoints[0].unavailable_until = time.monotonic() - 1
+    with patch.object(
+        multi_endpoint_vertex_model.random,
+        "choices",
+        side_effect=lambda candidates, weights: [candidates[-1]],
+    ):
+      await model.generate_text("prompt")
+
+    broken.generate_content_async.assert_awaited_once()
+
+    self.assertEqual(ENDPOINT_AVAILABLE.value(**labels), 1)
+    self.assertTrue(model.endpoint_stats()[0]["available"])
+
+  async def test_invalid_request_is_not_failed_over(self):
+    model = _make_model()
+    for llm in self._llms(model):
+      llm.generate_content_async = AsyncMock(
+          side_effect=Exception("400 INVALID_ARGUMENT")
+      )
+
+    with self.assertRaises(Exception):
+      await model.generate_text("prompt")
+
+    self.assertEqual(
+        sum(llm.generate_content_async.call_count for llm in self._llms(model)),
+        1,
+    )
+    self.assertTrue(
+        all(stats["failures"] == 0 for stats in model.endpoint_stats())
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
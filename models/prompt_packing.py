@@ -0,0 +1,173 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Packing of several small LLM jobs into a single request."""
+
+import json
+from typing import Any, Dict, List
+
+from google import genai
+import pydantic
+
+from . import json_repair
+from .model_util import JSON_MIME_TYPE, fingerprint
+
+# Only JSON responses can be split back into per-job results.
+PACKABLE_MIME_TYPE = JSON_MIME_TYPE
+# Maximum number of jobs combined into a single request.
+MAX_JOBS_PER_PACK = 20
+
+
+def task_id(index: int) -> str:
+  return f"task_{index + 1}"
+
+
+def build_packed_prompt(prompts: List[str]) -> str:
+  """Combines several prompts into one prompt asking for a keyed response."""
+  task_ids = [task_id(i) for i in range(len(prompts))]
+  tasks = "\n\n".join(
+      f'<task id="{task_ids[i]}">\n{prompt}\n</task>'
+      for i, prompt in enumerate(prompts)
+  )
+  return f"""You are given {len(prompts)} independent tasks. Complete each task separately, as if it were the only one.
+Respond with a single JSON object with exactly these keys: {", ".join(task_ids)}.
+The value of each key must be the complete JSON response to the task with that id.
+
+{tasks}"""
+
+
+def build_packed_schema(response_schema: Any, count: int) -> Any:
+  """Returns a response schema for an object keyed by task id.
+
+  Args:
+    response_schema: The response schema shared by all packed jobs. Can be a
+      JSON schema dict, a `genai.types.Schema`, a type such as a Pydantic model,
+      or None.
+    count: The number of packed jobs.
+
+  Returns:
+    A schema of the same kind that requires one response per task id.
+  """
+  task_ids = [task_id(i) for i in range(count)]
+  if response_schema is None:
+    return None
+  if isinstance(response_schema, dict):
+    return {
+        "type": "OBJECT",
+        "properties": {tid: response_schema for tid in task_ids},
+        "required": task_ids,
+        "property_ordering": task_ids,
+    }
+  if isinstance(response_schema, genai.types.Schema):
+    return genai.types.Schema(
+        type=genai.types.Type.OBJECT,
+        properties={tid: response_schema for tid in task_ids},
+        required=task_ids,
+        property_ordering=task_ids,
+    )
+  return pydantic.create_model(
+      "PackedResponse", **{tid: (response_schema, ...) for tid in task_ids}
+  )
+
+
+def split_packed_response(text: str, count: int) -> List[str]:
+  """Splits a keyed JSON response into the JSON response text of each task.
+
+  Raises:
+    ValueError: If the response is not a JSON object with every task id.
+  """
+  try:
+    salvaged = json_repair.repair_json(text)
+  except ValueError as e:
+    raise ValueError(f"Packed response is not valid JSON: {e}") from e
+  response = salvaged.value
+  if not isinstance(response, dict):
+    raise ValueError("Packed response is not a JSON object.")
+  task_ids = [task_id(i) for i in range(count)]
+  missing_ids = [tid for tid in task_ids if tid not in response]
+  if missing_ids:
+    raise ValueError(f"Packed response is missing tasks: {missing_ids}")
+  json_repair.record_salvage(salvaged, backend="packed")
+  return [json.dumps(response[tid], ensure_ascii=False) for tid in task_ids]
+
+
+class JobPacker:
+  """Groups small jobs with the same system prompt and schema into packs.
+
+  Jobs are added one at a time. Jobs that cannot be packed are returned right
+  away; packable jobs are held until their pack would exceed the token budget,
+  at which point the full pack is returned. `flush` returns the remaining packs.
+  """
+
+  def __init__(self, token_budget: int, max_jobs: int = MAX_JOBS_PER_PACK):
+    """Initializes the JobPacker.
+
+    Args:
+      token_budget: The maximum combined input tokens of a pack.
+      max_jobs: The maximum number of jobs in a pack.
+    """
+    self.token_budget = token_budget
+    self.max_jobs = max_jobs
+    self._open_packs: Dict[str, List[Dict[str, Any]]] = {}
+
+  def add(self, job: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Adds a job, returning the jobs and packs that are ready to be run."""
+    tokens = job["stats"]["combined_tokens"]
+    if (
+        job["response_mime_type"] != PACKABLE_MIME_TYPE
+        or tokens * 2 > self.token_budget
+    ):
+      return [job]
+
+    group_key = json.dumps(
+        fingerprint([job["system_prompt"], job["response_schema"]]),
+        sort_keys=True,
+    )
+    ready = []
+    pack = self._open_packs.setdefault(group_key, [])
+    pack_tokens = sum(member["stats"]["combined_tokens"] for member in pack)
+    if pack and (
+        pack_tokens + tokens > self.token_budget or len(pack) >= self.max_jobs
+    ):
+      ready.append(self._make_pack(pack))
+      pack = self._open_packs[group_key] = []
+    pack.append(job)
+    return ready
+
+  def flush(self) -> List[Dict[str, Any]]:
+    """Returns all packs that are still open."""
+    ready = [self._make_pack(pack) for pack in self._open_packs.values()]
+    self._open_packs = {}
+    return ready
+
+  def _make_pack(self, jobs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    if len(jobs) == 1:
+      return jobs[0]
+    first_job = jobs[0]
+    return {
+        **first_job,
+        "topic": f"pack of {len(jobs)} topics",
+        "prompt": build_packed_prompt([job["prompt"] for job in jobs]),
+        "allocations": None,
+        "stats": {
+            "combined_tokens": sum(
+                job["stats"]["combined_tokens"] for job in jobs
+            )
+        },
+        "response_schema": build_packed_schema(
+            first_job["response_schema"], len(jobs)
+        ),
+        "journal_key": None,
+        "packed_jobs": jobs,
+    }
@@ -0,0 +1,76 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from models import prompt_packing
+import pydantic
+
+
+def _make_job(prompt: str, tokens: int, system_prompt: str = "System"):
+  return {
+      "prompt": prompt,
+      "stats": {"combined_tokens": tokens},
+      "system_prompt": system_prompt,
+      "response_mime_type": "application/json",
+      "response_schema": {"type": "ARRAY", "items": {"type": "STRING"}},
+  }
+
+
+class Topic(pydantic.BaseModel):
+  name: str
+
+
+class PromptPackingTest(unittest.TestCase):
+
+  def test_packer_groups_compatible_jobs_within_budget(self):
+    packer = prompt_packing.JobPacker(token_budget=100)
+
+    ready = []
+    ready += packer.add(_make_job("a", 40))
+    ready += packer.add(_make_job("b", 40, system_prompt="Other"))
+    ready += packer.add(_make_job("c", 40))
+    ready += packer.add(_make_job("d", 40))
+    ready += packer.add(_make_job("big", 80))
+    ready += packer.flush()
+
+    prompts = [
+        [job["prompt"] for job in ready_job["packed_jobs"]]
+        if "packed_jobs" in ready_job
+        else ready_job["prompt"]
+        for ready_job in ready
+    ]
+    self.assertEqual(prompts, [["a", "c"], "big", "d", "b"])
+
+  def test_build_packed_schema_for_pydantic_types(self):
+    schema = prompt_packing.build_packed_schema(list[Topic], 2)
+
+    response = schema.model_validate_json(
+        '{"task_1": [{"name": "a"}], "task_2": []}'
+    )
+
+    self.assertEqual(response.task_1, [Topic(name="a")])
+
+  def test_split_packed_response(self):
+    texts = prompt_packing.split_packed_response(
+        '{"task_2": ["b"], "task_1": ["a"]}', 2
+    )
+
+    self.assertEqual(texts, ['["a"]', '["b"]'])
+    with self.assertRaises(ValueError):
+      prompt_packing.split_packed_response('{"task_1": ["a"]}', 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
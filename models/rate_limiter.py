@@ -0,0 +1,110 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Quota-aware rate limiting shared by concurrent LLM workers."""
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+
+class _TokenBucket:
+  """A token bucket that refills continuously up to a per-minute capacity."""
+
+  def __init__(self, per_minute: float):
+    if per_minute <= 0:
+      raise ValueError("Per-minute capacity must be positive.")
+    self.capacity = float(per_minute)
+    self.refill_rate_per_sec = self.capacity / 60.0
+    self.available = self.capacity
+    self.last_refill = time.monotonic()
+
+  def refill(self, now: float):
+    elapsed = max(0.0, now - self.last_refill)
+    self.available = min(
+        self.capacity, self.available + elapsed * self.refill_rate_per_sec
+    )
+    self.last_refill = now
+
+  def seconds_until_available(self, amount: float) -> float:
+    deficit = amount - self.available
+    if deficit <= 0:
+      return 0.0
+    return deficit / self.refill_rate_per_sec
+
+
+class RateLimiter:
+  """Limits requests per minute (RPM) and tokens per minute (TPM).
+
+  All workers share one limiter and call `acquire` before each API call. A
+  call only goes out once both buckets can cover it, so throughput follows the
+  configured quota rather than a fixed sleep between calls. Waiters are served
+  in arrival order so a large request is not starved by smaller ones.
+  """
+
+  def __init__(
+      self,
+      requests_per_minute: Optional[int] = None,
+      tokens_per_minute: Optional[int] = None,
+  ):
+    """Initializes the RateLimiter.
+
+    Args:
+      requests_per_minute: Maximum number of calls per minute, or None for no
+        request limit.
+      tokens_per_minute: Maximum number of input tokens per minute, or None for
+        no token limit.
+    """
+    self.request_bucket = (
+        _TokenBucket(requests_per_minute) if requests_per_minute else None
+    )
+    self.token_bucket = (
+        _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+    )
+    self._lock = asyncio.Lock()
+
+  async def acquire(self, tokens: int = 0):
+    """Waits until the quota allows one call consuming `tokens` input tokens.
+
+    Args:
+      tokens: The number of tokens the call is expected to consume. Requests
+        bigger than the whole per-minute token budget are charged the full
+        budget, so they wait for an empty minute instead of forever.
+    """
+    async with self._lock:
+      while True:
+        now = time.monotonic()
+        wait_sec = 0.0
+        token_cost = 0.0
+        if self.request_bucket:
+          self.request_bucket.refill(now)
+          wait_sec = self.request_bucket.seconds_until_available(1)
+        if self.token_bucket:
+          self.token_bucket.refill(now)
+          token_cost = min(float(tokens), self.token_bucket.capacity)
+          wait_sec = max(
+              wait_sec, self.token_bucket.seconds_until_available(token_cost)
+          )
+        if wait_sec <= 0:
+          break
+        logging.debug(
+            f"Rate limit reached, waiting {wait_sec:.2f} seconds for quota."
+        )
+        await asyncio.sleep(wait_sec)
+
+      if self.request_bucket:
+        self.request_bucket.available -= 1
+      if self.token_bucket:
+        self.token_bucket.available -= token_cost
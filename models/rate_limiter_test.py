@@ -0,0 +1,79 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+from unittest.mock import MagicMock, patch
+
+from models import rate_limiter
+
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.now = 0.0
+    self.sleeps = []
+    mock_time = MagicMock()
+    mock_time.monotonic.side_effect = lambda: self.now
+    time_patcher = patch.object(rate_limiter, "time", mock_time)
+    time_patcher.start()
+    self.addCleanup(time_patcher.stop)
+
+    async def fake_sleep(seconds):
+      self.sleeps.append(seconds)
+      self.now += seconds
+
+    sleep_patcher = patch.object(rate_limiter.asyncio, "sleep", fake_sleep)
+    sleep_patcher.start()
+    self.addCleanup(sleep_patcher.stop)
+
+  async def test_acquire_within_quota_does_not_wait(self):
+    limiter = rate_limiter.RateLimiter(
+        requests_per_minute=3, tokens_per_minute=3000
+    )
+
+    for _ in range(3):
+      await limiter.acquire(1000)
+
+    self.assertEqual(self.sleeps, [])
+
+  async def test_acquire_waits_for_request_quota(self):
+    limiter = rate_limiter.RateLimiter(requests_per_minute=2)
+
+    await limiter.acquire()
+    await limiter.acquire()
+    await limiter.acquire()
+
+    # One request refills every 30 seconds at 2 RPM.
+    self.assertAlmostEqual(sum(self.sleeps), 30.0)
+
+  async def test_acquire_charges_token_budget(self):
+    limiter = rate_limiter.RateLimiter(tokens_per_minute=600)
+
+    await limiter.acquire(500)
+    await limiter.acquire(300)
+
+    # 200 missing tokens refill at 10 tokens per second.
+    self.assertAlmostEqual(sum(self.sleeps), 20.0)
+
+  async def test_oversized_request_is_capped_at_budget(self):
+    limiter = rate_limiter.RateLimiter(tokens_per_minute=100)
+
+    await limiter.acquire(50)
+    await limiter.acquire(1000)
+
+    self.assertAlmostEqual(sum(self.sleeps), 30.0)
+
+
+if __name__ == "__main__":
+  unittest.main()
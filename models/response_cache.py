@@ -0,0 +1,167 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Persistent, content-addressed cache for LLM responses."""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from .model_util import fingerprint
+
+# Default maximum number of responses kept in the cache.
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+class ResponseCache:
+  """An on-disk SQLite cache of LLM responses keyed by a hash of the request.
+
+  Entries are evicted least-recently-used first once the cache holds more than
+  `max_entries` responses, and entries older than `ttl_sec` are never returned.
+  Values must be JSON-serializable.
+  """
+
+  def __init__(
+      self,
+      path: str,
+      max_entries: int = DEFAULT_MAX_ENTRIES,
+      ttl_sec: Optional[float] = None,
+  ):
+    """Initializes the ResponseCache.
+
+    Args:
+      path: The SQLite database file to store responses in.
+      max_entries: The maximum number of responses to keep.
+      ttl_sec: How long in seconds a response stays valid, or None to keep
+        responses until they are evicted.
+    """
+    if os.path.dirname(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+    self.path = path
+    self.max_entries = max_entries
+    self.ttl_sec = ttl_sec
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._conn = sqlite3.connect(path)
+    self._conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses ("
+        " key TEXT PRIMARY KEY,"
+        " value TEXT NOT NULL,"
+        " created_at REAL NOT NULL,"
+        " last_accessed REAL NOT NULL)"
+    )
+    self._conn.execute(
+        "CREATE INDEX IF NOT EXISTS responses_last_accessed"
+        " ON responses (last_accessed)"
+    )
+    self._conn.commit()
+
+  @staticmethod
+  def make_key(
+      model_name: str,
+      prompt: str,
+      system_prompt: Optional[str] = None,
+      response_schema: Any = None,
+      response_mime_type: Optional[str] = None,
+      temperature: float = 0.0,
+  ) -> str:
+    """Returns the content hash identifying a single LLM request."""
+    payload = json.dumps(
+        {
+            "model_name": model_name,
+            "prompt": prompt,
+            "system_prompt": system_prompt,
+            "response_schema": fingerprint(response_schema),
+            "response_mime_type": response_mime_type,
+            "temperature": temperature,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+  def get(self, key: str) -> Optional[Any]:
+    """Returns the cached value for `key`, or None on a miss."""
+    now = time.time()
+    row = self._conn.execute(
+        "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+    ).fetchone()
+    if row and self.ttl_sec is not None and now - row[1] > self.ttl_sec:
+      self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+      self._conn.commit()
+      self.evictions += 1
+      row = None
+    if not row:
+      self.misses += 1
+      return None
+
+    self._conn.execute(
+        "UPDATE responses SET last_accessed = ? WHERE key = ?", (now, key)
+    )
+    self._conn.commit()
+    self.hits += 1
+    return json.loads(row[0])
+
+  def put(self, key: str, value: Any):
+    """Stores `value` under `key`, evicting old entries if over capacity."""
+    now = time.time()
+    self._conn.execute(
+        "INSERT OR REPLACE INTO responses (key, value, created_at,"
+        " last_accessed) VALUES (?, ?, ?, ?)",
+        (key, json.dumps(value, ensure_ascii=False), now, now),
+    )
+    self._evict(now)
+    self._conn.commit()
+
+  def _evict(self, now: float):
+    if self.ttl_sec is not None:
+      cursor = self._conn.execute(
+          "DELETE FROM responses WHERE created_at < ?", (now - self.ttl_sec,)
+      )
+      self.evictions += max(cursor.rowcount, 0)
+    (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+    if count > self.max_entries:
+      cursor = self._conn.execute(
+          "DELETE FROM responses WHERE key IN (SELECT key FROM responses"
+          " ORDER BY last_accessed ASC LIMIT ?)",
+          (count - self.max_entries,),
+      )
+      self.evictions += max(cursor.rowcount, 0)
+
+  def stats(self) -> Dict[str, Any]:
+    """Returns hit/miss statistics for this cache instance."""
+    (entries,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+    lookups = self.hits + self.misses
+    return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "hit_rate": self.hits / lookups if lookups else 0.0,
+        "evictions": self.evictions,
+        "entries": entries,
+    }
+
+  def log_stats(self):
+    stats = self.stats()
+    logging.info(
+        f"Response cache: {stats['hits']} hits, {stats['misses']} misses"
+        f" ({stats['hit_rate']:.1%} hit rate), {stats['entries']} entries."
+    )
+
+  def close(self):
+    self._conn.close()
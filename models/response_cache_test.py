@@ -0,0 +1,91 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from models import response_cache
+from models.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.TemporaryDirectory()
+    self.addCleanup(self.temp_dir.cleanup)
+    self.path = os.path.join(self.temp_dir.name, "cache.sqlite")
+
+  def test_make_key_depends_on_all_request_fields(self):
+    key = ResponseCache.make_key("model", "prompt")
+
+    self.assertEqual(key, ResponseCache.make_key("model", "prompt"))
+    self.assertNotEqual(key, ResponseCache.make_key("other", "prompt"))
+    self.assertNotEqual(
+        key, ResponseCache.make_key("model", "prompt", system_prompt="sys")
+    )
+    self.assertNotEqual(
+        key,
+        ResponseCache.make_key(
+            "model", "prompt", response_schema={"type": "ARRAY"}
+        ),
+    )
+    self.assertNotEqual(
+        key, ResponseCache.make_key("model", "prompt", temperature=0.5)
+    )
+
+  def test_get_and_put_persist_across_instances(self):
+    cache = ResponseCache(self.path)
+    key = ResponseCache.make_key("model", "prompt")
+    self.assertIsNone(cache.get(key))
+    cache.put(key, {"text": "response", "input_token_count": 10})
+    cache.close()
+
+    reopened_cache = ResponseCache(self.path)
+    self.assertEqual(
+        reopened_cache.get(key), {"text": "response", "input_token_count": 10}
+    )
+    self.assertEqual(reopened_cache.stats()["hits"], 1)
+    reopened_cache.close()
+
+  def test_evicts_least_recently_used_entries(self):
+    cache = ResponseCache(self.path, max_entries=2)
+    with patch.object(response_cache.time, "time", side_effect=range(10)):
+      cache.put("a", "A")
+      cache.put("b", "B")
+      cache.get("a")
+      cache.put("c", "C")
+
+    self.assertEqual(cache.get("a"), "A")
+    self.assertIsNone(cache.get("b"))
+    self.assertEqual(cache.get("c"), "C")
+    self.assertEqual(cache.stats()["evictions"], 1)
+    cache.close()
+
+  def test_expired_entries_are_misses(self):
+    cache = ResponseCache(self.path, ttl_sec=60)
+    with patch.object(response_cache.time, "time", return_value=0):
+      cache.put("a", "A")
+    with patch.object(response_cache.time, "time", return_value=61):
+      self.assertIsNone(cache.get("a"))
+
+    stats = cache.stats()
+    self.assertEqual(stats["misses"], 1)
+    self.assertEqual(stats["entries"], 0)
+    cache.close()
+
+
+if __name__ == "__main__":
+  unittest.main()
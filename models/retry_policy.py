@@ -0,0 +1,297 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Retry decisions shared by the model wrappers.
+
+Errors are classified to decide whether a retry can help at all. Retries wait
+for the server's Retry-After hint when there is one and use decorrelated
+jitter otherwise, so that many workers failing together don't retry together.
+All retries in the process draw from a shared `RetryBudget`, which stops a
+retry storm from piling onto an endpoint that is already struggling.
+"""
+
+import asyncio
+import collections
+import enum
+import logging
+import random
+import re
+import time
+from typing import Optional
+
+from . import deadline
+from . import metrics
+
+# The longest delay between two attempts, unless the server asks for longer.
+DEFAULT_MAX_DELAY_SEC = 300.0
+# Part of the message of errors for prompts over the input token limit.
+TOKEN_LIMIT_MESSAGE = "exceeds the maximum number of tokens allowed"
+
+RETRIES_DENIED = metrics.default_registry.counter(
+    "llm_retries_denied_total",
+    "Retries skipped because the process-wide retry budget was exhausted.",
+)
+
+
+class ResponseBlockedError(Exception):
+  """The model refused to respond, e.g. because of its safety filters."""
+
+
+class InvalidResponseError(Exception):
+  """The model returned an empty or otherwise unusable response."""
+
+
+class TokenLimitExceededError(Exception):
+  """The prompt has more tokens than the model accepts."""
+
+
+def is_token_limit_error(error: Optional[BaseException]) -> bool:
+  """Returns whether an error says the prompt has too many tokens."""
+  return isinstance(error, TokenLimitExceededError) or (
+      error is not None and TOKEN_LIMIT_MESSAGE in str(error)
+  )
+
+
+class ErrorClass(str, enum.Enum):
+  """What an error says about whether retrying can help."""
+
+  # Rate limit or quota exceeded (429). Retrying later helps.
+  QUOTA = "quota"
+  # Server-side failure (500, 502, 503) or a dropped connection.
+  TRANSIENT = "transient"
+  # The call took too long.
+  DEADLINE = "deadline"
+  # Bad request, e.g. too many input tokens. Fails the same way on retry.
+  INVALID_ARGUMENT = "invalid_argument"
+  # The response was blocked. Fails the same way on retry.
+  SAFETY = "safety"
+  # The model responded, but not with something usable.
+  INVALID_RESPONSE = "invalid_response"
+  # Anything else, retried to be safe.
+  UNKNOWN = "unknown"
+
+
+NON_RETRYABLE_ERROR_CLASSES = frozenset(
+    {ErrorClass.INVALID_ARGUMENT, ErrorClass.SAFETY}
+)
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+  """Returns the HTTP status code of an API error, if it has one."""
+  code = getattr(error, "code", None)
+  if isinstance(code, int):
+    return code
+  # Google API errors without a code attribute start with the status code
+  match = re.match(r"([45]\d\d)(?!\d)", str(error))
+  return int(match.group(1)) if match else None
+
+
+def classify_error(error: Optional[BaseException]) -> ErrorClass:
+  """Classifies an API error, or None for a response that failed validation.
+
+  The status code of the error decides, if it has one, and only errors
+  without one are classified by their message.
+  """
+  if error is None or isinstance(error, InvalidResponseError):
+    return ErrorClass.INVALID_RESPONSE
+  if isinstance(error, ResponseBlockedError):
+    return ErrorClass.SAFETY
+  if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+    return ErrorClass.DEADLINE
+  # Token counts in the message may contain e.g. "429"
+  if is_token_limit_error(error):
+    return ErrorClass.INVALID_ARGUMENT
+
+  code = _status_code(error)
+  if code is not None:
+    if code == 429:
+      return ErrorClass.QUOTA
+    if code in (408, 504):
+      return ErrorClass.DEADLINE
+    if 400 <= code < 500:
+      return ErrorClass.INVALID_ARGUMENT
+    if code >= 500:
+      return ErrorClass.TRANSIENT
+
+  message = str(error)
+  if "DEADLINE_EXCEEDED" in message or "Deadline Exceeded" in message:
+    return ErrorClass.DEADLINE
+  if (
+      re.search(r"\b429\b", message)
+      or re.search(r"resource[ _]exhausted", message, re.IGNORECASE)
+      or "Quota exceeded" in message
+  ):
+    return ErrorClass.QUOTA
+  if "INVALID_ARGUMENT" in message:
+    return ErrorClass.INVALID_ARGUMENT
+  if (
+      isinstance(error, ConnectionError)
+      or "UNAVAILABLE" in message
+      or "INTERNAL" in message
+  ):
+    return ErrorClass.TRANSIENT
+  return ErrorClass.UNKNOWN
+
+
+def retry_after_sec(error: Optional[BaseException]) -> Optional[float]:
+  """Returns how long the server asked to wait before retrying, if it did.
+
+  Reads the Retry-After header of the HTTP response, or the `retryDelay` of
+  the RetryInfo details included in Google API error messages.
+  """
+  if error is None:
+    return None
+  headers = getattr(getattr(error, "response", None), "headers", None)
+  if headers:
+    try:
+      value = headers.get("Retry-After") or headers.get("retry-after")
+      if value:
+        return max(0.0, float(value))
+    except (AttributeError, TypeError, ValueError):
+      pass  # Not a number of seconds, e.g. an HTTP date
+  match = re.search(
+      r"retry(?:Delay['\"]?\s*:\s*['\"]?| in )(\d+(?:\.\d+)?)s",
+      str(error),
+      re.IGNORECASE,
+  )
+  return float(match.group(1)) if match else None
+
+
+class RetryBudget:
+  """Caps retries at a fraction of recent requests.
+
+  Within the sliding window, retries are allowed while they number fewer than
+  `ratio` times the requests, or `min_retries_per_sec` times the window length
+  when traffic is low. Once an endpoint fails most calls, retries stop until
+  first attempts succeed again, instead of multiplying the load.
+  """
+
+  def __init__(
+      self,
+      ratio: float = 0.2,
+      min_retries_per_sec: float = 0.5,
+      window_sec: float = 60.0,
+  ):
+    self.ratio = ratio
+    self.min_retries_per_sec = min_retries_per_sec
+    self.window_sec = window_sec
+    self._requests = collections.deque()
+    self._retries = collections.deque()
+
+  def _prune(self, now: float):
+    for timestamps in (self._requests, self._retries):
+      while timestamps and now - timestamps[0] > self.window_sec:
+        timestamps.popleft()
+
+  def record_request(self):
+    """Records a first attempt of a call."""
+    now = time.monotonic()
+    self._prune(now)
+    self._requests.append(now)
+
+  def try_spend(self) -> bool:
+    """Records a retry and returns True if the budget allows one."""
+    now = time.monotonic()
+    self._prune(now)
+    allowed = max(
+        self.ratio * len(self._requests),
+        self.min_retries_per_sec * self.window_sec,
+    )
+    if len(self._retries) >= allowed:
+      return False
+    self._retries.append(now)
+    return True
+
+
+# The budget shared by all retry policies in the process.
+default_retry_budget = RetryBudget()
+
+
+class RetryPolicy:
+  """Decides whether and when to retry a failed call."""
+
+  def __init__(
+      self,
+      max_attempts: int,
+      base_delay_sec: float,
+      max_delay_sec: float = DEFAULT_MAX_DELAY_SEC,
+      budget: Optional[RetryBudget] = default_retry_budget,
+  ):
+    """Initializes the RetryPolicy.
+
+    Args:
+      max_attempts: The maximum number of attempts per call, including the
+        first one.
+      base_delay_sec: The shortest delay between two attempts.
+      max_delay_sec: The longest delay between two attempts, unless the server
+        asks for longer.
+      budget: The retry budget to draw from, or None to not limit retries.
+    """
+    self.max_attempts = max_attempts
+    self.base_delay_sec = base_delay_sec
+    self.max_delay_sec = max(max_delay_sec, base_delay_sec)
+    self.budget = budget
+
+  def record_attempt(self, attempt: int):
+    """Records that attempt number `attempt` (starting at 1) is being made."""
+    if attempt == 1 and self.budget:
+      self.budget.record_request()
+
+  def next_delay(
+      self,
+      error: Optional[BaseException],
+      attempt: int,
+      previous_delay_sec: Optional[float] = None,
+  ) -> Optional[float]:
+    """Returns how long to wait before retrying, or None to give up.
+
+    Args:
+      error: The error of the failed attempt, or None if the response failed
+        validation.
+      attempt: The number of the failed attempt, starting at 1.
+      previous_delay_sec: The delay before the failed attempt, if it was a
+        retry.
+    """
+    error_class = classify_error(error)
+    if error_class in NON_RETRYABLE_ERROR_CLASSES:
+      logging.warning(f"Not retrying a call that failed with {error_class}.")
+      return None
+    if attempt >= self.max_attempts:
+      return None
+
+    hint_sec = retry_after_sec(error)
+    if hint_sec is not None:
+      # Never retry earlier than asked, and spread out the retries a little
+      delay_sec = hint_sec * random.uniform(1.0, 1.2)
+    else:
+      # Decorrelated jitter: each delay is random between the base delay and
+      # three times the previous one, which grows the delays without syncing
+      # callers that failed at the same time.
+      upper_sec = max(
+          self.base_delay_sec, (previous_delay_sec or self.base_delay_sec) * 3
+      )
+      delay_sec = min(
+          self.max_delay_sec, random.uniform(self.base_delay_sec, upper_sec)
+      )
+
+    # A retry that can't start before the run deadline can't succeed
+    remaining_sec = deadline.remaining_sec()
+    if remaining_sec is not None and delay_sec >= remaining_sec:
+      logging.warning("Not retrying, as the run deadline would pass first.")
+      return None
+    if self.budget and not self.budget.try_spend():
+      logging.warning("Retry budget exhausted. Not retrying.")
+      RETRIES_DENIED.inc(error_class=error_class.value)
+      return None
+    return delay_sec
@@ -0,0 +1,167 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+from unittest.mock import MagicMock
+
+from models import deadline
+from models import retry_policy
+from models.retry_policy import ErrorClass
+
+
+class _ApiError(Exception):
+
+  def __init__(self, code: int, message: str = "", headers=None):
+    super().__init__(f"{code} {message}")
+    self.code = code
+    self.response = MagicMock(headers=headers or {})
+
+
+class ClassifyErrorTest(unittest.TestCase):
+
+  def test_classifies_errors(self):
+    cases = [
+        (_ApiError(429, "RESOURCE_EXHAUSTED"), ErrorClass.QUOTA),
+        (Exception("Quota exceeded for aiplatform"), ErrorClass.QUOTA),
+        (_ApiError(503, "UNAVAILABLE"), ErrorClass.TRANSIENT),
+        (ConnectionResetError(), ErrorClass.TRANSIENT),
+        (asyncio.TimeoutError(), ErrorClass.DEADLINE),
+        (_ApiError(504, "DEADLINE_EXCEEDED"), ErrorClass.DEADLINE),
+        (
+            Exception("input exceeds the maximum number of tokens allowed"),
+            ErrorClass.INVALID_ARGUMENT,
+        ),
+        (_ApiError(400, "INVALID_ARGUMENT"), ErrorClass.INVALID_ARGUMENT),
+        (retry_policy.ResponseBlockedError("SAFETY"), ErrorClass.SAFETY),
+        (None, ErrorClass.INVALID_RESPONSE),
+        (ValueError("Something else"), ErrorClass.UNKNOWN),
+        (Exception("Resource exhausted, try again"), ErrorClass.QUOTA),
+        (Exception("Error 429: slow down"), ErrorClass.QUOTA),
+        (Exception("Request 14290 failed"), ErrorClass.UNKNOWN),
+    ]
+    for error, expected in cases:
+      with self.subTest(error=repr(error)):
+        self.assertEqual(retry_policy.classify_error(error), expected)
+
+  def test_numbers_in_message_do_not_override_status_code(self):
+    cases = [
+        (
+            _ApiError(
+                400,
+                "The input token count (1429001) exceeds the maximum number"
+                " of tokens allowed (1048576).",
+            ),
+            ErrorClass.INVALID_ARGUMENT,
+        ),
+        (
+            Exception(
+                "400 The input token count (2429000) exceeds the maximum"
+                " number of tokens allowed (1048576)."
+            ),
+            ErrorClass.INVALID_ARGUMENT,
+        ),
+        (
+            Exception("400 Request contains 429 invalid fields."),
+            ErrorClass.INVALID_ARGUMENT,
+        ),
+        (_ApiError(500, "request id 84290"), ErrorClass.TRANSIENT),
+        (_ApiError(500, "request id 429"), ErrorClass.TRANSIENT),
+    ]
+    for error, expected in cases:
+      with self.subTest(error=repr(error)):
+        self.assertEqual(retry_policy.classify_error(error), expected)
+
+  def test_retry_after_from_header_and_retry_info(self):
+    self.assertEqual(
+        retry_policy.retry_after_sec(
+            _ApiError(429, headers={"Retry-After": "12"})
+        ),
+        12.0,
+    )
+    self.assertEqual(
+        retry_policy.retry_after_sec(
+            Exception(
+                "429 RESOURCE_EXHAUSTED. {'@type':"
+                " 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay':"
+                " '37s'}"
+            )
+        ),
+        37.0,
+    )
+    self.assertIsNone(retry_policy.retry_after_sec(Exception("500")))
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+  def test_decorrelated_jitter_stays_within_bounds(self):
+    policy = retry_policy.RetryPolicy(
+        max_attempts=100, base_delay_sec=1, max_delay_sec=20, budget=None
+    )
+    delay = None
+    for attempt in range(1, 50):
+      previous_delay = delay
+      delay = policy.next_delay(Exception("500"), attempt, delay)
+      self.assertGreaterEqual(delay, 1)
+      self.assertLessEqual(delay, min(20, 3 * (previous_delay or 1)))
+
+  def test_honors_retry_after(self):
+    policy = retry_policy.RetryPolicy(
+        max_attempts=3, base_delay_sec=1, budget=None
+    )
+
+    delay = policy.next_delay(_ApiError(429, headers={"Retry-After": "30"}), 1)
+
+    self.assertGreaterEqual(delay, 30)
+    self.assertLessEqual(delay, 36)
+
+  def test_gives_up_on_non_retryable_errors_and_last_attempt(self):
+    policy = retry_policy.RetryPolicy(
+        max_attempts=3, base_delay_sec=1, budget=None
+    )
+
+    self.assertIsNone(policy.next_delay(_ApiError(400, "INVALID_ARGUMENT"), 1))
+    self.assertIsNone(
+        policy.next_delay(retry_policy.ResponseBlockedError("SAFETY"), 1)
+    )
+    self.assertIsNone(policy.next_delay(Exception("500"), 3))
+    self.assertIsNotNone(policy.next_delay(Exception("500"), 2))
+
+  def test_budget_stops_retry_storm(self):
+    budget = retry_policy.RetryBudget(
+        ratio=0.5, min_retries_per_sec=0.1, window_sec=10
+    )
+    policy = retry_policy.RetryPolicy(
+        max_attempts=3, base_delay_sec=1, budget=budget
+    )
+    for _ in range(10):
+      policy.record_attempt(1)
+
+    delays = [policy.next_delay(Exception("503"), 1) for _ in range(10)]
+
+    self.assertEqual(sum(delay is not None for delay in delays), 5)
+
+  def test_no_retry_that_would_start_after_run_deadline(self):
+    policy = retry_policy.RetryPolicy(
+        max_attempts=3, base_delay_sec=10, budget=None
+    )
+
+    with deadline.run_deadline(5):
+      self.assertIsNone(policy.next_delay(Exception("503"), 1))
+    with deadline.run_deadline(60):
+      self.assertIsNotNone(policy.next_delay(Exception("503"), 1))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,290 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A model that routes each request to one of several underlying models.
+
+Most requests, e.g. rating a claim against a single comment, are easy enough
+for a small, fast model, and only a few need the biggest one. `RouterModel`
+sends each request to the model of the first `RoutingRule` it matches, by
+estimated prompt tokens, response schema or caller tag, and to a default model
+otherwise. If a routed model returns a response that can't be parsed, or the
+prompt is too long for it, the request is retried on the default model.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import dataclasses
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, FrozenSet, Iterator, List, Optional, Sequence, Tuple
+
+from . import metrics
+from .model import ListSchemaType, Model, SchemaType
+from .retry_policy import InvalidResponseError, is_token_limit_error
+from .token_estimator import TokenEstimator
+
+ROUTED_REQUESTS = metrics.default_registry.counter(
+    "llm_routed_requests_total",
+    "Requests by the model they were routed to and why.",
+)
+
+# The tag of the code making model calls in the current task, if any.
+caller_tag: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "caller_tag", default=None
+)
+
+
+@contextlib.contextmanager
+def tagged(tag: str) -> Iterator[None]:
+  """Tags the model calls made within the context, e.g. `tagged("topics")`."""
+  token = caller_tag.set(tag)
+  try:
+    yield
+  finally:
+    caller_tag.reset(token)
+
+
+def _model_name(model: Model) -> str:
+  return getattr(model, "model_name", type(model).__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class RoutingRule:
+  """Routes the requests that meet all of its conditions to `model`.
+
+  Conditions left as None match every request.
+
+  Attributes:
+    model: The model to route matching requests to.
+    max_prompt_tokens: The most estimated prompt tokens a request may have.
+    schemas: The response schemas of matching requests. Use None in the tuple
+      to match text requests.
+    caller_tags: The caller tags of matching requests, see `tagged`.
+  """
+
+  model: Model
+  max_prompt_tokens: Optional[int] = None
+  schemas: Optional[Tuple[Any, ...]] = None
+  caller_tags: Optional[FrozenSet[str]] = None
+
+  def matches(
+      self, prompt_tokens: int, schema: Any, tag: Optional[str]
+  ) -> bool:
+    return (
+        (
+            self.max_prompt_tokens is None
+            or prompt_tokens <= self.max_prompt_tokens
+        )
+        and (self.schemas is None or schema in self.schemas)
+        and (self.caller_tags is None or tag in self.caller_tags)
+    )
+
+
+def _should_fall_back(error: Exception) -> bool:
+  """Returns whether a bigger model may succeed where the routed one failed."""
+  # Parse and validation errors are ValueErrors
+  return isinstance(
+      error, (ValueError, InvalidResponseError)
+  ) or is_token_limit_error(error)
+
+
+class RouterModel(Model):
+  """Routes each request to a model by its size, schema and caller."""
+
+  def __init__(
+      self,
+      rules: Sequence[RoutingRule],
+      default_model: Model,
+      fall_back: bool = True,
+      token_estimator: Optional[TokenEstimator] = None,
+  ):
+    """Initializes the RouterModel.
+
+    Args:
+      rules: The routing rules, in order. A request goes to the model of the
+        first rule it matches.
+      default_model: The model for requests no rule matches, usually the
+        biggest one.
+      fall_back: Whether a request that fails on a routed model with an
+        invalid response or a token limit error is retried on the default
+        model.
+      token_estimator: Estimates the prompt tokens the rules are matched on.
+    """
+    self.rules = list(rules)
+    self.default_model = default_model
+    self.fall_back = fall_back
+    self.token_estimator = token_estimator or TokenEstimator()
+    self.model_name = ",".join(
+        dict.fromkeys(
+            _model_name(model)
+            for model in [default_model] + [rule.model for rule in self.rules]
+        )
+    )
+    self.categorization_batch_size = default_model.categorization_batch_size
+    self.max_input_tokens = default_model.max_input_tokens
+
+  def route(self, prompt: str, schema: Any = None) -> Model:
+    """Returns the model a request is sent to."""
+    prompt_tokens = self.token_estimator.estimate(prompt)
+    tag = caller_tag.get()
+    for rule in self.rules:
+      if rule.matches(prompt_tokens, schema, tag):
+        return rule.model
+    return self.default_model
+
+  async def generate_text(self, prompt: str) -> str:
+    return await self._run(
+        prompt, None, lambda model: model.generate_text(prompt)
+    )
+
+  async def generate_data(
+      self, prompt: str, schema: type[SchemaType] | type[ListSchemaType]
+  ) -> SchemaType | ListSchemaType:
+    return await self._run(
+        prompt, schema, lambda model: model.generate_data(prompt, schema)
+    )
+
+  async def generate_text_batch_timed(
+      self, prompts: Sequence[str]
+  ) -> Tuple[List[str | Exception], List[Optional[float]]]:
+    return await self._run_batch(
+        prompts,
+        None,
+        lambda model, batch: model.generate_text_batch_timed(batch),
+    )
+
+  async def generate_data_batch_timed(
+      self,
+      prompts: Sequence[str],
+      schema: type[SchemaType] | type[ListSchemaType],
+  ) -> Tuple[
+      List[SchemaType | ListSchemaType | Exception], List[Optional[float]]
+  ]:
+    return await self._run_batch(
+        prompts,
+        schema,
+        lambda model, batch: model.generate_data_batch_timed(batch, schema),
+    )
+
+  async def generate_text_stream(self, prompt: str) -> AsyncIterator[str]:
+    # Chunks may have been used by the time a stream fails, so streams don't
+    # fall back
+    model = self._route_and_count(prompt, None)
+    async with contextlib.aclosing(
+        model.generate_text_stream(prompt)
+    ) as chunks:
+      async for chunk in chunks:
+        yield chunk
+
+  async def generate_data_stream(
+      self, prompt: str, schema: type[ListSchemaType]
+  ) -> AsyncIterator[Any]:
+    model = self._route_and_count(prompt, schema)
+    async with contextlib.aclosing(
+        model.generate_data_stream(prompt, schema)
+    ) as items:
+      async for item in items:
+        yield item
+
+  def _route_and_count(self, prompt: str, schema: Any) -> Model:
+    model = self.route(prompt, schema)
+    ROUTED_REQUESTS.inc(
+        model=_model_name(model),
+        reason="default" if model is self.default_model else "rule",
+    )
+    return model
+
+  async def _run(
+      self, prompt: str, schema: Any, call: Callable[[Model], Any]
+  ) -> Any:
+    """Runs a request on its routed model, falling back to the default."""
+    model = self._route_and_count(prompt, schema)
+    try:
+      return await call(model)
+    except Exception as e:
+      if not self._can_fall_back(model, e):
+        raise
+      logging.warning(
+          f"{_model_name(model)} failed with {e!r}, retrying on"
+          f" {_model_name(self.default_model)}."
+      )
+    ROUTED_REQUESTS.inc(
+        model=_model_name(self.default_model), reason="fallback"
+    )
+    return await call(self.default_model)
+
+  async def _run_batch(
+      self,
+      prompts: Sequence[str],
+      schema: Any,
+      call: Callable[[Model, List[str]], Any],
+  ) -> Tuple[List[Any], List[Optional[float]]]:
+    """Hands each model the prompts routed to it as a batch of its own.
+
+    Returns:
+      The response to each prompt, and how long its call took in seconds, as
+      timed by the model that answered it.
+    """
+    routed_models = [
+        self._route_and_count(prompt, schema) for prompt in prompts
+    ]
+    # Models aren't hashable in general, so they are grouped by identity
+    models: Dict[int, Model] = {}
+    indices_by_model: Dict[int, List[int]] = {}
+    for index, model in enumerate(routed_models):
+      models[id(model)] = model
+      indices_by_model.setdefault(id(model), []).append(index)
+
+    responses: List[Any] = [None] * len(prompts)
+    runtimes_sec: List[Optional[float]] = [None] * len(prompts)
+
+    async def run_on(model: Model, indices: List[int]):
+      batch = [prompts[index] for index in indices]
+      batch_responses, batch_runtimes_sec = await call(model, batch)
+      for index, response, runtime_sec in zip(
+          indices, batch_responses, batch_runtimes_sec
+      ):
+        responses[index] = response
+        runtimes_sec[index] = runtime_sec
+
+    await asyncio.gather(*(
+        run_on(models[model_id], indices)
+        for model_id, indices in indices_by_model.items()
+    ))
+
+    fallback_indices = [
+        index
+        for index, response in enumerate(responses)
+        if isinstance(response, Exception)
+        and self._can_fall_back(routed_models[index], response)
+    ]
+    if fallback_indices:
+      logging.warning(
+          f"Retrying {len(fallback_indices)} failed requests on"
+          f" {_model_name(self.default_model)}."
+      )
+      ROUTED_REQUESTS.inc(
+          len(fallback_indices),
+          model=_model_name(self.default_model),
+          reason="fallback",
+      )
+      await run_on(self.default_model, fallback_indices)
+    return responses, runtimes_sec
+
+  def _can_fall_back(self, model: Model, error: Exception) -> bool:
+    return (
+        self.fall_back
+        and model is not self.default_model
+        and _should_fall_back(error)
+    )
@@ -0,0 +1,159 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+from typing import List
+import unittest
+
+from models import router_model
+from models.model import Model
+from models.retry_policy import TokenLimitExceededError
+import pydantic
+
+
+class _Rating(pydantic.BaseModel):
+  answer: str
+
+
+class _StubModel(Model):
+  """Answers with its name, failing the prompts it is told to fail."""
+
+  def __init__(self, model_name: str, failing_prompts=()):
+    self.model_name = model_name
+    self.failing_prompts = set(failing_prompts)
+    self.prompts: List[str] = []
+
+  async def generate_text(self, prompt: str) -> str:
+    self.prompts.append(prompt)
+    if prompt in self.failing_prompts:
+      raise ValueError("Failed to parse or validate model response.")
+    return self.model_name
+
+  async def generate_data(self, prompt, schema):
+    return _Rating(answer=await self.generate_text(prompt))
+
+
+class RouterModelTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.small = _StubModel("small")
+    self.big = _StubModel("big")
+
+  async def test_routes_short_prompts_to_small_model(self):
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(self.small, max_prompt_tokens=10)], self.big
+    )
+
+    self.assertEqual(await router.generate_text("short"), "small")
+    self.assertEqual(await router.generate_text("long " * 100), "big")
+
+  async def test_routes_by_schema_and_caller_tag(self):
+    router = router_model.RouterModel(
+        [
+            router_model.RoutingRule(
+                self.small,
+                schemas=(_Rating,),
+                caller_tags=frozenset({"autorater"}),
+            )
+        ],
+        self.big,
+    )
+
+    self.assertEqual(await router.generate_text("prompt"), "big")
+    self.assertEqual(
+        (await router.generate_data("prompt", _Rating)).answer, "big"
+    )
+    with router_model.tagged("autorater"):
+      self.assertEqual(
+          (await router.generate_data("prompt", _Rating)).answer, "small"
+      )
+    self.assertIsNone(router_model.caller_tag.get())
+
+  async def test_invalid_response_falls_back_to_default_model(self):
+    self.small.failing_prompts = {"hard"}
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(self.small)], self.big
+    )
+
+    self.assertEqual(await router.generate_text("hard"), "big")
+    self.assertEqual(self.small.prompts, ["hard"])
+
+  async def test_token_limit_error_falls_back_to_default_model(self):
+    async def too_long(prompt):
+      raise TokenLimitExceededError("exceeds the maximum number of tokens")
+
+    self.small.generate_text = too_long
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(self.small)], self.big
+    )
+
+    self.assertEqual(await router.generate_text("prompt"), "big")
+
+  async def test_other_errors_do_not_fall_back(self):
+    async def unavailable(prompt):
+      raise ConnectionError("unavailable")
+
+    self.small.generate_text = unavailable
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(self.small)], self.big
+    )
+
+    with self.assertRaises(ConnectionError):
+      await router.generate_text("prompt")
+    self.assertEqual(self.big.prompts, [])
+
+  async def test_batch_is_split_by_model_and_falls_back(self):
+    self.small.failing_prompts = {"b"}
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(self.small, max_prompt_tokens=10)], self.big
+    )
+    long_prompt = "long " * 100
+
+    results, runtimes_sec = await router.generate_data_batch_timed(
+        ["a", long_prompt, "b"], _Rating
+    )
+
+    self.assertEqual(
+        [result.answer for result in results], ["small", "big", "big"]
+    )
+    self.assertCountEqual(self.small.prompts, ["a", "b"])
+    self.assertCountEqual(self.big.prompts, [long_prompt, "b"])
+    self.assertEqual(len(runtimes_sec), 3)
+    self.assertNotIn(None, runtimes_sec)
+
+  async def test_concurrent_batches_on_one_model_get_their_own_runtimes(self):
+    class _SlowModel(_StubModel):
+
+      async def generate_text(self, prompt: str) -> str:
+        await asyncio.sleep(float(prompt))
+        return await super().generate_text(prompt)
+
+    shared = _SlowModel("shared")
+    router = router_model.RouterModel(
+        [router_model.RoutingRule(shared, max_prompt_tokens=10)], shared
+    )
+
+    (_, slow_runtimes_sec), (_, fast_runtimes_sec) = await asyncio.gather(
+        router.generate_text_batch_timed(["0.2", "0.2"]),
+        router.generate_text_batch_timed(["0"]),
+    )
+
+    self.assertEqual(len(slow_runtimes_sec), 2)
+    self.assertTrue(all(runtime >= 0.2 for runtime in slow_runtimes_sec))
+    self.assertEqual(len(fast_runtimes_sec), 1)
+    self.assertLess(fast_runtimes_sec[0], 0.2)
+
+
+if __name__ == "__main__":
+  unittest.main()
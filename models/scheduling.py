@@ -0,0 +1,138 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Job ordering policies and makespan reporting for LLM worker pools."""
+
+import enum
+import heapq
+import time
+from typing import Any, Callable, Dict, List, Sequence, Tuple, TypeVar
+
+JobType = TypeVar("JobType")
+
+
+class QueuePolicy(str, enum.Enum):
+  """The order in which jobs are handed to workers."""
+
+  # Input order.
+  FIFO = "fifo"
+  # Largest jobs first, which keeps one huge job from running alone at the end.
+  LARGEST_FIRST = "largest_first"
+  # Smallest jobs first, which gets the most results out early.
+  SHORTEST_FIRST = "shortest_first"
+
+
+def order_jobs(
+    jobs: Sequence[JobType],
+    policy: QueuePolicy | str,
+    cost: Callable[[JobType], float],
+) -> List[JobType]:
+  """Returns the jobs in the order the queue policy hands them out.
+
+  Sorting is stable, so jobs of equal cost keep their input order.
+  """
+  policy = QueuePolicy(policy)
+  if policy == QueuePolicy.LARGEST_FIRST:
+    return sorted(jobs, key=cost, reverse=True)
+  if policy == QueuePolicy.SHORTEST_FIRST:
+    return sorted(jobs, key=cost)
+  return list(jobs)
+
+
+def predict_makespan(durations: Sequence[float], workers: int) -> float:
+  """Simulates workers pulling jobs in order and returns the total runtime."""
+  worker_free_at = [0.0] * max(1, workers)
+  for duration in durations:
+    heapq.heappush(
+        worker_free_at, heapq.heappop(worker_free_at) + max(0.0, duration)
+    )
+  return max(worker_free_at)
+
+
+class MakespanTracker:
+  """Records planned and completed jobs of a run to report its makespan.
+
+  Job durations are predicted from their token counts with a linear model
+  (fixed overhead plus time per token) fitted to the jobs of the run, and the
+  makespan is predicted by simulating the worker pool with those durations.
+  """
+
+  def __init__(self, policy: QueuePolicy | str, workers: int):
+    self.policy = QueuePolicy(policy)
+    self.workers = workers
+    # (input position, tokens) of each job, in queue order
+    self.planned: List[Tuple[int, float]] = []
+    self.completed: List[Tuple[float, float]] = []
+    self.start_time = time.perf_counter()
+
+  def plan(self, position: int, tokens: float):
+    """Records a job handed to the workers, in queue order.
+
+    Args:
+      position: The position of the job in the input.
+      tokens: The input tokens of the job.
+    """
+    self.planned.append((position, tokens))
+
+  def record(self, tokens: float, duration_sec: float):
+    """Records how long a completed job took."""
+    self.completed.append((tokens, duration_sec))
+
+  def _fit_duration(self) -> Tuple[float, float]:
+    """Returns the (overhead seconds, seconds per token) fitted to the run."""
+    if not self.completed:
+      return 0.0, 0.0
+    count = len(self.completed)
+    mean_tokens = sum(tokens for tokens, _ in self.completed) / count
+    mean_duration = sum(duration for _, duration in self.completed) / count
+    variance = sum((tokens - mean_tokens) ** 2 for tokens, _ in self.completed)
+    if not variance:
+      return mean_duration, 0.0
+    covariance = sum(
+        (tokens - mean_tokens) * (duration - mean_duration)
+        for tokens, duration in self.completed
+    )
+    sec_per_token = max(0.0, covariance / variance)
+    return max(0.0, mean_duration - sec_per_token * mean_tokens), sec_per_token
+
+  def report(self) -> Dict[str, Any]:
+    """Returns the predicted and actual makespan of the run.
+
+    The report also predicts the makespan of every other queue policy on the
+    same jobs, to show how much tail time a different policy would save.
+    """
+    overhead_sec, sec_per_token = self._fit_duration()
+
+    def predict(jobs: Sequence[Tuple[int, float]]) -> float:
+      return predict_makespan(
+          [overhead_sec + sec_per_token * tokens for _, tokens in jobs],
+          self.workers,
+      )
+
+    input_order = sorted(self.planned)
+
+    return {
+        "policy": self.policy.value,
+        "workers": self.workers,
+        "jobs": len(self.planned),
+        "completed_jobs": len(self.completed),
+        "predicted_makespan_sec": predict(self.planned),
+        "actual_makespan_sec": time.perf_counter() - self.start_time,
+        "predicted_makespan_sec_by_policy": {
+            policy.value: predict(
+                order_jobs(input_order, policy, lambda job: job[1])
+            )
+            for policy in QueuePolicy
+        },
+    }
@@ -0,0 +1,61 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from models import scheduling
+from models.scheduling import QueuePolicy
+
+
+class SchedulingTest(unittest.TestCase):
+
+  def test_order_jobs(self):
+    jobs = [2, 5, 1, 5]
+
+    self.assertEqual(
+        scheduling.order_jobs(jobs, QueuePolicy.FIFO, lambda j: j), jobs
+    )
+    self.assertEqual(
+        scheduling.order_jobs(jobs, "largest_first", lambda j: j), [5, 5, 2, 1]
+    )
+    self.assertEqual(
+        scheduling.order_jobs(jobs, "shortest_first", lambda j: j),
+        [1, 2, 5, 5],
+    )
+    with self.assertRaises(ValueError):
+      scheduling.order_jobs(jobs, "random", lambda j: j)
+
+  def test_predict_makespan(self):
+    # A big job scheduled last runs alone after the others finish.
+    self.assertEqual(scheduling.predict_makespan([1, 1, 1, 1, 4], 2), 6)
+    self.assertEqual(scheduling.predict_makespan([4, 1, 1, 1, 1], 2), 4)
+
+  def test_makespan_tracker_report(self):
+    tracker = scheduling.MakespanTracker(QueuePolicy.FIFO, workers=2)
+    for position, tokens in enumerate([100, 100, 100, 100, 400]):
+      tracker.plan(position, tokens)
+      # Each job takes 1 second plus 1 second per 100 tokens.
+      tracker.record(tokens, 1 + tokens / 100)
+
+    report = tracker.report()
+
+    self.assertEqual(report["jobs"], 5)
+    self.assertAlmostEqual(report["predicted_makespan_sec"], 9)
+    self.assertAlmostEqual(
+        report["predicted_makespan_sec_by_policy"]["largest_first"], 7
+    )
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,94 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Coalescing of concurrent identical LLM calls into a single call."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from . import metrics
+
+ResultType = TypeVar("ResultType")
+
+COALESCED_REQUESTS = metrics.default_registry.counter(
+    "llm_coalesced_requests_total",
+    "Requests that shared the in-flight call of an identical request.",
+)
+
+
+class _Call:
+  """A call in flight and how many callers are waiting for it."""
+
+  def __init__(self, task: asyncio.Task):
+    self.task = task
+    self.waiters = 0
+
+
+class SingleFlight:
+  """Lets concurrent callers with the same key share one in-flight call.
+
+  The first caller for a key starts the call, and callers that arrive while it
+  is in flight wait for the same call and get its result or exception. Once
+  the call is done, the next caller for the key starts a new one, so results
+  are only shared between callers that overlap in time.
+
+  The call runs in a task of its own. A caller that is cancelled stops waiting
+  without cancelling the call for the others, and the call is cancelled once
+  no caller waits for it anymore.
+  """
+
+  def __init__(self):
+    self._calls: Dict[str, _Call] = {}
+
+  @property
+  def in_flight(self) -> int:
+    """The number of distinct calls in flight."""
+    return len(self._calls)
+
+  async def run(
+      self,
+      key: str,
+      make_call: Callable[[], Awaitable[ResultType]],
+      **metric_labels: Any,
+  ) -> ResultType:
+    """Returns the result of `make_call`, sharing it with identical callers.
+
+    Args:
+      key: Identifies the request. Callers must only share a key if they can
+        share a result.
+      make_call: Starts the call, e.g. a model call with retries.
+      **metric_labels: Labels of the coalesced requests counter.
+    """
+    call = self._calls.get(key)
+    if call is None:
+      call = _Call(asyncio.ensure_future(make_call()))
+      self._calls[key] = call
+      call.task.add_done_callback(lambda _: self._forget(key, call))
+    else:
+      COALESCED_REQUESTS.inc(**metric_labels)
+
+    call.waiters += 1
+    try:
+      # A cancelled caller must not cancel the call the others wait for
+      return await asyncio.shield(call.task)
+    finally:
+      call.waiters -= 1
+      if call.waiters == 0 and not call.task.done():
+        # Nobody waits for the result anymore
+        self._forget(key, call)
+        call.task.cancel()
+
+  def _forget(self, key: str, call: _Call):
+    if self._calls.get(key) is call:
+      del self._calls[key]
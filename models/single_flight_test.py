@@ -0,0 +1,114 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import unittest
+
+from models import single_flight
+
+
+class SingleFlightTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_concurrent_callers_share_one_call(self):
+    flight = single_flight.SingleFlight()
+    calls = 0
+
+    async def make_call():
+      nonlocal calls
+      calls += 1
+      await asyncio.sleep(0.01)
+      return f"result {calls}"
+
+    labels = {"model": "concurrent-callers-share"}
+    results = await asyncio.gather(
+        *(flight.run("key", make_call, **labels) for _ in range(3))
+    )
+
+    self.assertEqual(results, ["result 1"] * 3)
+    self.assertEqual(single_flight.COALESCED_REQUESTS.value(**labels), 2)
+    self.assertEqual(flight.in_flight, 0)
+    # A later caller starts a new call
+    self.assertEqual(await flight.run("key", make_call), "result 2")
+
+  async def test_different_keys_are_not_shared(self):
+    flight = single_flight.SingleFlight()
+
+    async def make_call(value):
+      await asyncio.sleep(0.01)
+      return value
+
+    results = await asyncio.gather(
+        flight.run("a", lambda: make_call("a")),
+        flight.run("b", lambda: make_call("b")),
+    )
+
+    self.assertEqual(results, ["a", "b"])
+
+  async def test_error_is_raised_to_every_caller(self):
+    flight = single_flight.SingleFlight()
+
+    async def make_call():
+      await asyncio.sleep(0.01)
+      raise ValueError("failed")
+
+    results = await asyncio.gather(
+        flight.run("key", make_call),
+        flight.run("key", make_call),
+        return_exceptions=True,
+    )
+
+    self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+  async def test_cancelled_caller_does_not_cancel_call_for_others(self):
+    flight = single_flight.SingleFlight()
+    release = asyncio.Event()
+
+    async def make_call():
+      await release.wait()
+      return "result"
+
+    first = asyncio.create_task(flight.run("key", make_call))
+    second = asyncio.create_task(flight.run("key", make_call))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+
+    self.assertEqual(await second, "result")
+    self.assertTrue(first.cancelled())
+
+  async def test_call_is_cancelled_once_no_caller_waits(self):
+    flight = single_flight.SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def make_call():
+      try:
+        await asyncio.sleep(3600)
+      except asyncio.CancelledError:
+        cancelled.set()
+        raise
+
+    callers = [
+        asyncio.create_task(flight.run("key", make_call)) for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+    for caller in callers:
+      caller.cancel()
+
+    await asyncio.wait_for(cancelled.wait(), timeout=1)
+    self.assertEqual(flight.in_flight, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
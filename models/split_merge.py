@@ -0,0 +1,183 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Split-and-merge of prompts over the model's input token limit.
+
+A prompt built from a list of items, e.g. the comments of a topic, can grow
+past what the model accepts. Instead of failing, the items are split into
+shards whose prompts fit, the shards run concurrently, and their results are
+merged by a reducer. Shards are cut by estimated token count up front when the
+limit is known, and halved again whenever a shard is still rejected as too
+long.
+"""
+
+import contextlib
+import logging
+from typing import Any, Callable, List, Optional, Sequence, TypeVar
+
+from . import executor
+from . import metrics
+from .retry_policy import is_token_limit_error
+from .token_estimator import TokenEstimator
+
+ItemType = TypeVar("ItemType")
+
+# How many shards of one prompt run at the same time.
+DEFAULT_SHARD_PARALLELISM = 10
+
+SHARDED_PROMPTS = metrics.default_registry.counter(
+    "llm_sharded_prompts_total",
+    "Prompts split into shards because they exceeded the input token limit.",
+)
+
+
+def concatenate(results: List[List[Any]]) -> List[Any]:
+  """Merges the list results of shards into one list, in shard order."""
+  return [value for result in results for value in result]
+
+
+def _item_tokens(
+    items: Sequence[ItemType],
+    make_prompt: Callable[[List[ItemType]], str],
+    token_estimator: TokenEstimator,
+) -> List[int]:
+  """Estimates how many tokens each item adds to the prompt."""
+  base_tokens = token_estimator.estimate(make_prompt([]))
+  return [
+      max(1, token_estimator.estimate(make_prompt([item])) - base_tokens)
+      for item in items
+  ]
+
+
+def shard_items(
+    items: Sequence[ItemType],
+    make_prompt: Callable[[List[ItemType]], str],
+    max_prompt_tokens: int,
+    token_estimator: Optional[TokenEstimator] = None,
+) -> List[List[ItemType]]:
+  """Splits items into consecutive shards whose prompts fit the token limit.
+
+  An item too large to fit even on its own gets a shard of its own.
+  """
+  token_estimator = token_estimator or TokenEstimator()
+  base_tokens = token_estimator.estimate(make_prompt([]))
+  shards: List[List[ItemType]] = []
+  shard: List[ItemType] = []
+  shard_tokens = base_tokens
+  for item, tokens in zip(
+      items, _item_tokens(items, make_prompt, token_estimator)
+  ):
+    if shard and shard_tokens + tokens > max_prompt_tokens:
+      shards.append(shard)
+      shard = []
+      shard_tokens = base_tokens
+    shard.append(item)
+    shard_tokens += tokens
+  if shard:
+    shards.append(shard)
+  return shards
+
+
+def _split_in_two(
+    items: List[ItemType],
+    make_prompt: Callable[[List[ItemType]], str],
+    token_estimator: TokenEstimator,
+) -> List[List[ItemType]]:
+  """Splits items into two shards of about the same number of tokens."""
+  item_tokens = _item_tokens(items, make_prompt, token_estimator)
+  half_tokens = sum(item_tokens) / 2
+  cumulative_tokens = 0
+  for cut, tokens in enumerate(item_tokens[:-1], start=1):
+    cumulative_tokens += tokens
+    if cumulative_tokens >= half_tokens:
+      break
+  return [items[:cut], items[cut:]]
+
+
+async def generate_data_sharded(
+    model: Any,
+    items: Sequence[ItemType],
+    make_prompt: Callable[[List[ItemType]], str],
+    schema: Any,
+    reducer: Callable[[List[Any]], Any] = concatenate,
+    max_prompt_tokens: Optional[int] = None,
+    token_estimator: Optional[TokenEstimator] = None,
+    limit: int = DEFAULT_SHARD_PARALLELISM,
+) -> Any:
+  """Runs `model.generate_data` on a prompt, sharding it if it is too long.
+
+  Args:
+    model: The model to call, usually a `Model`.
+    items: The items the prompt is built from, e.g. comments.
+    make_prompt: Builds the prompt for a list of items. Must accept an empty
+      list, which is used to estimate the size of the instructions.
+    schema: The schema to parse each response as.
+    reducer: Merges the results of all shards, in item order, into a single
+      result. Defaults to concatenating list results.
+    max_prompt_tokens: The model's input token limit, if known. Prompts
+      estimated to exceed it are sharded before the model is called.
+    token_estimator: Estimates the tokens of prompts and items.
+    limit: How many shards run at the same time.
+
+  Returns:
+    The result of the whole prompt if it fit, and the reduced results of its
+    shards otherwise.
+
+  Raises:
+    The error of the first shard that failed, including a token limit error
+    for a single item that is too long on its own.
+  """
+  items = list(items)
+  token_estimator = token_estimator or TokenEstimator()
+
+  async def run(shard: List[ItemType]) -> List[Any]:
+    """Returns the result of each leaf shard the items end up in."""
+    try:
+      return [await model.generate_data(make_prompt(shard), schema)]
+    except Exception as e:
+      if not is_token_limit_error(e) or len(shard) < 2:
+        raise
+    logging.warning(
+        f"Prompt with {len(shard)} items exceeds the input token limit,"
+        " splitting it in two."
+    )
+    SHARDED_PROMPTS.inc()
+    return await run_all(_split_in_two(shard, make_prompt, token_estimator))
+
+  async def run_all(shards: List[List[ItemType]]) -> List[Any]:
+    results = []
+    async with contextlib.aclosing(
+        executor.stream_tasks(shards, run, limit=limit)
+    ) as outcomes:
+      async for outcome in outcomes:
+        if isinstance(outcome, executor.Error):
+          raise outcome.error
+        results.extend(outcome.value)
+    return results
+
+  if (
+      max_prompt_tokens is not None
+      and token_estimator.estimate(make_prompt(items)) > max_prompt_tokens
+  ):
+    shards = shard_items(items, make_prompt, max_prompt_tokens, token_estimator)
+    logging.info(
+        f"Prompt with {len(items)} items exceeds {max_prompt_tokens} tokens,"
+        f" splitting it into {len(shards)} shards."
+    )
+    SHARDED_PROMPTS.inc()
+    return reducer(await run_all(shards))
+
+  results = await run(items)
+  # A single result means the prompt fit as it was
+  return results[0] if len(results) == 1 else reducer(results)
@@ -0,0 +1,99 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+import unittest
+
+from models import split_merge
+from models.model import Model
+from models.retry_policy import TokenLimitExceededError
+
+
+def _make_prompt(comments: List[str]) -> str:
+  return "Summarize:\n" + "\n".join(comments)
+
+
+class _LimitedModel(Model):
+  """Echoes the comments of prompts up to a number of characters."""
+
+  def __init__(self, max_prompt_chars: int):
+    self.max_prompt_chars = max_prompt_chars
+    self.prompts: List[str] = []
+
+  async def generate_text(self, prompt: str) -> str:
+    raise NotImplementedError()
+
+  async def generate_data(self, prompt, schema):
+    self.prompts.append(prompt)
+    if len(prompt) > self.max_prompt_chars:
+      raise TokenLimitExceededError(
+          "The input token count exceeds the maximum number of tokens allowed"
+      )
+    return prompt.splitlines()[1:]
+
+
+class SplitMergeTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_prompt_that_fits_is_not_split(self):
+    model = _LimitedModel(max_prompt_chars=1000)
+
+    result = await model.generate_data_in_shards(
+        ["a", "b"], _make_prompt, List[str]
+    )
+
+    self.assertEqual(result, ["a", "b"])
+    self.assertEqual(len(model.prompts), 1)
+
+  async def test_too_long_prompt_is_split_and_merged(self):
+    comments = [f"comment {i:02d}" for i in range(20)]
+    model = _LimitedModel(max_prompt_chars=60)
+
+    result = await model.generate_data_in_shards(
+        comments, _make_prompt, List[str]
+    )
+
+    self.assertEqual(result, comments)
+    # The full prompt was tried first, then split until the shards fit
+    self.assertEqual(model.prompts[0], _make_prompt(comments))
+    self.assertGreater(len(model.prompts), 3)
+
+  async def test_known_limit_shards_before_calling(self):
+    comments = [f"comment {i:02d}" for i in range(20)]
+    model = _LimitedModel(max_prompt_chars=1000)
+    model.max_input_tokens = 20
+
+    result = await model.generate_data_in_shards(
+        comments, _make_prompt, List[str], reducer=len
+    )
+
+    self.assertEqual(result, len(model.prompts))
+    self.assertGreater(len(model.prompts), 1)
+    self.assertTrue(
+        all(
+            split_merge.TokenEstimator().estimate(prompt) <= 20
+            for prompt in model.prompts
+        )
+    )
+
+  async def test_single_item_over_the_limit_raises(self):
+    model = _LimitedModel(max_prompt_chars=20)
+
+    with self.assertRaises(TokenLimitExceededError):
+      await model.generate_data_in_shards(
+          ["a" * 100, "b"], _make_prompt, List[str]
+      )
+
+
+if __name__ == "__main__":
+  unittest.main()
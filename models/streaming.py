@@ -0,0 +1,243 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming model responses and parsing JSON lists as they arrive.
+
+A streamed response is consumed chunk by chunk, so the first part of a long
+response can be used before the model has produced the rest. For list
+responses, `JsonArrayParser` returns each element of the JSON array as soon as
+its closing bracket arrives.
+"""
+
+import contextlib
+import dataclasses
+import json
+import time
+import typing
+from typing import Any, AsyncContextManager, AsyncIterable, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from pydantic import TypeAdapter
+
+from . import deadline
+from . import metrics
+from .retry_policy import InvalidResponseError
+
+LLM_TIME_TO_FIRST_CHUNK = metrics.default_registry.histogram(
+    "llm_time_to_first_chunk_seconds",
+    "Time from starting a streaming LLM call to its first response chunk.",
+)
+
+
+class JsonArrayParser:
+  """Parses the elements of a JSON array from text that arrives in chunks.
+
+  Text before the opening bracket, such as a markdown code fence, is skipped.
+  Elements are decoded with `json.loads` as soon as they are complete.
+  """
+
+  def __init__(self):
+    # The text not consumed yet, starting at the current element if any
+    self._buffer = ""
+    # How far into the buffer has been scanned
+    self._position = 0
+    self._started = False
+    self._done = False
+    # Where the current element starts in the buffer, if inside one
+    self._element_start: Optional[int] = None
+    # The nesting depth of brackets and braces within the current element
+    self._depth = 0
+    self._in_string = False
+    self._escaped = False
+
+  @property
+  def done(self) -> bool:
+    """Whether the closing bracket of the array has been parsed."""
+    return self._done
+
+  def feed(self, text: str) -> List[Any]:
+    """Adds the next chunk of text and returns the elements it completed.
+
+    Raises:
+      ValueError: If the text isn't a JSON array or an element isn't valid
+        JSON.
+    """
+    self._buffer += text
+    elements = []
+    buffer = self._buffer
+    position = self._position
+    while position < len(buffer) and not self._done:
+      char = buffer[position]
+      if not self._started:
+        if char == "[":
+          self._started = True
+        elif char == "{":
+          raise ValueError("Expected a JSON array, got an object.")
+      elif self._in_string:
+        if self._escaped:
+          self._escaped = False
+        elif char == "\\":
+          self._escaped = True
+        elif char == '"':
+          self._in_string = False
+      elif self._element_start is None:
+        if char == "]":
+          self._done = True
+        elif not char.isspace() and char != ",":
+          self._element_start = position
+          # Scans the first character of the element again
+          continue
+      elif char == '"':
+        self._in_string = True
+      elif char in "[{":
+        self._depth += 1
+      elif char in "]}" and self._depth > 0:
+        self._depth -= 1
+        if self._depth == 0:
+          elements.append(
+              self._decode(buffer[self._element_start : position + 1])
+          )
+          self._element_start = None
+      elif self._depth == 0 and char in ",]":
+        # The end of a scalar element
+        elements.append(self._decode(buffer[self._element_start : position]))
+        self._element_start = None
+        self._done = char == "]"
+      position += 1
+
+    # Drops the consumed text, so long responses are scanned only once
+    keep_from = position if self._element_start is None else self._element_start
+    self._buffer = buffer[keep_from:]
+    self._position = position - keep_from
+    if self._element_start is not None:
+      self._element_start = 0
+    return elements
+
+  def close(self):
+    """Checks that the whole array has been parsed.
+
+    Raises:
+      ValueError: If the array is incomplete, e.g. because the response was
+        truncated.
+    """
+    if not self._done:
+      raise ValueError("The JSON array is incomplete.")
+
+  def _decode(self, text: str) -> Any:
+    try:
+      return json.loads(text)
+    except json.JSONDecodeError as e:
+      raise ValueError(f"Invalid JSON array element: {text}") from e
+
+
+def list_item_schema(schema: Any) -> Any:
+  """Returns the element type of a list schema such as `List[Topic]`.
+
+  Raises:
+    ValueError: If the schema isn't a list.
+  """
+  if typing.get_origin(schema) is not list:
+    raise ValueError(f"Streaming data needs a list schema, got {schema}.")
+  (item_schema,) = typing.get_args(schema) or (Any,)
+  return item_schema
+
+
+async def parse_json_array(
+    chunks: AsyncIterable[str], item_adapter: Optional[TypeAdapter] = None
+) -> AsyncIterator[Any]:
+  """Yields the elements of a streamed JSON array as soon as each is complete.
+
+  Args:
+    chunks: The text of the response, in chunks.
+    item_adapter: Validates each element, e.g. `TypeAdapter(Topic)`.
+
+  Raises:
+    ValueError: If the response isn't a complete JSON array, or an element
+      doesn't validate. Elements before the error have been yielded already.
+  """
+  parser = JsonArrayParser()
+  async for chunk in chunks:
+    for element in parser.feed(chunk):
+      yield item_adapter.validate_python(element) if item_adapter else element
+  parser.close()
+
+
+@dataclasses.dataclass
+class OpenStream:
+  """A streaming call whose first chunk has arrived.
+
+  Iterating the stream yields all chunks, starting with the first one, and
+  releases the call's concurrency slot once it is done or closed.
+  """
+
+  first_chunk: Any
+  rest: AsyncIterator[Any]
+  exit_stack: contextlib.AsyncExitStack
+  # The longest wait for each further chunk, if limited
+  timeout_sec: Optional[float] = None
+
+  async def __aiter__(self) -> AsyncIterator[Any]:
+    async with self.exit_stack:
+      yield self.first_chunk
+      while True:
+        try:
+          chunk = await deadline.call_with_timeout(
+              lambda: anext(self.rest), self.timeout_sec
+          )
+        except StopAsyncIteration:
+          return
+        yield chunk
+
+
+async def open_stream(
+    start: Callable[[], Awaitable[AsyncIterable[Any]]],
+    slot: AsyncContextManager,
+    timeout_sec: Optional[float] = None,
+    **metric_labels: str,
+) -> OpenStream:
+  """Starts a streaming call and waits for its first chunk.
+
+  The call holds `slot` and counts as in flight until the returned stream has
+  been consumed. Waiting for the first chunk means that errors of the request
+  itself are raised here, while the call can still be retried.
+
+  Args:
+    start: Starts the call and returns its stream of chunks.
+    slot: A concurrency slot to hold for the whole call.
+    timeout_sec: The longest wait for the first chunk, and then for each
+      further chunk, if limited. The run deadline applies as well.
+    **metric_labels: Labels of the latency metrics, e.g. backend and model.
+
+  Raises:
+    InvalidResponseError: If the stream ended without any chunk.
+    asyncio.TimeoutError: If a chunk took longer than `timeout_sec`.
+  """
+
+  async def start_and_read_first_chunk() -> Tuple[AsyncIterator[Any], Any]:
+    rest = aiter(await start())
+    try:
+      return rest, await anext(rest)
+    except StopAsyncIteration:
+      raise InvalidResponseError("The model returned an empty stream.")
+
+  async with contextlib.AsyncExitStack() as exit_stack:
+    await exit_stack.enter_async_context(slot)
+    exit_stack.enter_context(metrics.track_llm_call(**metric_labels))
+    start_time = time.perf_counter()
+    rest, first_chunk = await deadline.call_with_timeout(
+        start_and_read_first_chunk, timeout_sec
+    )
+    LLM_TIME_TO_FIRST_CHUNK.observe(
+        time.perf_counter() - start_time, **metric_labels
+    )
+    return OpenStream(first_chunk, rest, exit_stack.pop_all(), timeout_sec)
@@ -0,0 +1,116 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List
+import unittest
+
+from models import streaming
+from models.concurrency import AdaptiveConcurrencyLimiter
+from models.retry_policy import InvalidResponseError
+import pydantic
+
+
+class _Topic(pydantic.BaseModel):
+  name: str
+
+
+async def _chunks(*texts: str):
+  for text in texts:
+    yield text
+
+
+class JsonArrayParserTest(unittest.TestCase):
+
+  def test_yields_elements_as_soon_as_they_are_complete(self):
+    parser = streaming.JsonArrayParser()
+
+    self.assertEqual(parser.feed('```json\n[{"name": "Pa'), [])
+    self.assertEqual(
+        parser.feed('rks", "tags": ["a]", "b"]}, {"na'),
+        [{"name": "Parks", "tags": ["a]", "b"]}],
+    )
+    self.assertEqual(
+        parser.feed('me": "Roads \\"x\\""}]\n```'), [{"name": 'Roads "x"'}]
+    )
+    self.assertTrue(parser.done)
+    parser.close()
+
+  def test_parses_scalar_elements(self):
+    parser = streaming.JsonArrayParser()
+
+    self.assertEqual(parser.feed('[1, "a,b", tr'), [1, "a,b"])
+    self.assertEqual(parser.feed("ue, null]"), [True, None])
+    parser.close()
+
+  def test_empty_array(self):
+    parser = streaming.JsonArrayParser()
+
+    self.assertEqual(parser.feed(" [ ] "), [])
+    parser.close()
+
+  def test_incomplete_array_fails_on_close(self):
+    parser = streaming.JsonArrayParser()
+    parser.feed('[{"name": "Parks"}, {"name": ')
+
+    with self.assertRaises(ValueError):
+      parser.close()
+
+  def test_object_is_not_an_array(self):
+    with self.assertRaises(ValueError):
+      streaming.JsonArrayParser().feed('{"items": [1]}')
+
+  def test_list_item_schema(self):
+    self.assertIs(streaming.list_item_schema(List[_Topic]), _Topic)
+    with self.assertRaises(ValueError):
+      streaming.list_item_schema(_Topic)
+
+
+class StreamingTest(unittest.IsolatedAsyncioTestCase):
+
+  async def test_parse_json_array_validates_elements(self):
+    items = streaming.parse_json_array(
+        _chunks('[{"name": "Parks"},', ' {"nam', 'e": 3}]'),
+        pydantic.TypeAdapter(_Topic),
+    )
+
+    self.assertEqual(await anext(items), _Topic(name="Parks"))
+    with self.assertRaises(pydantic.ValidationError):
+      await anext(items)
+
+  async def test_open_stream_holds_slot_until_consumed(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+
+    async def start():
+      return _chunks("a", "b")
+
+    stream = await streaming.open_stream(start, limiter.slot(), backend="test")
+    self.assertEqual(stream.first_chunk, "a")
+    self.assertEqual(limiter.in_flight, 1)
+
+    self.assertEqual([chunk async for chunk in stream], ["a", "b"])
+    self.assertEqual(limiter.in_flight, 0)
+
+  async def test_open_stream_fails_for_empty_stream(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+
+    async def start():
+      return _chunks()
+
+    with self.assertRaises(InvalidResponseError):
+      await streaming.open_stream(start, limiter.slot(), backend="test")
+    self.assertEqual(limiter.in_flight, 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,63 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local, calibrated estimation of prompt token counts."""
+
+import math
+
+# Rough number of characters per token for Gemini models on English text.
+DEFAULT_CHARS_PER_TOKEN = 4.0
+# How many observations are needed before the fitted ratio is used.
+MIN_CALIBRATION_OBSERVATIONS = 5
+
+
+class TokenEstimator:
+  """Estimates token counts from character counts without calling the API.
+
+  The estimator starts from a fixed characters-per-token ratio and refits it
+  against every exact count it observes, e.g. from `count_tokens` results or a
+  response's `usage_metadata`. The fit is a least-squares line through the
+  origin, which matches how token counts grow with text length.
+  """
+
+  def __init__(self, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN):
+    self.default_tokens_per_char = 1.0 / chars_per_token
+    self.observations = 0
+    # Running sums for the least-squares fit tokens = ratio * chars
+    self._sum_chars_times_tokens = 0.0
+    self._sum_chars_squared = 0.0
+
+  @property
+  def tokens_per_char(self) -> float:
+    if (
+        self.observations < MIN_CALIBRATION_OBSERVATIONS
+        or not self._sum_chars_squared
+    ):
+      return self.default_tokens_per_char
+    return self._sum_chars_times_tokens / self._sum_chars_squared
+
+  def observe(self, text: str, token_count: int):
+    """Calibrates the estimator with the exact token count of a text."""
+    if not text or token_count <= 0:
+      return
+    chars = len(text)
+    self._sum_chars_times_tokens += chars * token_count
+    self._sum_chars_squared += chars * chars
+    self.observations += 1
+
+  def estimate(self, text: str) -> int:
+    """Returns the approximate number of tokens in `text`."""
+    if not text:
+      return 0
+    return max(1, math.ceil(len(text) * self.tokens_per_char))
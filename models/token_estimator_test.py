@@ -0,0 +1,39 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from models.token_estimator import TokenEstimator
+
+
+class TokenEstimatorTest(unittest.TestCase):
+
+  def test_estimate_uses_default_ratio_before_calibration(self):
+    estimator = TokenEstimator(chars_per_token=4.0)
+
+    self.assertEqual(estimator.estimate(""), 0)
+    self.assertEqual(estimator.estimate("a" * 40), 10)
+    self.assertEqual(estimator.estimate("abc"), 1)
+
+  def test_estimate_fits_observed_counts(self):
+    estimator = TokenEstimator(chars_per_token=4.0)
+    for length in range(10, 60, 10):
+      estimator.observe("a" * length, length // 2)
+
+    self.assertAlmostEqual(estimator.tokens_per_char, 0.5)
+    self.assertEqual(estimator.estimate("a" * 100), 50)
+
+
+if __name__ == "__main__":
+  unittest.main()
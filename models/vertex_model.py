@@ -13,52 +13,140 @@
 # limitations under the License.
 
 import asyncio
-import json
+import contextlib
+import copy
+import dataclasses
+import functools
 import logging
-from typing import Any, List, Callable, Type
+import time
+from typing import Any, AsyncContextManager, AsyncIterator, Dict, List, Callable, Optional, Sequence, Tuple, Type
 import vertexai
 from vertexai.generative_models import (
+    GenerationConfig,
     GenerativeModel,
     HarmBlockThreshold,
     HarmCategory,
     GenerationResponse,
 )
-import google.auth
-from google.auth.transport.requests import Request as AuthRequest
-from requests.adapters import HTTPAdapter
-import requests
-from pydantic import ValidationError, TypeAdapter
+from pydantic import TypeAdapter
 
 from .model import Model as BaseModelClass, SchemaType, ListSchemaType
-from .model_util import MAX_LLM_RETRIES, DEFAULT_VERTEX_PARALLELISM, RETRY_DELAY_SEC, MAX_RETRIES
-
-
-class TokenLimitExceededError(Exception):
-  """Custom exception for when the token limit is exceeded."""
-
-  pass
+from . import batch_prediction
+from .batch_prediction import BatchBackend
+from .cassette import Cassette
+from . import model_util
+from .model_util import MAX_LLM_RETRIES, BLOCKED_FINISH_REASONS, DEFAULT_VERTEX_PARALLELISM, RETRY_DELAY_SEC, CALL_TIMEOUT_SEC, JSON_MIME_TYPE
+from .concurrency import AdaptiveConcurrencyLimiter
+from .credentials import SharedCredentials, default_credentials
+from . import deadline
+from .hedging import Hedger
+from .job_journal import JobJournal, job_key
+from . import executor
+from . import json_repair
+from . import metrics
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from . import streaming
+from .retry_policy import InvalidResponseError, ResponseBlockedError, RetryPolicy, TokenLimitExceededError, classify_error, is_token_limit_error
+
+# Param docs: http://cloud/vertex-ai/generative-ai/docs/model-reference/inference#generationconfig
+GENERATION_PARAMS = {
+    "temperature": 0,
+    "top_p": 0,
+}
+
+
+@dataclasses.dataclass(frozen=True)
+class _Response:
+  """The text of a model response."""
+
+  text: str
+  # Whether the response was cut off by the output token limit
+  truncated: bool = False
 
 
 class VertexModel(BaseModelClass):
 
+  # Shortest time in seconds to wait before retrying a failed model call.
+  retry_delay_sec: float = RETRY_DELAY_SEC
+  # Longest time in seconds a single model call may take, if limited.
+  call_timeout_sec: float | None = CALL_TIMEOUT_SEC
+
   def __init__(
       self,
       project: str,
       location: str,
       model_name: str,
+      response_cache: ResponseCache | None = None,
+      concurrency_limiter: AdaptiveConcurrencyLimiter | None = None,
+      hedger: Hedger | None = None,
+      credentials: SharedCredentials | None = None,
+      batch_backend: BatchBackend | None = None,
+      cassette: Cassette | None = None,
+      max_input_tokens: int | None = None,
   ):
-    # Initialize Vertex AI SDK
-    creds = custom_pool_creds()  # Enables high concurrency
-
-    vertexai.init(project=project, location=location, credentials=creds)
-
-    self.llm = GenerativeModel(
+    """Initializes the VertexModel.
+
+    The model client is created on first use, so constructing the model is
+    cheap and doesn't need credentials.
+
+    Args:
+      project: The GCP project to run the model in.
+      location: The GCP location to run the model in.
+      model_name: The name of the Vertex AI model to use.
+      response_cache: An optional cache consulted before calling the model.
+      concurrency_limiter: An optional adaptive limiter every model call waits
+        for. It can be shared with other models that use the same quota.
+      hedger: An optional hedger that sends a duplicate of unusually slow
+        calls.
+      credentials: The credentials to call the model with. Defaults to the
+        application default credentials shared by all models.
+      batch_backend: The service `predict_batch` runs jobs with, if batch
+        prediction is used. With a backend, `generate_text_batch` and
+        `generate_data_batch` also run their batches as batch jobs.
+      cassette: An optional cassette every successful model call is recorded
+        in, to replay the run with `FakeModel`.
+      max_input_tokens: The input token limit of the model, which
+        `generate_data_in_shards` shards longer prompts by. Defaults to the
+        limit of known models.
+    """
+    self.model_name = model_name
+    self.max_input_tokens = max_input_tokens or model_util.max_input_tokens(
+        model_name
+    )
+    self.response_cache = response_cache
+    self.concurrency_limiter = concurrency_limiter
+    self.hedger = hedger
+    self.project = project
+    self.location = location
+    self.credentials = credentials or default_credentials
+    self.batch_backend = batch_backend
+    self.cassette = cassette
+    self._llm: GenerativeModel | None = None
+    self._in_flight = SingleFlight()
+
+  @property
+  def llm(self) -> GenerativeModel:
+    """The model client, created on first use."""
+    if self._llm is None:
+      self._llm = self._make_llm(self.location, self.model_name)
+    return self._llm
+
+  @llm.setter
+  def llm(self, llm: GenerativeModel):
+    self._llm = llm
+
+  def _make_llm(self, location: str, model_name: str) -> GenerativeModel:
+    """Creates a client for a model in a location."""
+    # Models keep the location that is set globally when they are created
+    vertexai.init(
+        project=self.project,
+        location=location,
+        credentials=self.credentials.get(),
+    )
+    return GenerativeModel(
         model_name=model_name,
-        generation_config={
-            # Param docs: http://cloud/vertex-ai/generative-ai/docs/model-reference/inference#generationconfig
-            "temperature": 0,
-            "top_p": 0,
-        },
+        generation_config=GENERATION_PARAMS,
         safety_settings={
             HarmCategory.HARM_CATEGORY_UNSPECIFIED: (
                 HarmBlockThreshold.BLOCK_NONE
@@ -82,39 +170,80 @@ class VertexModel(BaseModelClass):
     )
 
   async def generate_text(self, prompt: str) -> str:
-    return await self._call_llm_with_retry(prompt)
+    return (await self._call_llm_with_retry(prompt)).text
 
   async def generate_data(
-      self, prompt: str, schema: Type[SchemaType] | Type[ListSchemaType]
+      self,
+      prompt: str,
+      schema: Type[SchemaType] | Type[ListSchemaType],
+      drop_invalid_items: bool = False,
   ) -> SchemaType | ListSchemaType:
-    response_text = await self._call_llm_with_retry(prompt)
-
-    # Drop markdown code block delimiters if present
-    if response_text.startswith("```json"):
-      response_text = response_text[7:]  # Remove ```json
-    if response_text.endswith("```"):
-      response_text = response_text[:-3]  # Remove ```
-
+    """Generates data matching the schema, see `Model.generate_data`.
+
+    Args:
+      prompt: The instructions and data to process as a prompt.
+      schema: The Pydantic model (or a list of Pydantic models/scalars) to
+        parse the response as.
+      drop_invalid_items: Whether items of a list response that fail
+        validation are dropped instead of failing the whole response.
+    """
+    # Constrain decoding to the schema, so the response is valid JSON for it
+    response = await self._call_llm_with_retry(prompt, response_schema=schema)
+    result = self._parse_data(
+        response.text,
+        schema,
+        truncated=response.truncated,
+        drop_invalid_items=drop_invalid_items,
+    )
+    if result.salvaged:
+      logging.warning(
+          f"Using a {schema} response repaired with"
+          f" {', '.join(result.repairs)}."
+      )
+    return result.value
+
+  async def generate_text_stream(self, prompt: str) -> AsyncIterator[str]:
+    async with contextlib.aclosing(
+        self._stream_llm_with_retry(prompt)
+    ) as chunks:
+      async for chunk in chunks:
+        yield chunk
+
+  async def generate_data_stream(
+      self, prompt: str, schema: Type[ListSchemaType]
+  ) -> AsyncIterator[Any]:
+    item_adapter = _type_adapter(streaming.list_item_schema(schema))
+    async with contextlib.aclosing(
+        self._stream_llm_with_retry(prompt, response_schema=schema)
+    ) as chunks:
+      async for item in streaming.parse_json_array(chunks, item_adapter):
+        yield item
+
+  def _parse_data(
+      self,
+      response_text: str,
+      schema: Type[SchemaType] | Type[ListSchemaType],
+      truncated: bool = False,
+      drop_invalid_items: bool = False,
+  ) -> json_repair.SalvageResult:
+    """Parses a JSON response as an instance of the schema.
+
+    Returns:
+      The instance, and the repairs the response needed, if any.
+    """
     try:
-      # Use TypeAdapter for robust parsing of schema
-      # The schema argument itself is the type hint, e.g. Topic or List[Topic]
-      adapter = TypeAdapter(schema)
-      return adapter.validate_json(response_text)
-
-    except ValidationError as e:  # Catches Pydantic validation errors
-      logging.error(
-          f"Model response failed Pydantic validation for schema {schema}:"
-          f" {response_text}.\nError: {e}"
+      # Repairs near misses like stray prose or a truncated array locally,
+      # which is much cheaper than calling the model again. The schema
+      # argument itself is the type hint, e.g. Topic or List[Topic].
+      return json_repair.salvage(
+          response_text,
+          _type_adapter(schema),
+          truncated=truncated,
+          drop_invalid_items=drop_invalid_items,
+          backend="vertex",
+          model=self.model_name,
       )
-      raise ValueError(
-          f"Model response failed Pydantic validation: {response_text}."
-      ) from e
-    except (
-        json.JSONDecodeError
-    ) as e:  # Catches errors if response_text is not valid JSON
-      logging.error(f"Model returned invalid JSON: {response_text}.")
-      raise ValueError(f"Model returned invalid JSON: {response_text}.") from e
-    except Exception as e:  # Catches any other unexpected errors during parsing
+    except ValueError as e:
       logging.error(
           f"Failed to parse or validate model response against schema {schema}:"
           f" {response_text}.\nError: {e}"
@@ -123,23 +252,204 @@ class VertexModel(BaseModelClass):
           f"Failed to parse or validate model response: {response_text}."
       ) from e
 
-  async def _call_llm_with_retry(self, prompt: str) -> str:
+  async def predict_batch(
+      self,
+      prompts: List[str],
+      schema: Type[SchemaType] | Type[ListSchemaType] | None = None,
+  ) -> List[Any]:
+    """Runs the prompts as a single job of the model's `batch_backend`.
+
+    Cached responses are used as they are, and responses from the job are
+    cached.
+    """
+    if not self.batch_backend:
+      raise NotImplementedError(
+          "Batch prediction needs a VertexModel with a batch_backend."
+      )
+    generation_config = (
+        _generation_config(schema)
+        if schema is not None
+        else GenerationConfig(**GENERATION_PARAMS)
+    ).to_dict()
+    responses: List[Any] = [None] * len(prompts)
+    requests = {}
+    for index, prompt in enumerate(prompts):
+      cached_text = None
+      if self.response_cache:
+        cached_text = self.response_cache.get(self._cache_key(prompt, schema))
+      if cached_text is not None:
+        responses[index] = cached_text
+      else:
+        requests[str(index)] = batch_prediction.make_request(
+            prompt, generation_config=generation_config
+        )
+
+    if requests:
+      outputs = await batch_prediction.run_batch(self.batch_backend, requests)
+      metric_labels = {"backend": "vertex_batch", "model": self.model_name}
+      for key, output in outputs.items():
+        index = int(key)
+        if not output.ok:
+          logging.error(f"Batch request {index} failed: {output.error}")
+          responses[index] = InvalidResponseError(output.error)
+          continue
+        metrics.record_llm_tokens(
+            output.input_token_count,
+            output.output_token_count,
+            **metric_labels,
+        )
+        if self.response_cache:
+          self.response_cache.put(
+              self._cache_key(prompts[index], schema), output.text
+          )
+        responses[index] = output.text
+
+    if schema is None:
+      return responses
+    results = []
+    for response in responses:
+      try:
+        results.append(
+            response
+            if isinstance(response, Exception)
+            else self._parse_data(response, schema).value
+        )
+      except ValueError as e:
+        results.append(e)
+    return results
+
+  async def generate_text_batch_timed(
+      self, prompts: Sequence[str]
+  ) -> Tuple[List[str | Exception], List[Optional[float]]]:
+    if self.batch_backend:
+      # Requests of a batch job aren't timed one by one
+      return await self.predict_batch(list(prompts)), [None] * len(prompts)
+    return await super().generate_text_batch_timed(prompts)
+
+  async def generate_data_batch_timed(
+      self,
+      prompts: Sequence[str],
+      schema: Type[SchemaType] | Type[ListSchemaType],
+  ) -> Tuple[
+      List[SchemaType | ListSchemaType | Exception], List[Optional[float]]
+  ]:
+    if self.batch_backend:
+      return (
+          await self.predict_batch(list(prompts), schema),
+          [None] * len(prompts),
+      )
+    return await super().generate_data_batch_timed(prompts, schema)
+
+  def _call_slot(self) -> AsyncContextManager:
+    """Returns a context holding a concurrency slot for one model call."""
+    if self.concurrency_limiter:
+      return self.concurrency_limiter.slot()
+    return contextlib.nullcontext()
+
+  async def _generate_content(
+      self, prompt: str, generation_config: GenerationConfig | None
+  ) -> GenerationResponse:
+    """Makes a single model call, without retries."""
+    # Refreshes an expiring token off the event loop
+    await self.credentials.get_async()
+    return await self._generate_with(
+        self.llm,
+        prompt,
+        generation_config,
+        {"backend": "vertex", "model": self.model_name},
+    )
+
+  async def _generate_with(
+      self,
+      llm: GenerativeModel,
+      prompt: str,
+      generation_config: GenerationConfig | None,
+      metric_labels: Dict[str, str],
+  ) -> GenerationResponse:
+    """Makes a single call to `llm`, hedging it if a hedger is set."""
+
+    async def call_llm_once() -> GenerationResponse:
+      async with self._call_slot():
+        with metrics.track_llm_call(**metric_labels):
+          # A hung connection fails the attempt instead of stalling it
+          return await deadline.call_with_timeout(
+              lambda: llm.generate_content_async(
+                  prompt, generation_config=generation_config
+              ),
+              self.call_timeout_sec,
+          )
+
+    if not self.hedger:
+      return await call_llm_once()
+    return await self.hedger.run(
+        call_llm_once, is_valid=_has_text, **metric_labels
+    )
+
+  def _cache_key(self, prompt: str, response_schema: Any = None) -> str:
+    return ResponseCache.make_key(
+        self.model_name,
+        prompt,
+        response_schema=response_schema,
+        response_mime_type=(
+            JSON_MIME_TYPE if response_schema is not None else None
+        ),
+    )
+
+  async def _call_llm_with_retry(
+      self, prompt: str, response_schema: Any = None
+  ) -> _Response:
+    """Calls the model with retries and returns the response.
+
+    Args:
+      prompt: The prompt to send to the model.
+      response_schema: An optional Pydantic model or type the response must be
+        JSON for. If given, decoding is constrained to its JSON schema.
+    """
+    cache_key = self._cache_key(prompt, response_schema)
+    if self.response_cache:
+      cached_text = self.response_cache.get(cache_key)
+      if cached_text is not None:
+        logging.info("✓ Using cached LLM response")
+        return _Response(cached_text)
+
+    # Concurrent identical calls share a single call and its response
+    return await self._in_flight.run(
+        cache_key,
+        lambda: self._call_llm_uncached(prompt, response_schema, cache_key),
+        backend="vertex",
+        model=self.model_name,
+    )
+
+  async def _call_llm_uncached(
+      self, prompt: str, response_schema: Any, cache_key: str
+  ) -> _Response:
+    """Calls the model with retries, and caches and records the response.
+
+    Responses cut off by the output token limit are neither cached nor
+    recorded.
+    """
+    generation_config = None
+    if response_schema is not None:
+      generation_config = _generation_config(response_schema)
+    metric_labels = {"backend": "vertex", "model": self.model_name}
+
+    # Latency of the last attempt, which is the successful one
+    latency_sec = 0.0
 
     async def call_llm_inner() -> GenerationResponse:
-      return await self.llm.generate_content_async(
-          prompt
-      )  # TODO: pass schema for constraint decoding
+      nonlocal latency_sec
+      start_time = time.perf_counter()
+      try:
+        return await self._generate_content(prompt, generation_config)
+      finally:
+        latency_sec = time.perf_counter() - start_time
 
     def validate_response(response: GenerationResponse | None) -> bool:
       if not response:
         logging.error("Failed to get a model response.")
         return False
 
-      if (
-          not response.candidates
-          or not response.candidates[0].content.parts
-          or not response.candidates[0].content.parts[0].text
-      ):
+      if not _has_text(response):
         logging.error(f"Model returned an incomplete response: {response}")
         return False
 
@@ -148,6 +458,11 @@ class VertexModel(BaseModelClass):
           f" {response.usage_metadata.prompt_token_count} tokens, output:"
           f" {response.usage_metadata.candidates_token_count} tokens)"
       )
+      metrics.record_llm_tokens(
+          response.usage_metadata.prompt_token_count,
+          response.usage_metadata.candidates_token_count,
+          **metric_labels,
+      )
       return True
 
     result = await _retry_call(
@@ -155,9 +470,200 @@ class VertexModel(BaseModelClass):
         validate_response,
         MAX_LLM_RETRIES,
         "Failed to get a valid model response.",
-        RETRY_DELAY_SEC,
+        self.retry_delay_sec,
+        metric_labels=metric_labels,
     )
-    return result.text
+    if result.candidates[0].finish_reason.name == "MAX_TOKENS":
+      logging.warning("The response was truncated at the output token limit.")
+      return _Response(result.text, truncated=True)
+    if self.response_cache:
+      self.response_cache.put(cache_key, result.text)
+    if self.cassette is not None:
+      self.cassette.record_call(
+          prompt,
+          result.text,
+          latency_sec,
+          result.usage_metadata.prompt_token_count,
+          result.usage_metadata.candidates_token_count,
+      )
+    return _Response(result.text)
+
+  async def _stream_llm_with_retry(
+      self, prompt: str, response_schema: Any = None
+  ) -> AsyncIterator[str]:
+    """Streams the response text of a model call, retrying until it starts.
+
+    Failed attempts are retried like `_call_llm_with_retry` until the first
+    chunk arrives. An error after that is raised to the caller, which may have
+    used the chunks yielded so far. Streaming calls aren't hedged.
+
+    Args:
+      prompt: The prompt to send to the model.
+      response_schema: An optional Pydantic model or type the response must be
+        JSON for. If given, decoding is constrained to its JSON schema.
+
+    Yields:
+      The chunks of the response text. A cached response is a single chunk.
+    """
+    generation_config = None
+    cache_key = None
+    if response_schema is not None:
+      generation_config = _generation_config(response_schema)
+    if self.response_cache:
+      cache_key = self._cache_key(prompt, response_schema)
+      cached_text = self.response_cache.get(cache_key)
+      if cached_text is not None:
+        logging.info("✓ Using cached LLM response")
+        yield cached_text
+        return
+
+    metric_labels = {"backend": "vertex", "model": self.model_name}
+    start_time = time.perf_counter()
+
+    async def open_stream() -> streaming.OpenStream:
+      # Refreshes an expiring token off the event loop
+      await self.credentials.get_async()
+      return await streaming.open_stream(
+          lambda: self.llm.generate_content_async(
+              prompt, generation_config=generation_config, stream=True
+          ),
+          self._call_slot(),
+          self.call_timeout_sec,
+          **metric_labels,
+      )
+
+    stream = await _retry_call(
+        open_stream,
+        lambda stream: stream is not None,
+        MAX_LLM_RETRIES,
+        "Failed to start a model response stream.",
+        self.retry_delay_sec,
+        metric_labels=metric_labels,
+    )
+    texts = []
+    last_chunk = None
+    finish_reason = None
+    async with contextlib.aclosing(aiter(stream)) as chunks:
+      async for chunk in chunks:
+        last_chunk = chunk
+        block_reason = getattr(chunk.prompt_feedback, "block_reason", None)
+        if block_reason:
+          raise ResponseBlockedError(f"Prompt blocked: {block_reason.name}")
+        if chunk.candidates and chunk.candidates[0].finish_reason:
+          # Only the last chunk of a response has a finish reason
+          finish_reason = chunk.candidates[0].finish_reason.name
+          if finish_reason in BLOCKED_FINISH_REASONS:
+            raise ResponseBlockedError(f"Response blocked: {finish_reason}")
+        text = _chunk_text(chunk)
+        if text:
+          texts.append(text)
+          yield text
+
+    # Usage is reported with the last chunk
+    usage = last_chunk.usage_metadata if last_chunk is not None else None
+    if not usage:
+      return
+    metrics.record_llm_tokens(
+        usage.prompt_token_count, usage.candidates_token_count, **metric_labels
+    )
+    if finish_reason != "STOP":
+      # E.g. truncated at the output token limit, which isn't worth keeping
+      logging.warning(
+          f"The model stopped streaming for a reason: '{finish_reason}'. Not"
+          " caching the response."
+      )
+      return
+    response_text = "".join(texts)
+    if self.response_cache:
+      self.response_cache.put(cache_key, response_text)
+    if self.cassette is not None:
+      self.cassette.record_call(
+          prompt,
+          response_text,
+          time.perf_counter() - start_time,
+          usage.prompt_token_count,
+          usage.candidates_token_count,
+      )
+
+
+def _chunk_text(chunk: GenerationResponse) -> str:
+  if not chunk.candidates or not chunk.candidates[0].content.parts:
+    return ""
+  return chunk.candidates[0].content.parts[0].text
+
+
+def _has_text(response: GenerationResponse) -> bool:
+  return bool(
+      response.candidates
+      and response.candidates[0].content.parts
+      and response.candidates[0].content.parts[0].text
+  )
+
+
+@functools.lru_cache(maxsize=None)
+def _type_adapter(schema: Any) -> TypeAdapter:
+  """Returns the TypeAdapter of a schema, building it only once."""
+  return TypeAdapter(schema)
+
+
+@functools.lru_cache(maxsize=None)
+def _generation_config(schema: Any) -> GenerationConfig:
+  """Returns the config constraining decoding to JSON matching `schema`.
+
+  Falls back to unconstrained JSON output if the schema can't be expressed as
+  a response schema, e.g. because it is recursive.
+  """
+  try:
+    return GenerationConfig(
+        **GENERATION_PARAMS,
+        response_mime_type=JSON_MIME_TYPE,
+        response_schema=_to_response_schema(
+            _type_adapter(schema).json_schema()
+        ),
+    )
+  except Exception as e:  # The SDK raises various errors on bad schemas
+    logging.warning(f"Can't constrain decoding to schema {schema}: {e}")
+    return GenerationConfig(
+        **GENERATION_PARAMS, response_mime_type=JSON_MIME_TYPE
+    )
+
+
+def _to_response_schema(json_schema: Dict[str, Any]) -> Dict[str, Any]:
+  """Converts a Pydantic JSON schema to the subset response schemas support.
+
+  Pydantic puts nested models in `$defs` and marks optional fields with an
+  `anyOf` including null, so `$ref`s are replaced by their definitions and
+  null options become `nullable`.
+  """
+  definitions = json_schema.get("$defs", {})
+
+  def convert(node: Any, seen: tuple = ()) -> Any:
+    if isinstance(node, list):
+      return [convert(item, seen) for item in node]
+    if not isinstance(node, dict):
+      return node
+    if "$ref" in node:
+      name = node["$ref"].split("/")[-1]
+      if name in seen:
+        raise ValueError(f"Schema definition {name} is recursive.")
+      return convert(copy.deepcopy(definitions[name]), seen + (name,))
+    node = {key: value for key, value in node.items() if key != "$defs"}
+    if "anyOf" in node:
+      options = [
+          option for option in node["anyOf"] if option.get("type") != "null"
+      ]
+      if len(options) < len(node["anyOf"]):
+        node["nullable"] = True
+      if len(options) == 1:
+        del node["anyOf"]
+        node = {**options[0], **node}
+      else:
+        node["anyOf"] = options
+    if "const" in node:
+      node["enum"] = [node.pop("const")]
+    return {key: convert(value, seen) for key, value in node.items()}
+
+  return convert(json_schema)
 
 
 async def _retry_call(
@@ -168,12 +674,19 @@ async def _retry_call(
     retry_delay_sec: float,
     func_args: List[Any] | None = None,
     validator_args: List[Any] | None = None,
+    metric_labels: Dict[str, str] | None = None,
 ):
   func_args = func_args or []
   validator_args = validator_args or []
-  backoff_growth_rate = 2.5  # Controls how quickly delay increases b/w retries
+  metric_labels = metric_labels or {}
+  policy = RetryPolicy(max_attempts=max_retries, base_delay_sec=retry_delay_sec)
+  delay = None
+  attempt = 0
+  error = None
 
   for attempt in range(1, max_retries + 1):
+    policy.record_attempt(attempt)
+    error = None
     try:
       response = await func(*func_args)
 
@@ -181,60 +694,75 @@ async def _retry_call(
         return response
 
       logging.error(f"Attempt {attempt} failed. Invalid response: {response}")
-    except Exception as error:
-      if "exceeds the maximum number of tokens allowed" in str(error):
-        logging.warning("Input token limit exceeded. Not retrying.")
-        raise TokenLimitExceededError(error) from error
+    except Exception as e:
+      error = e
       logging.error(f"Attempt {attempt} failed: {error}")
 
-    # Exponential backoff calculation
-    delay = retry_delay_sec * (backoff_growth_rate ** (attempt - 1))
-    logging.info(f"Retrying in {delay} seconds (attempt {attempt})")
+    error_class = classify_error(error)
+    delay = policy.next_delay(error, attempt, delay)
+    if delay is None:
+      metrics.LLM_FAILURES.inc(error_class=error_class.value, **metric_labels)
+      if is_token_limit_error(error):
+        logging.warning("Input token limit exceeded. Not retrying.")
+        raise TokenLimitExceededError(error) from error
+      break
+    metrics.LLM_RETRIES.inc(error_class=error_class.value, **metric_labels)
+    logging.info(f"Retrying in {delay:.1f} seconds (attempt {attempt})")
     await asyncio.sleep(delay)
 
-  raise Exception(f"Failed after {max_retries} attempts: {error_message}")
+  raise Exception(
+      f"Failed after {attempt} attempts: {error_message}"
+  ) from error
 
 
 async def run_tasks_in_parallel(
     items: List[Any],
     func: Callable,  # func should be an async function: async def func(item, *args, **kwargs)
-    limit: int = DEFAULT_VERTEX_PARALLELISM,
+    limit: int | AdaptiveConcurrencyLimiter = DEFAULT_VERTEX_PARALLELISM,
     *args: Any,
+    journal: JobJournal | None = None,
     **kwargs: Any,
 ) -> List[Any]:
-  semaphore = asyncio.Semaphore(limit)  # Controls concurrency
-
-  async def limited_task(item: Any) -> Any:
-    async with semaphore:
-      return await func(item, *args, **kwargs)
-
+  """Runs `func` on all items with at most `limit` tasks running at once.
+
+  Returns the results in input order, and raises the first exception in input
+  order if any task fails. For large or lazily produced inputs, or to keep the
+  results of the tasks that succeeded, use `executor.stream_tasks` instead.
+
+  `limit` can also be an adaptive limiter, in which case each task holds one of
+  its slots and the task outcomes adapt the limit. Don't pass a limiter that the
+  model called by `func` already waits for, as each task would then need two
+  slots of the same limiter.
+
+  If a `journal` is given, each result is recorded as soon as its task
+  completes, and items already recorded by a previous run with the same `func`,
+  `args` and `kwargs` are returned from the journal without calling `func`
+  again. Results must then be JSON-serializable, and items and arguments must
+  have a stable representation, see `model_util.fingerprint`; other items fail
+  with a TypeError.
+  """
   if items:
+    max_tasks = (
+        f"{limit.limit} (adaptive)"
+        if isinstance(limit, AdaptiveConcurrencyLimiter)
+        else limit
+    )
     logging.info(
-        f"Running up to {limit} tasks in parallel for a total of"
+        f"Running up to {max_tasks} tasks in parallel for a total of"
         f" {len(items)} tasks..."
     )
+    if journal is not None:
+      logging.info(
+          f"Journal holds {len(journal)} completed jobs to resume from."
+      )
 
-  tasks = [limited_task(item) for item in items]
-  results = await asyncio.gather(
-      *tasks, return_exceptions=False
-  )  # Set return_exceptions=True to debug individual task failures
-  return results
-
-
-def custom_pool_creds():
-  # By default, GCP uses connection pool of size 10, we need to override it to support higher concurrency.
-  # Create a session that holds up to 100 connections using a custom adaptor
-  session = requests.Session()
-  adapter = HTTPAdapter(
-      pool_connections=DEFAULT_VERTEX_PARALLELISM,  # number of connection pools to cache
-      pool_maxsize=DEFAULT_VERTEX_PARALLELISM,  # max connections per pool
-      max_retries=MAX_RETRIES,
-      pool_block=True,  # block when no free connections
+  results = []
+  outcomes = executor.stream_tasks(
+      items, func, *args, limit=limit, journal=journal, **kwargs
   )
-  session.mount("https://", adapter)
-  # Build a google‑auth request using that session
-  auth_request = AuthRequest(session=session)
-  # Retrieve app-default creds and refresh them with the new settings
-  creds, _ = google.auth.default()
-  creds.refresh(auth_request)  # primes the pool
-  return creds
+  async with contextlib.aclosing(outcomes):
+    async for outcome in outcomes:
+      if isinstance(outcome, executor.Error):
+        raise outcome.error
+      results.append(outcome.value)
+  return results
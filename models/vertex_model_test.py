@@ -12,10 +12,59 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import os
+import tempfile
+from typing import List, Optional
 import unittest
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 
 from models import vertex_model
+from models.concurrency import AdaptiveConcurrencyLimiter
+from models.credentials import SharedCredentials
+from models.job_journal import JobJournal
+from models.response_cache import ResponseCache
+from models.retry_policy import InvalidResponseError, ResponseBlockedError
+import pydantic
+from vertexai.generative_models import GenerationResponse
+
+
+class _Claim(pydantic.BaseModel):
+  text: str
+  score: Optional[float] = None
+
+
+class _Topic(pydantic.BaseModel):
+  name: str
+  claims: List[_Claim]
+
+
+def _make_vertex_model(**kwargs) -> vertex_model.VertexModel:
+  model = vertex_model.VertexModel(
+      "project",
+      "location",
+      "model",
+      credentials=MagicMock(spec=SharedCredentials),
+      **kwargs,
+  )
+  model.llm = MagicMock()
+  return model
+
+
+def _make_response(
+    text: str, finish_reason: str = "STOP"
+) -> GenerationResponse:
+  return GenerationResponse.from_dict({
+      "candidates": [{
+          "content": {"role": "model", "parts": [{"text": text}]},
+          "finish_reason": finish_reason,
+      }],
+      "usage_metadata": {
+          "prompt_token_count": 10,
+          "candidates_token_count": 5,
+          "total_token_count": 15,
+      },
+  })
 
 
 class VertexModelTest(unittest.IsolatedAsyncioTestCase):
@@ -34,6 +83,346 @@ class VertexModelTest(unittest.IsolatedAsyncioTestCase):
     )
     self.assertEqual(mock_func.call_count, 1)
 
+  def test_max_input_tokens_defaults_to_limit_of_known_models(self):
+    def make_model(model_name, **kwargs):
+      return vertex_model.VertexModel(
+          "project",
+          "location",
+          model_name,
+          credentials=MagicMock(spec=SharedCredentials),
+          **kwargs,
+      )
+
+    self.assertEqual(make_model("gemini-1.5-pro-002").max_input_tokens, 2097152)
+    self.assertEqual(make_model("gemini-2.5-flash").max_input_tokens, 1048576)
+    self.assertIsNone(make_model("custom-model").max_input_tokens)
+    self.assertEqual(
+        make_model("gemini-2.5-flash", max_input_tokens=1000).max_input_tokens,
+        1000,
+    )
+
+  async def test_generate_text_uses_response_cache(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cache = ResponseCache(os.path.join(temp_dir, "cache.sqlite"))
+      model = _make_vertex_model(response_cache=cache)
+      model.llm.generate_content_async = AsyncMock(
+          return_value=_make_response("cached text")
+      )
+
+      self.assertEqual(await model.generate_text("prompt"), "cached text")
+      self.assertEqual(await model.generate_text("prompt"), "cached text")
+
+      self.assertEqual(model.llm.generate_content_async.call_count, 1)
+      self.assertEqual(cache.stats()["hits"], 1)
+      cache.close()
+
+  async def test_cached_response_needs_no_client(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cache = ResponseCache(os.path.join(temp_dir, "cache.sqlite"))
+      cache.put(ResponseCache.make_key("model", "prompt"), "cached text")
+      credentials = MagicMock(spec=SharedCredentials)
+      with patch.object(vertex_model, "vertexai") as vertexai:
+        model = vertex_model.VertexModel(
+            "project",
+            "location",
+            "model",
+            response_cache=cache,
+            credentials=credentials,
+        )
+
+        self.assertEqual(await model.generate_text("prompt"), "cached text")
+
+      vertexai.init.assert_not_called()
+      credentials.get.assert_not_called()
+      cache.close()
+
+  async def test_concurrent_identical_calls_share_one_model_call(self):
+    model = _make_vertex_model()
+
+    async def respond(prompt, generation_config=None):
+      await asyncio.sleep(0.01)
+      return _make_response(f"response to {prompt}")
+
+    model.llm.generate_content_async = AsyncMock(side_effect=respond)
+
+    results = await asyncio.gather(
+        model.generate_text("a"),
+        model.generate_text("a"),
+        model.generate_text("b"),
+    )
+
+    self.assertEqual(
+        results, ["response to a", "response to a", "response to b"]
+    )
+    self.assertEqual(model.llm.generate_content_async.call_count, 2)
+
+  async def test_hung_call_times_out_and_is_retried(self):
+    model = _make_vertex_model()
+    model.call_timeout_sec = 0.01
+    model.retry_delay_sec = 0
+
+    async def respond(prompt, generation_config=None):
+      if model.llm.generate_content_async.call_count == 1:
+        # The first call hangs
+        await asyncio.sleep(3600)
+      return _make_response("text")
+
+    model.llm.generate_content_async = AsyncMock(side_effect=respond)
+
+    self.assertEqual(await model.generate_text("prompt"), "text")
+    self.assertEqual(model.llm.generate_content_async.call_count, 2)
+
+  async def test_run_tasks_in_parallel_resumes_from_journal(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      journal_path = os.path.join(temp_dir, "journal.jsonl")
+
+      async def fail_on_three(item):
+        if item == 3:
+          raise ValueError("Task failed")
+        return item * 2
+
+      journal = JobJournal(journal_path)
+      with self.assertRaises(ValueError):
+        await vertex_model.run_tasks_in_parallel(
+            [1, 2, 3], fail_on_three, journal=journal
+        )
+      journal.close()
+
+      calls = []
+
+      async def fail_on_three(item):
+        calls.append(item)
+        return item * 2
+
+      journal = JobJournal(journal_path)
+      results = await vertex_model.run_tasks_in_parallel(
+          [1, 2, 3], fail_on_three, journal=journal
+      )
+      journal.close()
+
+      self.assertEqual(results, [2, 4, 6])
+      self.assertEqual(calls, [3])
+
+  async def test_generate_text_throttling_reduces_concurrency_limit(self):
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=8)
+    model = _make_vertex_model(concurrency_limiter=limiter)
+    model.llm.generate_content_async = AsyncMock(
+        side_effect=[
+            Exception("429 Resource exhausted"),
+            _make_response("text"),
+        ]
+    )
+
+    with patch.object(vertex_model.asyncio, "sleep", AsyncMock()):
+      self.assertEqual(await model.generate_text("prompt"), "text")
+
+    self.assertEqual(limiter.limit, 4)
+    self.assertEqual(limiter.in_flight, 0)
+
+  async def test_generate_data_constrains_decoding_to_schema(self):
+    model = _make_vertex_model()
+    model.llm.generate_content_async = AsyncMock(
+        return_value=_make_response(
+            '[{"name": "Parks", "claims": [{"text": "More trees"}]}]'
+        )
+    )
+
+    topics = await model.generate_data("prompt", List[_Topic])
+
+    self.assertEqual(topics[0].claims[0].text, "More trees")
+    config = model.llm.generate_content_async.call_args.kwargs[
+        "generation_config"
+    ].to_dict()
+    self.assertEqual(config["response_mime_type"], "application/json")
+    claim_schema = config["response_schema"]["items"]["properties"]["claims"]
+    self.assertEqual(
+        claim_schema["items"]["properties"]["score"]["type"], "NUMBER"
+    )
+    self.assertTrue(claim_schema["items"]["properties"]["score"]["nullable"])
+    self.assertIs(
+        vertex_model._type_adapter(List[_Topic]),
+        vertex_model._type_adapter(List[_Topic]),
+    )
+
+  async def test_generate_text_does_not_constrain_decoding(self):
+    model = _make_vertex_model()
+    model.llm.generate_content_async = AsyncMock(
+        return_value=_make_response("text")
+    )
+
+    await model.generate_text("prompt")
+
+    self.assertIsNone(
+        model.llm.generate_content_async.call_args.kwargs["generation_config"]
+    )
+
+  async def test_generate_data_batch_calls_once_per_distinct_prompt(self):
+    model = _make_vertex_model()
+
+    async def respond(prompt, generation_config=None):
+      if prompt == "bad":
+        return _make_response("not json")
+      return _make_response(f'{{"name": "{prompt}", "claims": []}}')
+
+    model.llm.generate_content_async = AsyncMock(side_effect=respond)
+
+    results, runtimes_sec = await model.generate_data_batch_timed(
+        ["a", "bad", "a", "b"], _Topic
+    )
+
+    self.assertEqual(
+        [result.name for result in results if isinstance(result, _Topic)],
+        ["a", "a", "b"],
+    )
+    self.assertIsInstance(results[1], ValueError)
+    self.assertEqual(model.llm.generate_content_async.call_count, 3)
+    self.assertEqual(len(runtimes_sec), 4)
+    self.assertTrue(all(runtime_sec >= 0 for runtime_sec in runtimes_sec))
+    self.assertEqual(runtimes_sec[0], runtimes_sec[2])
+
+  async def test_generate_data_closes_only_truncated_responses(self):
+    response_cache = MagicMock()
+    response_cache.get.return_value = None
+    model = _make_vertex_model(response_cache=response_cache)
+    model.retry_delay_sec = 0
+    text = '[{"text": "a"}, {"text": "b"}, {"te'
+    model.llm.generate_content_async = AsyncMock(
+        return_value=_make_response(text, finish_reason="MAX_TOKENS")
+    )
+
+    claims = await model.generate_data("prompt", List[_Claim])
+
+    self.assertEqual([claim.text for claim in claims], ["a", "b"])
+    response_cache.put.assert_not_called()
+    model.llm.generate_content_async.return_value = _make_response(text)
+    with self.assertRaises(ValueError):
+      await model.generate_data("other prompt", List[_Claim])
+
+  async def test_generate_data_drops_invalid_items_only_if_asked(self):
+    model = _make_vertex_model()
+    model.llm.generate_content_async = AsyncMock(
+        return_value=_make_response('[{"text": "a"}, {"text": 5}]')
+    )
+
+    with self.assertRaises(ValueError):
+      await model.generate_data("prompt", List[_Claim])
+    claims = await model.generate_data(
+        "prompt", List[_Claim], drop_invalid_items=True
+    )
+
+    self.assertEqual([claim.text for claim in claims], ["a"])
+
+  async def test_generate_text_batch_runs_batch_job_with_backend(self):
+    model = _make_vertex_model(batch_backend=MagicMock())
+    model.predict_batch = AsyncMock(return_value=["a", "b"])
+
+    results = await model.generate_text_batch(["prompt a", "prompt b"])
+
+    self.assertEqual(results, ["a", "b"])
+    model.predict_batch.assert_awaited_once_with(["prompt a", "prompt b"])
+    model.llm.generate_content_async.assert_not_called()
+
+  async def test_generate_data_stream_yields_items_and_caches_response(self):
+    with tempfile.TemporaryDirectory() as temp_dir:
+      cache = ResponseCache(os.path.join(temp_dir, "cache.sqlite"))
+      model = _make_vertex_model(response_cache=cache)
+      chunks = [
+          '[{"name": "Parks", "claims": []},',
+          ' {"name": "Roads", "c',
+          'laims": []}]',
+      ]
+
+      async def stream():
+        for chunk in chunks:
+          yield _make_response(chunk)
+
+      model.llm.generate_content_async = AsyncMock(
+          side_effect=[Exception("503 Service Unavailable"), stream()]
+      )
+      model.retry_delay_sec = 0
+
+      items = model.generate_data_stream("prompt", List[_Topic])
+      first_item = await anext(items)
+      # The first item arrives before the response is complete
+      self.assertEqual(first_item.name, "Parks")
+      self.assertEqual([item.name async for item in items], ["Roads"])
+      cached = [
+          item.name
+          async for item in model.generate_data_stream("prompt", List[_Topic])
+      ]
+      cache.close()
+
+    self.assertEqual(cached, ["Parks", "Roads"])
+    self.assertEqual(model.llm.generate_content_async.call_count, 2)
+    self.assertTrue(model.llm.generate_content_async.call_args.kwargs["stream"])
+
+  async def test_truncated_stream_is_not_cached_or_recorded(self):
+    response_cache = MagicMock()
+    response_cache.get.return_value = None
+    cassette = MagicMock()
+    model = _make_vertex_model(response_cache=response_cache, cassette=cassette)
+
+    async def stream():
+      yield _make_response("[1, ", finish_reason="FINISH_REASON_UNSPECIFIED")
+      yield _make_response("2", finish_reason="MAX_TOKENS")
+
+    model.llm.generate_content_async = AsyncMock(return_value=stream())
+
+    chunks = [chunk async for chunk in model.generate_text_stream("prompt")]
+
+    self.assertEqual(chunks, ["[1, ", "2"])
+    response_cache.put.assert_not_called()
+    cassette.record_call.assert_not_called()
+
+  async def test_empty_stream_fails_to_start(self):
+    model = _make_vertex_model()
+    model.retry_delay_sec = 0
+
+    async def stream():
+      return
+      yield
+
+    model.llm.generate_content_async = AsyncMock(
+        side_effect=lambda *args, **kwargs: stream()
+    )
+
+    with self.assertRaisesRegex(Exception, "Failed to start") as context:
+      async for _ in model.generate_text_stream("prompt"):
+        pass
+    self.assertIsInstance(context.exception.__cause__, InvalidResponseError)
+
+  async def test_stream_without_usage_metadata_is_not_cached(self):
+    response_cache = MagicMock()
+    response_cache.get.return_value = None
+    model = _make_vertex_model(response_cache=response_cache)
+
+    async def stream():
+      yield GenerationResponse.from_dict({
+          "candidates": [{
+              "content": {"role": "model", "parts": [{"text": "text"}]},
+              "finish_reason": "STOP",
+          }]
+      })
+
+    model.llm.generate_content_async = AsyncMock(return_value=stream())
+
+    chunks = [chunk async for chunk in model.generate_text_stream("prompt")]
+
+    self.assertEqual(chunks, ["text"])
+    response_cache.put.assert_not_called()
+
+  async def test_blocked_stream_raises(self):
+    model = _make_vertex_model()
+
+    async def stream():
+      yield _make_response("", finish_reason="SAFETY")
+
+    model.llm.generate_content_async = AsyncMock(return_value=stream())
+
+    with self.assertRaises(ResponseBlockedError):
+      async for _ in model.generate_text_stream("prompt"):
+        pass
+
 
 if __name__ == "__main__":
   unittest.main()